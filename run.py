@@ -1,30 +1,35 @@
 import sys
 import os
-from src.cmds.download import run_download
-from src.cmds.unload import run_unload 
-from src.cmds.reload import run_reload 
-from src.cmds.list import run_list
-from src.cmds.edit import run_edit 
-from src.utils.generic import (clear_terminal, 
-                               log_into_huggingface)
+from importlib import import_module
 from dotenv import load_dotenv
 
-# Load environment variables from .env file
+# Load environment variables from .env file, once, before any command module
+# is imported, the modules read their settings from the environment
 load_dotenv()
 hf_token = os.getenv("HF_TOKEN")
 civitai_api_key = os.getenv("CIVITAI_API_KEY")
 db_filepath = os.getenv("MODEL_INFO_FILE")
 storage_root_dir = os.environ.get("MODEL_STORAGE_DIR")
 
-## map of the commands available to cozy manager
+## map of the commands available to cozy manager, as "module:function".
+## only the module of the command that is run gets imported, so e.g.
+## `cozy list` never pays for importing huggingface_hub or requests
 cmd_map = {
-    "download": run_download,
-    "unload": run_unload,
-    "reload": run_reload,
-    "list": run_list,
-    "edit": run_edit
+    "download": "src.cmds.download:run_download",
+    "unload": "src.cmds.unload:run_unload",
+    "reload": "src.cmds.reload:run_reload",
+    "list": "src.cmds.list:run_list",
+    "edit": "src.cmds.edit:run_edit",
+    "migrate": "src.cmds.migrate:run_migrate",
+    "refresh-metadata": "src.cmds.refresh_metadata:run_refresh_metadata",
+    "serve": "src.cmds.serve:run_serve",
+    "export": "src.cmds.bundle:run_export",
+    "import": "src.cmds.bundle:run_import"
 }
 
+## the commands that download from huggingface, and need us to be logged in
+hf_cmds = ("download", "reload")
+
 def validate_installation():
     if not db_filepath:
         print_error_env_var_missing("MODEL_INFO_FILE")
@@ -40,11 +45,10 @@ def validate_installation():
     if not civitai_api_key:
         print_warning_user_about_missing_env_vars("CIVITAI_API_KEY")
 
-    log_into_huggingface()
-
 
 
 def print_error_env_var_missing(var_name):
+    from src.utils.generic import clear_terminal
     clear_terminal()
     print('-' * 80)
     print(f"--- Missing '{var_name}' environment variable")
@@ -74,7 +78,13 @@ def get_cozy_command():
         print(f"--- {', '.join(cmd_map.keys())}")
         sys.exit(1)
 
-    cmd_handle = cmd_map[cmd]
+    if cmd in hf_cmds:
+        from src.utils.generic import log_into_huggingface
+        log_into_huggingface()
+
+    ## only now import the module of the command we are about to run
+    module_name, func_name = cmd_map[cmd].split(":")
+    cmd_handle = getattr(import_module(module_name), func_name)
 
     ## now return the actual command handle
     return cmd_handle
@@ -6,8 +6,6 @@ setup(
     packages=find_packages(),
     install_requires=[
         "huggingface_hub",
-        "wget",
-        "civitdl",
         "requests",
         "bs4",
         "python-dotenv",
@@ -0,0 +1,253 @@
+import io
+import os
+import sys
+import contextlib
+import json
+import time
+import tarfile
+import hashlib
+from src.utils.args import (get_export_args,
+                            get_import_args)
+from src.utils.generic import (sanitize_and_validate_arg_input,
+                               get_part_path,
+                               format_size)
+from src.utils.db import (load_collection,
+                          db_transaction)
+from src.utils.store_index import (build_store_index,
+                                   load_store_index,
+                                   get_safe_rel_path)
+from src.utils.blobs import (is_blob_store_enabled,
+                             store_as_blob)
+from src.utils.collection import matches_filters
+
+storage_root_dir = os.getenv("MODEL_STORAGE_DIR")
+
+## the first member of every bundle, the files follow under files/<type>/<base>/<filename>
+BUNDLE_INDEX_NAME = 'cozy-bundle.json'
+BUNDLE_FILES_DIR = 'files'
+## big sequential reads and writes, the bundles live on volumes and in object stores
+BLOCK_SIZE = 8 * 1024 * 1024
+
+
+def run_export():
+    """ Main entry point for writing (part of) the collection and its files into a bundle """
+    args = get_export_args()
+
+    export_model_type = None
+    export_model_base = None
+    if args.model_type:
+        export_model_type = sanitize_and_validate_arg_input(args.model_type, 'model_type_names')
+    if args.model_base:
+        export_model_base = sanitize_and_validate_arg_input(args.model_base, 'model_base_names')
+
+    collection = load_collection()
+    entries = [entry for entry in collection
+               if matches_filters(entry, args.tag, export_model_type, export_model_base)]
+    index = build_store_index(entries, include_entries=True)
+    num_missing = len(entries) - len(index['entries'])
+    if num_missing:
+        print(f"--- skipping {num_missing} models that are not stored locally", file=sys.stderr)
+
+    start = time.monotonic()
+    num_bytes = write_bundle(index, args.bundle)
+    elapsed = time.monotonic() - start
+    ## the bundle itself may be going to stdout, so the report goes to stderr
+    print(f"--- exported {len(index['entries'])} models ({format_size(num_bytes)}) in {elapsed:.1f}s", file=sys.stderr)
+
+def write_bundle(index, bundle_path):
+    """ streams the index and then every file into an uncompressed tar, '-' is stdout.
+    returns the number of file bytes written
+    """
+    if bundle_path == '-':
+        fileobj = sys.stdout.buffer
+        ## anything else printed along the way must not end up in the middle of the tar
+        redirect = contextlib.redirect_stdout(sys.stderr)
+    else:
+        fileobj = open(bundle_path, 'wb')
+        redirect = contextlib.nullcontext()
+    num_bytes = 0
+    try:
+        with redirect, tarfile.open(fileobj=fileobj, mode='w|', bufsize=BLOCK_SIZE) as tar:
+            tar.copybufsize = BLOCK_SIZE
+            body = json.dumps(index, indent=1).encode('utf-8')
+            tarinfo = tarfile.TarInfo(BUNDLE_INDEX_NAME)
+            tarinfo.size = len(body)
+            tarinfo.mtime = int(time.time())
+            tar.addfile(tarinfo, io.BytesIO(body))
+
+            for rel_path in iter_index_files(index):
+                filepath = os.path.join(storage_root_dir, rel_path)
+                with open(filepath, 'rb') as f:
+                    st = os.fstat(f.fileno())
+                    tarinfo = tarfile.TarInfo(f"{BUNDLE_FILES_DIR}/{rel_path}")
+                    tarinfo.size = st.st_size
+                    tarinfo.mtime = int(st.st_mtime)
+                    tarinfo.mode = 0o644
+                    tar.addfile(tarinfo, f)
+                num_bytes += st.st_size
+    finally:
+        if bundle_path == '-':
+            fileobj.flush()
+        else:
+            fileobj.close()
+    return num_bytes
+
+def iter_index_files(index):
+    """ the relative path of every file in the index, directories expanded """
+    for index_entry in index['entries']:
+        if index_entry.get('files') is None:
+            yield index_entry['path']
+            continue
+        for rel_path, size in index_entry['files']:
+            yield os.path.join(index_entry['path'], rel_path)
+
+
+def run_import():
+    """ Main entry point for unpacking a bundle into the storage dir and the collection """
+    args = get_import_args()
+
+    start = time.monotonic()
+    index, imported, skipped, failed = read_bundle(args.bundle, verify=args.checksum)
+    merged = merge_bundle_entries(index, failed)
+    elapsed = time.monotonic() - start
+
+    print('-' * 80)
+    print(f"--- imported {imported[0]} files ({format_size(imported[1])}), "
+          f"{skipped[0]} already there ({format_size(skipped[1])}), {len(failed)} failed in {elapsed:.1f}s")
+    print(f"--- added {merged[0]} new entries to the collection, updated {merged[1]}")
+    for rel_path, error in failed.items():
+        print(f"--- failed: {rel_path} :: {error}")
+    print('-' * 80)
+
+def read_bundle(bundle_path, verify=False):
+    """ streams the files of the bundle into MODEL_STORAGE_DIR in one pass, '-' is stdin.
+    returns (index, [count, bytes] imported, [count, bytes] skipped, {rel_path: error})
+    """
+    fileobj = sys.stdin.buffer if bundle_path == '-' else open(bundle_path, 'rb')
+    index = None
+    digests = {}
+    imported = [0, 0]
+    skipped = [0, 0]
+    failed = {}
+    try:
+        with tarfile.open(fileobj=fileobj, mode='r|', bufsize=BLOCK_SIZE) as tar:
+            for member in tar:
+                if index is None:
+                    index = read_bundle_index(tar, member)
+                    digests = {index_entry['path']: index_entry.get('sha256')
+                               for index_entry in index.entries if index_entry.get('files') is None}
+                    continue
+                rel_path = get_member_rel_path(member)
+                if rel_path is None:
+                    print(f"--- warning:: skipping unexpected bundle member: {member.name}")
+                    continue
+
+                filepath = os.path.join(storage_root_dir, rel_path)
+                sha256 = digests.get(rel_path)
+                if is_same_file(filepath, member, sha256 if verify else None):
+                    skipped[0] += 1
+                    skipped[1] += member.size
+                    continue
+                try:
+                    extract_member(tar, member, filepath, sha256)
+                except (OSError, ValueError) as e:
+                    failed[rel_path] = e
+                    continue
+                imported[0] += 1
+                imported[1] += member.size
+    finally:
+        if bundle_path != '-':
+            fileobj.close()
+    if index is None:
+        raise ValueError(f"{bundle_path} is not a cozy bundle, it has no {BUNDLE_INDEX_NAME}")
+    return index, imported, skipped, failed
+
+def read_bundle_index(tar, member):
+    if member.name != BUNDLE_INDEX_NAME:
+        raise ValueError(f"not a cozy bundle, expected {BUNDLE_INDEX_NAME} first, got {member.name}")
+    return load_store_index(json.load(tar.extractfile(member)))
+
+def get_member_rel_path(member):
+    """ files/<rel_path> -> rel_path, None for anything else or anything that would escape the storage dir """
+    if not member.isfile() or not member.name.startswith(f"{BUNDLE_FILES_DIR}/"):
+        return None
+    return get_safe_rel_path(member.name[len(BUNDLE_FILES_DIR) + 1:])
+
+def is_same_file(filepath, member, sha256=None):
+    """ same size and mtime (what rsync checks by default), and the same digest if we verify """
+    try:
+        st = os.stat(filepath)
+    except OSError:
+        return False
+    if st.st_size != member.size or int(st.st_mtime) != int(member.mtime):
+        return False
+    if sha256:
+        with open(filepath, 'rb') as f:
+            return hash_fileobj(f) == sha256.lower()
+    return True
+
+def extract_member(tar, member, filepath, sha256=None):
+    """ writes the member through a .part file, checking its digest on the way """
+    os.makedirs(os.path.dirname(filepath), exist_ok=True)
+    part_path = get_part_path(filepath)
+    source = tar.extractfile(member)
+    hasher = hashlib.sha256()
+    with open(part_path, 'wb') as f:
+        while True:
+            chunk = source.read(BLOCK_SIZE)
+            if not chunk:
+                break
+            hasher.update(chunk)
+            f.write(chunk)
+        f.flush()
+        os.fsync(f.fileno())
+    if sha256 and hasher.hexdigest() != sha256.lower():
+        os.remove(part_path)
+        raise ValueError(f"sha256 mismatch: expected {sha256}, got {hasher.hexdigest()}")
+    os.utime(part_path, (member.mtime, member.mtime))
+    os.replace(part_path, filepath)
+    if sha256 and is_blob_store_enabled():
+        store_as_blob(filepath, sha256)
+
+def merge_bundle_entries(index, failed):
+    """ adds the entries of the bundle we don't know yet in one transaction, and fills in
+    the digest and size of the ones we do. returns (created, updated)
+    """
+    collection = load_collection()
+    collection.index_urls()
+    failed_paths = set(failed)
+    created = 0
+    updated = 0
+    with db_transaction() as txn:
+        for index_entry in index.entries:
+            entry_data = dict(index_entry.get('entry') or {})
+            if not entry_data or has_failed_files(index_entry, failed_paths):
+                continue
+            existing = collection.find_by_url(entry_data.get('url'))
+            if existing is None:
+                txn.create(entry_data)
+                created += 1
+                continue
+            changed = False
+            for field in ('sha256', 'file_size_mb'):
+                if not existing.get(field) and entry_data.get(field):
+                    txn.update(existing.id, field, entry_data[field])
+                    changed = True
+            updated += changed
+    return created, updated
+
+def has_failed_files(index_entry, failed_paths):
+    if index_entry.get('files') is None:
+        return index_entry['path'] in failed_paths
+    return any(os.path.join(index_entry['path'], rel_path) in failed_paths
+               for rel_path, size in index_entry['files'])
+
+def hash_fileobj(f):
+    hasher = hashlib.sha256()
+    while True:
+        chunk = f.read(BLOCK_SIZE)
+        if not chunk:
+            break
+        hasher.update(chunk)
+    return hasher.hexdigest()
+
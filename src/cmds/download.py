@@ -1,10 +1,20 @@
 import os
+import threading
+from concurrent.futures import ThreadPoolExecutor
 from src.utils.args import get_download_args
-from src.utils.generic import sanitize_and_validate_arg_input
-from src.main import check_and_download_file
+from src.utils.generic import (sanitize_and_validate_arg_input,
+                               get_absolute_model_filepath,
+                               get_size_of_path)
+from src.main import (check_and_download_file,
+                      fetch_model_file,
+                      is_download_complete)
 from src.utils.metadata import get_model_info
-from dotenv import load_dotenv
-load_dotenv()
+from src.utils.urls import normalize_url
+from src.utils.info import build_download_info
+from src.utils.db import (load_collection,
+                          db_transaction)
+from src.utils.pool import (DownloadTask,
+                            run_download_tasks)
 
 storage_root_dir = os.getenv("MODEL_STORAGE_DIR")
 db_filepath = os.getenv("MODEL_INFO_FILE")
@@ -12,6 +22,9 @@ db_filepath = os.getenv("MODEL_INFO_FILE")
 def run_download():
     """ Main entry point for downloading a model """
     args = get_download_args()
+    if args.from_file:
+        return run_batch_download(args.from_file, jobs=args.jobs)
+
     # Set up download directory
     if args.model_type and args.model_base:
         model_type = sanitize_and_validate_arg_input(args.model_type, 'model_type_names')
@@ -37,4 +50,146 @@ def run_download():
                                        model_type=model_type, 
                                        model_base=model_base,
                                        filename=args.filename)
-    print(f"\nFile processed: {filename}")
\ No newline at end of file
+    print(f"\nFile processed: {filename}")
+
+
+## how many metadata lookups run at the same time in a batch, they are small
+## requests so this is independent of the download concurrency
+RESOLVE_WORKERS = 8
+
+
+class BatchItem:
+    """ one line of a --from-file manifest """
+    __slots__ = ('line_no', 'url', 'model_type', 'model_base', 'filename', 'resolved')
+
+    def __init__(self, line_no, url, model_type=None, model_base=None, filename=None):
+        self.line_no = line_no
+        self.url = url
+        self.model_type = model_type
+        self.model_base = model_base
+        self.filename = filename
+        self.resolved = None ## future of (model_type, model_base)
+
+
+def run_batch_download(manifest_path, jobs=4):
+    """ downloads every url in the manifest: metadata is resolved concurrently
+    while the downloads stream through the pool, and all the new entries are
+    committed to the db in a single transaction at the end, also when the
+    batch is interrupted, so the files already downloaded keep their entries
+    """
+    items = read_url_manifest(manifest_path)
+    collection = load_collection()
+    collection.index_urls()
+
+    ## dedupe up front, against the manifest itself and against the collection
+    new_items = []
+    repair_items = []
+    seen = set()
+    for item in items:
+        url_key = normalize_url(item.url)
+        if url_key in seen:
+            print(f"--- line {item.line_no}: duplicate url, skipping: {item.url}")
+            continue
+        seen.add(url_key)
+
+        entry = collection.find_by_url(item.url)
+        if entry is None:
+            new_items.append(item)
+            continue
+        local_filepath = get_absolute_model_filepath(entry.get("local_filename"), entry.get("model_type"), entry.get("model_base"))
+        if os.path.exists(local_filepath) and is_download_complete(local_filepath, entry.get("file_size_mb")):
+            print(f"--- line {item.line_no}: already in the collection (id {entry.id}): {item.url}")
+            continue
+        repair_items.append((item, entry))
+
+    print(f"--- {len(new_items)} new, {len(repair_items)} incomplete, {len(items) - len(new_items) - len(repair_items)} skipped")
+
+    new_entries = []
+    entries_lock = threading.Lock()
+    tasks = []
+    try:
+        with ThreadPoolExecutor(max_workers=RESOLVE_WORKERS) as resolver:
+            for item in new_items:
+                item.resolved = resolver.submit(resolve_batch_item, item)
+                tasks.append(DownloadTask(item.url, item.url,
+                                          make_batch_download_fn(item, new_entries, entries_lock),
+                                          prepare=item.resolved.result))
+            for item, entry in repair_items:
+                tasks.append(DownloadTask(item.url, item.url, make_batch_repair_fn(entry, collection)))
+
+            results = run_download_tasks(tasks, jobs=jobs)
+    finally:
+        with entries_lock:
+            finished = list(new_entries)
+        if finished:
+            with db_transaction() as txn:
+                for new_info in finished:
+                    collection.add(txn.create(new_info), new_info)
+            print(f"--- added {len(finished)} entries to the collection")
+    return results
+
+def read_url_manifest(manifest_path):
+    """ one url per line, optionally followed by the type, base and filename,
+    '-' leaves a field to the metadata lookup. everything from a '#' word on is a comment
+    """
+    items = []
+    with open(manifest_path, 'r') as f:
+        for line_no, line in enumerate(f, start=1):
+            parts = line.split()
+            for i, part in enumerate(parts):
+                if part.startswith('#'):
+                    parts = parts[:i]
+                    break
+            if not parts:
+                continue
+            url = parts[0]
+            model_type = parts[1] if len(parts) > 1 and parts[1] != '-' else None
+            model_base = parts[2] if len(parts) > 2 and parts[2] != '-' else None
+            filename = parts[3] if len(parts) > 3 else None
+            try:
+                if model_type:
+                    model_type = sanitize_and_validate_arg_input(model_type, 'model_type_names')
+                if model_base:
+                    model_base = sanitize_and_validate_arg_input(model_base, 'model_base_names')
+            except ValueError as e:
+                print(f"--- line {line_no}: skipping, {e}")
+                continue
+            items.append(BatchItem(line_no, url, model_type, model_base, filename))
+    return items
+
+def resolve_batch_item(item):
+    """ fills in whatever the manifest line didn't say about the model """
+    model_type, model_base = item.model_type, item.model_base
+    if not model_type or not model_base:
+        resolved_type, resolved_base = get_model_info(item.url)
+        model_type = model_type or resolved_type
+        model_base = model_base or resolved_base
+    if not model_type or not model_base:
+        raise ValueError(f"line {item.line_no}: could not determine model type or base model "
+                         f"(type: {model_type}, base: {model_base}), pass them in the manifest")
+    return model_type, model_base
+
+def make_batch_download_fn(item, new_entries, entries_lock):
+    """ downloads the (resolved) item and queues up its db entry """
+    def download_fn():
+        model_type, model_base = item.resolved.result()
+        download_dir = os.path.join(storage_root_dir, model_type, model_base)
+        filename, sha256 = fetch_model_file(item.url, download_dir, filename=item.filename)
+        new_info = build_download_info(item.url, filename, model_type, model_base, sha256=sha256)
+        with entries_lock:
+            new_entries.append(new_info)
+        return int(get_size_of_path(os.path.join(download_dir, filename)) * 1024 * 1024)
+    return download_fn
+
+def make_batch_repair_fn(entry, collection):
+    """ an url we already know but whose file is missing or incomplete """
+    def repair_fn():
+        local_filepath = get_absolute_model_filepath(entry.get("local_filename"), entry.get("model_type"), entry.get("model_base"))
+        check_and_download_file(entry.get("url"),
+                                os.path.dirname(local_filepath),
+                                model_type=entry.get("model_type"),
+                                model_base=entry.get("model_base"),
+                                filename=os.path.basename(local_filepath),
+                                collection=collection)
+        return int(get_size_of_path(local_filepath) * 1024 * 1024)
+    return repair_fn
@@ -5,12 +5,11 @@ from src.utils.generic import (get_user_choice,
                                is_model_local)
 from src.utils.db import (get_entry,   
                           get_entry_data, 
+                          load_collection,
                           delete_entry,
                           update_entry,
                           print_db_entry)
-from src.utils.metadata import get_model_list
-from dotenv import load_dotenv
-load_dotenv()
+from src.utils.config import get_model_list
 
 storage_root_dir = os.getenv("MODEL_STORAGE_DIR")
 db_filepath = os.getenv("MODEL_INFO_FILE")
@@ -20,12 +19,13 @@ def run_edit():
     """ Main entry point for editing the db """
     args = get_edit_args()
     id = args.id
-    model_entry = get_entry(id)
+    ## load the collection once, and hand it to all the helpers below
+    collection = load_collection()
+    model_entry = get_entry(id, collection)
     if not model_entry:
         return
 
-    # db = read_db()
-    print_db_entry(id, header_str='Editing this model entry')
+    print_db_entry(id, collection, header_str='Editing this model entry')
 
     question = "What would you like to edit?"
     options = ["Edit tags", 
@@ -37,12 +37,12 @@ def run_edit():
     choice = get_user_choice(question, options)
 
     if choice == "1": ## edit tags
-        updated_tags = menu_edit_tags_main(id)
-        update_entry(id, 'tags', updated_tags)
-        print_db_entry(args.id, header_str='Finished editing tags')
+        updated_tags = menu_edit_tags_main(id, collection)
+        update_entry(id, 'tags', updated_tags, collection)
+        print_db_entry(args.id, collection, header_str='Finished editing tags')
     elif choice == "2": ## rename local filename
         ## first get the current and the new filename
-        current_filename = get_entry_data(id, 'local_filename', '')
+        current_filename = get_entry_data(id, 'local_filename', '', collection)
         new_filename = input("Enter new filename: ").strip()
 
         if new_filename and new_filename != current_filename:
@@ -59,13 +59,13 @@ def run_edit():
                     print(f"Error renaming file: {e}")
                     return
             ## and now update the db
-            update_entry(id, 'local_filename', new_filename)
+            update_entry(id, 'local_filename', new_filename, collection)
             print("Filename updated.")
     elif choice == "3": ## edit model type
-        current_filename = get_entry_data(id, 'local_filename', '')
+        current_filename = get_entry_data(id, 'local_filename', '', collection)
         model_type = model_entry.get('model_type')
         model_base = model_entry.get('model_base')
-        new_model_type = menu_edit_model_type(id)
+        new_model_type = menu_edit_model_type(id, collection)
         ## now lets get the paths.
         old_path = get_absolute_model_filepath(current_filename, model_type, model_base)
         new_path = get_absolute_model_filepath(current_filename, new_model_type, model_base)
@@ -83,13 +83,13 @@ def run_edit():
                 print(f"Error renaming file: {e}")
                 return
         ## and now update the db
-        update_entry(id, 'model_type', new_model_type)
-        print_db_entry(args.id, header_str='Finished editing model type')
+        update_entry(id, 'model_type', new_model_type, collection)
+        print_db_entry(args.id, collection, header_str='Finished editing model type')
     elif choice == "4": ## edit model type
-        current_filename = get_entry_data(id, 'local_filename', '')
+        current_filename = get_entry_data(id, 'local_filename', '', collection)
         model_type = model_entry.get('model_type')
         model_base = model_entry.get('model_base')
-        new_model_base = menu_edit_model_base(id)
+        new_model_base = menu_edit_model_base(id, collection)
         ## now lets get the paths.
         old_path = get_absolute_model_filepath(current_filename, model_type, model_base)
         new_path = get_absolute_model_filepath(current_filename, model_type, new_model_base)
@@ -107,11 +107,11 @@ def run_edit():
                 print(f"Error renaming file: {e}")
                 return
         ## and now update the db
-        update_entry(id, 'model_base', new_model_base)
-        print_db_entry(args.id, header_str='Finished editing model base')
+        update_entry(id, 'model_base', new_model_base, collection)
+        print_db_entry(args.id, collection, header_str='Finished editing model base')
     elif choice == "5": ## remove model from collection
         ## by not forcing, the user will be prompted to confirm the deletion
-        delete_entry(id, force=False)
+        delete_entry(id, force=False, collection=collection)
         print(f"Model '{id}' has been removed from the collection.")
     else:
         print("Invalid choice. No changes made.")
@@ -119,9 +119,9 @@ def run_edit():
     print("Database updated successfully.")
 
 
-def menu_edit_tags_main(id):
-    print_db_entry(id, header_str='Editing this model entry')
-    current_tags = get_entry_data(id, 'tags', [])
+def menu_edit_tags_main(id, collection):
+    print_db_entry(id, collection, header_str='Editing this model entry')
+    current_tags = get_entry_data(id, 'tags', [], collection)
     print(f"Current tags: {', '.join(current_tags)}")
     
     question = "What would you like to do with the tags?"
@@ -172,9 +172,9 @@ def menu_edit_tags_clear_all_tags():
     print("All tags cleared.")
     return []
 
-def menu_edit_model_type(id):
-    print_db_entry(id, header_str='Editing this model entry')
-    current_model_type = get_entry_data(id, 'model_type', '')
+def menu_edit_model_type(id, collection):
+    print_db_entry(id, collection, header_str='Editing this model entry')
+    current_model_type = get_entry_data(id, 'model_type', '', collection)
     print(f"Current model type: {current_model_type}")
 
     question = f"Currently the model type is: {current_model_type}. What would you like to change it to?"
@@ -194,9 +194,9 @@ def menu_edit_model_type(id):
         print("Invalid input. No changes made to model type.")
     return current_model_type
 
-def menu_edit_model_base(id):
-    print_db_entry(id, header_str='Editing this model entry')
-    current_model_base = get_entry_data(id, 'model_base', '')
+def menu_edit_model_base(id, collection):
+    print_db_entry(id, collection, header_str='Editing this model entry')
+    current_model_base = get_entry_data(id, 'model_base', '', collection)
     print(f"Current model base: {current_model_base}")
 
     question = f"Currently the model base is: {current_model_base}. What would you like to change it to?"
@@ -2,13 +2,12 @@ import os
 import json
 from src.utils.args import get_list_args
 from src.utils.generic import (sanitize_and_validate_arg_input, 
-                               get_absolute_model_filepath, 
-                               get_size_of_path,
-                               is_model_local)
-from src.utils.db import (read_db, print_db_entries,
+                               get_absolute_model_filepath)
+from src.utils.db import (load_collection,
                           print_db_entries) 
-from dotenv import load_dotenv
-load_dotenv()
+from src.utils.inventory import get_inventory
+from src.utils.sizes import (get_entry_sizes,
+                             get_size_breakdowns)
 
 storage_root_dir = os.getenv("MODEL_STORAGE_DIR")
 db_filepath = os.getenv("MODEL_INFO_FILE")
@@ -17,57 +16,78 @@ def run_list():
     """ Main entry point for listing models """
     args = get_list_args()
 
-    db = read_db()
+    collection = load_collection()
 
     if args.all or (not args.loaded and not args.unloaded and not args.model_type and not args.model_base and not args.data):
-        print_db_entries(list(db.keys()))
+        print_db_entries(collection.ids(), collection)
 
     elif args.loaded:
         print("Listing the models that are stored locally...")
-        loaded_ids = [id for id, entry in db.items() if is_model_local(entry.get('local_filename'), 
-                                                                       entry.get('model_type'), 
-                                                                       entry.get('model_base'))]
-        print_db_entries(loaded_ids)
+        local_ids = get_local_ids(collection)
+        loaded_ids = [entry.id for entry in collection if entry.id in local_ids]
+        print_db_entries(loaded_ids, collection)
     elif args.unloaded:
         print("Listing the models that are )not_ stored locally...")
-        unloaded_ids = [id for id, entry in db.items() if not is_model_local(entry.get('local_filename'), 
-                                                                             entry.get('model_type'), 
-                                                                             entry.get('model_base'))]
-        print_db_entries(unloaded_ids)
+        local_ids = get_local_ids(collection)
+        unloaded_ids = [entry.id for entry in collection if entry.id not in local_ids]
+        print_db_entries(unloaded_ids, collection)
     elif args.model_type and args.model_base: ## in case both args are provided 
         model_type = sanitize_and_validate_arg_input(args.model_type, 'model_type_names')
         model_base = sanitize_and_validate_arg_input(args.model_base, 'model_base_names')
-        matching_models = [[id, entry] for id, entry in db.items() 
-                           if entry.get('model_type') == model_type and 
-                              entry.get('model_base') == model_base]
-        id_list = [id for id, entry in matching_models]
+        matching_models = collection.filter(model_type=model_type, model_base=model_base)
+        id_list = [entry.id for entry in matching_models]
         print("-" * 80)
         print(f"Found {len(matching_models)} models for model type '{model_type}' and model base '{model_base}':")
-        print_db_entries(id_list)
+        print_db_entries(id_list, collection)
     elif args.model_type:
         model_type = sanitize_and_validate_arg_input(args.model_type, 'model_type_names')
-        matching_models = [[id, entry] for id, entry in db.items() if entry.get('model_type') == model_type]
-        id_list = [id for id, entry in matching_models]
+        matching_models = collection.filter(model_type=model_type)
+        id_list = [entry.id for entry in matching_models]
         print("-" * 80)
         print(f"Found {len(matching_models)} models for model type '{model_type}':")
-        print_db_entries(id_list)
+        print_db_entries(id_list, collection)
     elif args.model_base:
         model_base = sanitize_and_validate_arg_input(args.model_base, 'model_base_names')
-        matching_models = [[id, entry] for id, entry in db.items() if entry.get('model_base') == model_base]
-        id_list = [id for id, entry in matching_models]
+        matching_models = collection.filter(model_base=model_base)
+        id_list = [entry.id for entry in matching_models]
         print("-" * 80)
         print(f"Found {len(matching_models)} models for model base '{model_base}':")
-        print_db_entries(id_list)
+        print_db_entries(id_list, collection)
     elif args.data:
         print("Calculating the size of the models stored locally...")
-        total_size = 0
-        for entry in db.values():
-            local_filename = entry.get('local_filename', 'N/A')
-            model_type = entry.get('model_type', 'N/A')
-            model_base = entry.get('model_base', 'N/A')
-            local_filepath = get_absolute_model_filepath(local_filename, model_type, model_base)
-            total_size += get_size_of_path(local_filepath)
-        print(f"Total size of models stored locally: {total_size} MB")
+        sizes = get_entry_sizes(collection)
+        print_size_breakdowns(sizes)
     
     else:
-        print("Please specify --all to list all models.")
\ No newline at end of file
+        print("Please specify --all to list all models.")
+
+def get_local_ids(collection):
+    """ the ids of the entries that are stored locally, answered from a single
+    walk of the storage dir instead of a few syscalls per entry
+    """
+    inventory = get_inventory()
+    local_ids = set()
+    for entry in collection:
+        local_filepath = get_absolute_model_filepath(entry.get('local_filename'),
+                                                     entry.get('model_type'),
+                                                     entry.get('model_base'))
+        if inventory.is_model_local(local_filepath):
+            local_ids.add(entry.id)
+    return local_ids
+
+def print_size_breakdowns(sizes, line_len=80):
+    breakdowns, status = get_size_breakdowns(sizes)
+    to_mb = lambda num_bytes: num_bytes / (1024 * 1024)
+
+    print('-' * line_len)
+    print(f"Total size of models stored locally: {to_mb(status['loaded'][1]):.2f} MB")
+    print(f"--- loaded:   {status['loaded'][0]} models, {to_mb(status['loaded'][1]):.2f} MB")
+    print(f"--- unloaded: {status['unloaded'][0]} models, {to_mb(status['unloaded'][1]):.2f} MB to reload")
+    for key, title in (('model_type', 'by model type'), ('model_base', 'by model base'), ('tag', 'by tag')):
+        if not breakdowns[key]:
+            continue
+        print('-' * line_len)
+        print(f"Stored locally {title}:")
+        for name, num_bytes in sorted(breakdowns[key].items(), key=lambda item: item[1], reverse=True):
+            print(f"--- {name:<30} {to_mb(num_bytes):>12.2f} MB")
+    print('-' * line_len)
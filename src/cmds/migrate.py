@@ -0,0 +1,23 @@
+import os
+from src.utils.args import get_migrate_args
+from src.utils.sqlite_db import (is_sqlite_path,
+                                 import_json_db)
+
+db_filepath = os.getenv("MODEL_INFO_FILE")
+
+def run_migrate():
+    """ Main entry point for importing a json collection into the sqlite db """
+    args = get_migrate_args()
+
+    if not is_sqlite_path(db_filepath):
+        print(f"--- MODEL_INFO_FILE is not a sqlite db: {db_filepath}")
+        print("--- point MODEL_INFO_FILE to a .sqlite / .db file first, e.g.")
+        print("--- MODEL_INFO_FILE=/path/to/collection.sqlite")
+        return
+
+    if not os.path.isfile(args.json_file):
+        print(f"--- json collection not found: {args.json_file}")
+        return
+
+    imported = import_json_db(args.json_file, db_filepath)
+    print(f"Imported {imported} entries from {args.json_file} into {db_filepath}")
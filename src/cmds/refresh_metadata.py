@@ -0,0 +1,179 @@
+import os
+import time
+import asyncio
+import threading
+from concurrent.futures import ThreadPoolExecutor
+from src.utils.args import get_refresh_metadata_args
+from src.utils.generic import (get_absolute_model_filepath,
+                               get_size_of_path)
+from src.utils.db import (load_collection,
+                          db_transaction)
+from src.utils.http_cache import (cached_get,
+                                  is_offline)
+from src.utils.urls import (get_host_key,
+                            get_hostname,
+                            parse_civitai_url,
+                            parse_huggingface_file_url,
+                            get_huggingface_resolve_url)
+
+## the values older entries carry for fields we could not fill in at the time
+UNKNOWN_VALUES = (None, '', 'unknown')
+
+## the fields we try to fill in for every entry
+REFRESH_FIELDS = ('author', 'repo', 'filename_in_repo', 'file_size_mb', 'sha256')
+
+
+class RateLimiter:
+    """ spaces out the requests to each host, shared by all the worker threads """
+    def __init__(self, requests_per_second):
+        self.interval = 1.0 / requests_per_second if requests_per_second > 0 else 0
+        self.lock = threading.Lock()
+        self.next_slot = {}
+
+    def wait(self, url):
+        if not self.interval:
+            return
+        host = get_hostname(url)
+        with self.lock:
+            now = time.monotonic()
+            slot = max(now, self.next_slot.get(host, now))
+            self.next_slot[host] = slot + self.interval
+        if slot > now:
+            time.sleep(slot - now)
+
+
+def run_refresh_metadata():
+    """ Main entry point for filling in the missing metadata of the collection """
+    args = get_refresh_metadata_args()
+    collection = load_collection()
+
+    entries = [entry for entry in collection if get_missing_fields(entry, force=args.force)]
+    if not entries:
+        print("--- all entries are up to date")
+        return
+    print(f"--- refreshing the metadata of {len(entries)} of {len(collection)} entries")
+
+    start = time.monotonic()
+    updates, failures = asyncio.run(refresh_entries(entries, jobs=args.jobs, rate=args.rate, force=args.force))
+    elapsed = time.monotonic() - start
+
+    ## one write for the whole collection
+    num_fields = 0
+    with db_transaction() as txn:
+        for id, fields in updates.items():
+            for field, value in fields.items():
+                txn.update(id, field, value)
+                num_fields += 1
+
+    print('-' * 80)
+    print(f"--- updated {num_fields} fields in {len(updates)} entries in {elapsed:.1f}s")
+    for id, error in failures.items():
+        print(f"--- failed: entry {id} :: {error}")
+    print('-' * 80)
+
+async def refresh_entries(entries, jobs=16, rate=10.0, force=False):
+    """ resolves the entries with at most `jobs` of them in flight, the blocking
+    lookups run in worker threads. returns ({id: {field: value}}, {id: error})
+    """
+    loop = asyncio.get_running_loop()
+    loop.set_default_executor(ThreadPoolExecutor(max_workers=jobs))
+    semaphore = asyncio.Semaphore(jobs)
+    limiter = RateLimiter(rate)
+
+    async def refresh(entry):
+        async with semaphore:
+            return await asyncio.to_thread(resolve_entry_updates, entry, limiter, force)
+
+    results = await asyncio.gather(*(refresh(entry) for entry in entries), return_exceptions=True)
+
+    updates = {}
+    failures = {}
+    for entry, result in zip(entries, results):
+        if isinstance(result, Exception):
+            failures[entry.id] = result
+        elif result:
+            updates[entry.id] = result
+    return updates, failures
+
+def get_missing_fields(entry, force=False):
+    return [field for field in REFRESH_FIELDS if force or entry.get(field) in UNKNOWN_VALUES]
+
+def resolve_entry_updates(entry, limiter, force=False):
+    """ runs in a worker thread, returns {field: value} for what it could resolve """
+    missing = get_missing_fields(entry, force=force)
+    url = entry.get('url') or ''
+    host_key = get_host_key(url)
+
+    ## whatever is on disk is what we actually have, that beats the remote size
+    local_size_mb = None
+    if 'file_size_mb' in missing:
+        local_filepath = get_absolute_model_filepath(entry.get('local_filename'), entry.get('model_type'), entry.get('model_base'))
+        if local_filepath and os.path.exists(local_filepath):
+            local_size_mb = round(get_size_of_path(local_filepath), 2)
+
+    resolved = {}
+    needs_remote = [field for field in missing if not (field == 'file_size_mb' and local_size_mb is not None)]
+    if needs_remote and host_key == 'civitai':
+        resolved = resolve_civitai_fields(url, limiter)
+    elif needs_remote and host_key == 'huggingface':
+        resolved = resolve_huggingface_fields(url, limiter, 'sha256' in missing)
+    if local_size_mb is not None:
+        resolved['file_size_mb'] = local_size_mb
+
+    return {field: resolved[field] for field in missing
+            if resolved.get(field) not in UNKNOWN_VALUES and resolved[field] != entry.get(field)}
+
+def resolve_huggingface_fields(url, limiter, need_sha256):
+    repo_id, revision, path_in_repo = parse_huggingface_file_url(url)
+    author, _, repo = repo_id.partition('/')
+    resolved = {
+        'author': author,
+        'repo': repo,
+        'filename_in_repo': os.path.basename(path_in_repo),
+    }
+    if need_sha256 and path_in_repo and not is_offline():
+        from src.utils.download import (get_huggingface_lfs_info,
+                                        get_huggingface_auth_headers)
+        resolve_url = get_huggingface_resolve_url(repo_id, revision, path_in_repo)
+        limiter.wait(resolve_url)
+        sha256, size = get_huggingface_lfs_info(resolve_url, get_huggingface_auth_headers())
+        resolved['sha256'] = sha256
+        if size:
+            resolved['file_size_mb'] = round(size / (1024 * 1024), 2)
+    return resolved
+
+def resolve_civitai_fields(url, limiter):
+    model_id, version_id = parse_civitai_url(url)
+    if model_id is None and version_id is not None:
+        version = fetch_civitai_json(f"https://civitai.com/api/v1/model-versions/{version_id}", limiter)
+        model_id = version.get('modelId')
+    if model_id is None:
+        raise ValueError(f"could not find the civitai model id in {url}")
+
+    model = fetch_civitai_json(f"https://civitai.com/api/v1/models/{model_id}", limiter)
+    versions = model.get('modelVersions') or []
+    version = next((v for v in versions if str(v.get('id')) == str(version_id)), None) if version_id else None
+    if version is None and versions:
+        version = versions[0] ## the latest version, same as the metadata lookup
+    files = (version or {}).get('files') or []
+    primary_file = next((f for f in files if f.get('primary')), files[0] if files else {})
+
+    resolved = {
+        'author': (model.get('creator') or {}).get('username'),
+        'repo': model.get('name'),
+        'filename_in_repo': primary_file.get('name'),
+    }
+    if primary_file.get('sizeKB'):
+        resolved['file_size_mb'] = round(primary_file['sizeKB'] / 1024, 2)
+    ## the digest of the primary file, the same one the download records
+    sha256 = (primary_file.get('hashes') or {}).get('SHA256')
+    if sha256:
+        resolved['sha256'] = sha256.lower()
+    return resolved
+
+def fetch_civitai_json(api_url, limiter):
+    ## only requests that actually go out count against the rate limit, not cache hits
+    response = cached_get(api_url, before_request=limiter.wait)
+    if response.status_code != 200:
+        raise RuntimeError(f"{api_url} returned status {response.status_code}")
+    return response.json()
@@ -1,17 +1,77 @@
 import os
-import json
+import shutil
+import threading
+from concurrent.futures import ThreadPoolExecutor
 from urllib.parse import urlparse
 from src.utils.args import get_reload_args
-from src.utils.generic import (get_absolute_model_filepath, 
-                               sanitize_and_validate_arg_input)
-from src.utils.db import read_db 
-from src.main import check_and_download_file
-from dotenv import load_dotenv
-load_dotenv()
+from src.utils.generic import (sanitize_and_validate_arg_input,
+                               get_size_of_path,
+                               get_part_path,
+                               format_size)
+from src.utils.db import load_collection 
+from src.utils.pool import (DownloadTask,
+                            run_download_tasks,
+                            get_estimated_throughput)
+from src.utils.sizes import get_entry_sizes
+from src.utils.blobs import (is_blob_store_enabled,
+                             has_blob)
+from src.utils.urls import (get_host_key,
+                            is_directory_download,
+                            parse_huggingface_file_url,
+                            get_huggingface_resolve_url)
+from src.main import (check_and_download_file,
+                      is_download_complete)
 
 storage_root_dir = os.getenv("MODEL_STORAGE_DIR")
 db_filepath = os.getenv("MODEL_INFO_FILE")
 
+## the HEAD requests for entries without a recorded size
+SIZE_PROBE_WORKERS = 16
+
+
+class ReloadItem:
+    """ a missing model, and what it takes to fetch it """
+    __slots__ = ('entry', 'local_filepath', 'label', 'num_bytes', 'source', 'disk_bytes')
+
+    def __init__(self, entry, local_filepath, label, num_bytes=None, source=None):
+        self.entry = entry
+        self.local_filepath = local_filepath
+        self.label = label
+        self.num_bytes = num_bytes  ## None while unknown
+        self.source = source        ## where num_bytes came from: 'db', 'head', 'blob' or 'unknown'
+        self.disk_bytes = num_bytes ## what the download still takes on the disk, less than
+                                    ## num_bytes when a preallocated .part already holds the space
+
+
+class DiskAdmission:
+    """ only lets a download start while the disk has room for it. the free space
+    is taken once up front and every admitted download is booked against it, the
+    live free space would count the bytes the running downloads already wrote twice
+    """
+    def __init__(self, path, min_free):
+        self.path = path
+        self.min_free = min_free
+        self.lock = threading.Lock()
+        self.free = shutil.disk_usage(path).free
+        self.reserved = 0
+
+    def admit(self, num_bytes):
+        num_bytes = num_bytes or 0
+        with self.lock:
+            free = self.free - self.reserved
+            if free - num_bytes < self.min_free:
+                raise RuntimeError(f"not enough free disk space, needs {format_size(num_bytes)} "
+                                   f"and {format_size(max(free, 0))} is available "
+                                   f"(keeping {format_size(self.min_free)} free)")
+            self.reserved += num_bytes
+        return num_bytes
+
+    def release(self, num_bytes):
+        """ for a download that failed, one that finished keeps its bytes on the disk """
+        with self.lock:
+            self.reserved -= num_bytes
+
+
 def run_reload():
     """ Main entry point for redownloading models """
     args = get_reload_args()
@@ -23,54 +83,183 @@ def run_reload():
     if args.model_base:
         load_model_base = sanitize_and_validate_arg_input(args.model_base, 'model_base_names')
 
-    db = read_db()
+    collection = load_collection()
+    ## build the url index up front, the workers only read it
+    collection.index_urls()
 
+    entries = []
     # Iterate through each entry in the db
-    for entry in db.values():
-        url = entry.get("url")
-        local_filename = entry.get("local_filename")
-        tags = entry.get("tags", [])
-        model_type = entry.get("model_type")
-        model_base = entry.get("model_base")
-        local_filepath = get_absolute_model_filepath(local_filename, model_type, model_base)
-
-        if args.tag:
-            if args.tag not in tags:
-                ## then we can skip this file
-                continue 
-        
-        if load_model_type:
-            if load_model_type != model_type:
-                ## then we can skip this file
-                continue
-
-        if load_model_base:
-            if load_model_base != model_base:
-                ## then we can skip this file
-                continue
-
-        if load_model_type and load_model_base:
-            if load_model_type != model_type or load_model_base != model_base:
-                ## then we can skip this file
-                continue
-
-        if url and local_filename:
-            # Ensure the directory exists
-            os.makedirs(os.path.dirname(local_filepath), exist_ok=True)
-            
-            # Extract the filename from the URL if not present in local_filename
-            if os.path.basename(local_filename) == "":
-                parsed_url = urlparse(url)
-                filename = os.path.basename(parsed_url.path)
-                local_filename = os.path.join(local_filepath, filename)
-            
-            # Download the file
-            filename = check_and_download_file(url, 
-                                               os.path.dirname(local_filepath), 
-                                               model_type=model_type,
-                                               model_base=model_base,
-                                               filename=os.path.basename(local_filepath))
+    for entry in collection:
+        if args.tag and args.tag not in entry.get("tags", []):
+            continue
+        if load_model_type and load_model_type != entry.get("model_type"):
+            continue
+        if load_model_base and load_model_base != entry.get("model_base"):
+            continue
+        if entry.get("url") and entry.get("local_filename"):
+            entries.append(entry)
         else:
             print(f"Skipping entry due to missing URL or local filename: {entry}")
 
+    ## one pass to find what's missing, and how big it is
+    items = get_missing_items(entries)
+    estimate_missing_sizes(items)
+    order_reload_items(items, priority_tags=args.priority_tag)
+
+    if args.plan:
+        print_reload_plan(items, len(entries), min_free=args.min_free)
+        return
+
+    admission = DiskAdmission(storage_root_dir, args.min_free)
+    tasks = []
+    for item in items:
+        # Ensure the directory exists
+        os.makedirs(os.path.dirname(item.local_filepath), exist_ok=True)
+        download_fn = make_reload_fn(item, collection, admission)
+        tasks.append(DownloadTask(item.label, item.entry.get("url"), download_fn))
+
+    print(f"--- {len(tasks)} of {len(entries)} models are missing")
+    ## in the order of order_reload_items, the models we need first start first
+    run_download_tasks(tasks, jobs=args.jobs, interleave=False)
     print("Redownload process completed.")
+
+def get_missing_items(entries):
+    """ the entries whose file or directory is not (completely) on disk """
+    items = []
+    for size in get_entry_sizes(entries):
+        entry = size.entry
+        local_filepath = size.filepath
+        if size.is_local and is_download_complete(local_filepath, entry.get("file_size_mb")):
+            continue
+        local_filename = entry.get("local_filename")
+        # Extract the filename from the URL if not present in local_filename
+        if os.path.basename(local_filename) == "":
+            parsed_url = urlparse(entry.get("url"))
+            local_filename = os.path.join(local_filepath, os.path.basename(parsed_url.path))
+        items.append(ReloadItem(entry, local_filepath, local_filename))
+    return items
+
+def estimate_missing_sizes(items):
+    """ the bytes still to fetch for every item: nothing if the blob store has it,
+    else the recorded size, else a HEAD request. whatever a partial download
+    already fetched is taken off
+    """
+    to_probe = []
+    for item in items:
+        entry = item.entry
+        if is_blob_store_enabled() and not is_directory_download(entry.get("url")) and has_blob(entry.get("sha256")):
+            item.num_bytes, item.source = 0, 'blob'
+        elif entry.get("file_size_mb"):
+            item.num_bytes, item.source = int(entry.get("file_size_mb") * 1024 * 1024), 'db'
+        else:
+            to_probe.append(item)
+
+    if to_probe:
+        with ThreadPoolExecutor(max_workers=SIZE_PROBE_WORKERS) as executor:
+            sizes = list(executor.map(probe_remote_size, [item.entry.get("url") for item in to_probe]))
+        for item, num_bytes in zip(to_probe, sizes):
+            item.num_bytes, item.source = (num_bytes, 'head') if num_bytes else (None, 'unknown')
+
+    for item in items:
+        item.disk_bytes = item.num_bytes
+        part_path = get_part_path(item.local_filepath)
+        if item.num_bytes and os.path.isfile(part_path):
+            part_size = os.path.getsize(part_path)
+            if part_size < item.num_bytes:
+                item.num_bytes -= part_size
+                item.disk_bytes = item.num_bytes
+            else:
+                ## a segmented .part is preallocated to the full size: that tells us nothing
+                ## about what's left to fetch, but the disk space is already taken
+                item.disk_bytes = 0
+
+def probe_remote_size(url):
+    from src.utils.download import (get_huggingface_lfs_info,
+                                    get_huggingface_auth_headers)
+    from src.utils.transfer import probe_url
+    headers = {}
+    if get_host_key(url) == 'huggingface':
+        headers = get_huggingface_auth_headers()
+        repo_id, revision, path_in_repo = parse_huggingface_file_url(url)
+        url = get_huggingface_resolve_url(repo_id, revision, path_in_repo)
+        ## LFS files carry their size on the redirect, no need to follow it
+        sha256, size = get_huggingface_lfs_info(url, headers)
+        if size:
+            return size
+    size, accepts_ranges = probe_url(url, headers=headers)
+    return size
+
+def order_reload_items(items, priority_tags=None):
+    """ the models we need first come first: an explicit `priority` on the entry
+    (lower is sooner), then the order of the --priority-tag tags, then smallest
+    first, so as many models as possible are usable as early as possible
+    """
+    priority_tags = priority_tags or []
+    def sort_key(item):
+        entry = item.entry
+        priority = entry.get("priority")
+        tags = entry.get("tags") or []
+        tag_rank = next((i for i, tag in enumerate(priority_tags) if tag in tags), len(priority_tags))
+        num_bytes = item.num_bytes if item.num_bytes is not None else float('inf')
+        return (priority if priority is not None else float('inf'), tag_rank, num_bytes)
+    items.sort(key=sort_key)
+
+def print_reload_plan(items, num_entries, min_free=0, line_len=80):
+    usage = shutil.disk_usage(storage_root_dir)
+    throughput = get_estimated_throughput()
+    available = usage.free - min_free
+
+    print('-' * line_len)
+    planned = 0
+    not_admitted = []
+    for i, item in enumerate(items):
+        disk_bytes = item.disk_bytes or 0
+        fits = planned + disk_bytes <= available
+        if fits:
+            planned += disk_bytes
+        else:
+            not_admitted.append(item)
+        size_str = format_size(item.num_bytes) if item.num_bytes is not None else 'unknown'
+        print(f"--- {i + 1:>4}. {size_str:>12} ({item.source:<7}) {'' if fits else '[no space] '}{item.label}")
+    print('-' * line_len)
+
+    total_bytes = sum(item.num_bytes or 0 for item in items)
+    num_unknown = sum(1 for item in items if item.num_bytes is None)
+    eta = total_bytes / (throughput * 1024 * 1024) if throughput > 0 else 0
+    print(f"--- missing: {len(items)} of {num_entries} models, {format_size(total_bytes)} to fetch"
+          + (f" (+ {num_unknown} of unknown size)" if num_unknown else ""))
+    print(f"--- eta: {format_eta(eta)} at {throughput:.1f} MB/s")
+    print(f"--- disk: {format_size(usage.free)} free, keeping {format_size(min_free)} free")
+    if not_admitted:
+        print(f"--- warning:: {len(not_admitted)} models ({format_size(sum(item.num_bytes or 0 for item in not_admitted))}) won't fit and would be skipped")
+    print('-' * line_len)
+
+def format_eta(seconds):
+    minutes, seconds = divmod(int(seconds), 60)
+    hours, minutes = divmod(minutes, 60)
+    return f"{hours}h {minutes:02d}m" if hours else f"{minutes}m {seconds:02d}s"
+
+def make_reload_fn(item, collection, admission):
+    """ returns the function a pool worker runs to reload a single entry,
+    it returns the number of bytes fetched, or None if the file was already there
+    """
+    entry = item.entry
+    local_filepath = item.local_filepath
+    def reload_fn():
+        if os.path.exists(local_filepath) and is_download_complete(local_filepath, entry.get("file_size_mb")):
+            return None
+        reserved = admission.admit(item.disk_bytes)
+        try:
+            check_and_download_file(entry.get("url"), 
+                                    os.path.dirname(local_filepath), 
+                                    model_type=entry.get("model_type"),
+                                    model_base=entry.get("model_base"),
+                                    filename=os.path.basename(local_filepath),
+                                    collection=collection)
+        except BaseException:
+            admission.release(reserved)
+            raise
+        if not os.path.exists(local_filepath):
+            raise RuntimeError(f"download finished but {local_filepath} is missing")
+        return int(get_size_of_path(local_filepath) * 1024 * 1024)
+    return reload_fn
@@ -0,0 +1,185 @@
+import os
+import re
+import json
+import time
+import threading
+from http.server import (BaseHTTPRequestHandler,
+                         ThreadingHTTPServer)
+from urllib.parse import (unquote,
+                          urlparse)
+from src.utils.args import get_serve_args
+from src.utils.db import load_collection
+from src.utils.store_index import build_store_index
+from src.utils.mirrors import INDEX_FILENAME
+
+storage_root_dir = os.getenv("MODEL_STORAGE_DIR")
+
+## how long a published index is served before the store is looked at again
+INDEX_TTL = 30
+## socket.sendfile falls back to plain sends where the os has no sendfile, in blocks of this size
+SEND_BLOCK_SIZE = 8 * 1024 * 1024
+
+
+class StoreIndexCache:
+    """ the serialized index of the local store, rebuilt at most every INDEX_TTL seconds.
+    also knows which files may be served, nothing outside the collection is
+    """
+    def __init__(self):
+        self.lock = threading.Lock()
+        self.built_at = 0.0
+        self.body = b''
+        self.allowed_paths = set()
+
+    def get(self):
+        with self.lock:
+            if time.monotonic() - self.built_at > INDEX_TTL:
+                index = build_store_index(load_collection())
+                self.body = json.dumps(index).encode('utf-8')
+                self.allowed_paths = get_allowed_paths(index)
+                self.built_at = time.monotonic()
+            return self.body, self.allowed_paths
+
+
+class StoreRequestHandler(BaseHTTPRequestHandler):
+    """ GET/HEAD /index.json and /files/<path relative to MODEL_STORAGE_DIR>, with byte ranges """
+    server_version = 'cozy-serve/1'
+    protocol_version = 'HTTP/1.1'
+    index_cache = None
+
+    def do_HEAD(self):
+        self.handle_request(send_body=False)
+
+    def do_GET(self):
+        self.handle_request(send_body=True)
+
+    def handle_request(self, send_body):
+        path = unquote(urlparse(self.path).path)
+        try:
+            if path == f"/{INDEX_FILENAME}":
+                self.send_index(send_body)
+            elif path.startswith('/files/'):
+                self.send_store_file(path[len('/files/'):], send_body)
+            else:
+                self.send_error(404)
+        except (BrokenPipeError, ConnectionResetError):
+            pass ## the client went away, e.g. a cancelled download
+
+    def send_index(self, send_body):
+        body, allowed_paths = self.index_cache.get()
+        self.send_response(200)
+        self.send_header('Content-Type', 'application/json')
+        self.send_header('Content-Length', str(len(body)))
+        self.end_headers()
+        if send_body:
+            self.wfile.write(body)
+
+    def send_store_file(self, rel_path, send_body):
+        rel_path = os.path.normpath(rel_path)
+        body, allowed_paths = self.index_cache.get()
+        if rel_path not in allowed_paths:
+            self.send_error(404)
+            return
+
+        filepath = os.path.join(storage_root_dir, rel_path)
+        try:
+            f = open(filepath, 'rb')
+        except OSError:
+            self.send_error(404)
+            return
+        with f:
+            size = os.fstat(f.fileno()).st_size
+            byte_range = parse_range_header(self.headers.get('Range'), size)
+            if byte_range is False:
+                self.send_response(416)
+                self.send_header('Content-Range', f"bytes */{size}")
+                self.send_header('Content-Length', '0')
+                self.end_headers()
+                return
+
+            if byte_range is None:
+                start, length = 0, size
+                self.send_response(200)
+            else:
+                start, end = byte_range
+                length = end - start + 1
+                self.send_response(206)
+                self.send_header('Content-Range', f"bytes {start}-{end}/{size}")
+            self.send_header('Content-Type', 'application/octet-stream')
+            self.send_header('Content-Length', str(length))
+            self.send_header('Accept-Ranges', 'bytes')
+            self.end_headers()
+            if send_body and length:
+                ## straight from the page cache to the socket, the bytes never pass through python
+                self.wfile.flush()
+                self.connection.sendfile(f, offset=start, count=length)
+
+    def log_message(self, format, *args):
+        print(f"--- {self.address_string()} :: {format % args}")
+
+
+def run_serve():
+    """ Main entry point for serving the local store to other cozy nodes """
+    args = get_serve_args()
+    index_cache = StoreIndexCache()
+
+    if args.write_index:
+        index_path = os.path.join(storage_root_dir, INDEX_FILENAME)
+        body, allowed_paths = index_cache.get()
+        tmp_path = f"{index_path}.{os.getpid()}.tmp"
+        with open(tmp_path, 'wb') as f:
+            f.write(body)
+        os.replace(tmp_path, index_path)
+        print(f"--- wrote the index of {len(allowed_paths)} files to {index_path}")
+        return
+
+    handler = type('BoundStoreRequestHandler', (StoreRequestHandler,), {'index_cache': index_cache})
+    server = ThreadingHTTPServer((args.host, args.port), handler)
+    server.daemon_threads = True
+    body, allowed_paths = index_cache.get()
+    print(f"--- serving {len(allowed_paths)} files from {storage_root_dir} on http://{args.host}:{args.port}")
+    if args.host in ('0.0.0.0', '::', ''):
+        print("--- warning:: listening on every interface without authentication, anyone who can reach this port can download the models")
+    elif args.host in ('127.0.0.1', 'localhost', '::1'):
+        print("--- only reachable from this machine, pass e.g. `--host 0.0.0.0` to serve the other nodes")
+    print(f"--- add it to the `mirrors` of the other nodes, e.g. `- url: http://<this host>:{args.port}`")
+    try:
+        server.serve_forever()
+    except KeyboardInterrupt:
+        print("\n--- stopped")
+    finally:
+        server.server_close()
+
+def get_allowed_paths(index):
+    """ the relative paths of every file in the index, directories expanded """
+    allowed_paths = set()
+    for index_entry in index['entries']:
+        if index_entry.get('files') is None:
+            allowed_paths.add(os.path.normpath(index_entry['path']))
+            continue
+        for rel_path, size in index_entry['files']:
+            allowed_paths.add(os.path.normpath(os.path.join(index_entry['path'], rel_path)))
+    return allowed_paths
+
+def parse_range_header(range_header, size):
+    """ 'bytes=100-199', 'bytes=100-' or 'bytes=-100' -> (start, end) inclusive.
+    None for no, a multi or an invalid range, which is answered with the whole file (rfc 7233),
+    False if unsatisfiable
+    """
+    if not range_header:
+        return None
+    match = re.fullmatch(r"\s*bytes=(\d*)-(\d*)\s*", range_header)
+    if not match or (not match.group(1) and not match.group(2)):
+        return None
+    if not match.group(1):
+        ## the last n bytes, none of an empty file
+        length = int(match.group(2))
+        if length == 0 or size == 0:
+            return False
+        return max(0, size - length), size - 1
+    start = int(match.group(1))
+    end = int(match.group(2)) if match.group(2) else size - 1
+    if match.group(2) and end < start:
+        return None
+    if start >= size:
+        return False
+    return start, min(end, size - 1)
@@ -1,15 +1,28 @@
 import os
 import json
+import time
+import shutil
+from concurrent.futures import (ThreadPoolExecutor,
+                                wait,
+                                FIRST_COMPLETED)
 from urllib.parse import urlparse
 from src.utils.args import get_unload_args
 from src.utils.generic import (sanitize_and_validate_arg_input, 
-                               get_absolute_model_filepath)
-from src.utils.db import read_db
-from dotenv import load_dotenv
-load_dotenv()
+                               get_user_choice,
+                               format_size)
+from src.utils.db import (load_collection,
+                          db_transaction)
+from src.utils.blobs import (release_blob,
+                             has_blob)
+from src.utils.sizes import get_entry_sizes
+from src.utils.collection import matches_filters
 
 storage_root_dir = os.getenv("MODEL_STORAGE_DIR")
 
+## removals are mostly waiting on the disk (rmtree of a civitai directory over
+## NFS is one round trip per file), so a few of them run at the same time
+DEFAULT_UNLOAD_JOBS = 8
+
 def run_unload():
     """ Main entry point for cleaning up space """
     args = get_unload_args()
@@ -21,58 +34,214 @@ def run_unload():
     if args.model_base:
         clear_model_base = sanitize_and_validate_arg_input(args.model_base, 'model_base_names')
 
-    db = read_db()
-
-    # Iterate through each entry in the db 
-    for entry in db.values():
-        local_filename = entry.get("local_filename")
-        force_keep = entry.get("force_keep", False)
-        tags = entry.get("tags", [])
-        model_type = entry.get("model_type", None)
-        model_base = entry.get("model_base", None)
-        local_filepath = get_absolute_model_filepath(local_filename, model_type, model_base)
-
-        ## if we passed in a specific tag, and the entry has a tag
-        if args.tag:
-            if args.tag not in tags:
-                ## then we can skip this file
-                continue
+    collection = load_collection()
+    matching_entries = [entry for entry in collection
+                        if matches_filters(entry, args.tag, clear_model_type, clear_model_base)]
+
+    if args.target_free or args.max_usage is not None:
+        return run_target_unload(matching_entries, target_free=args.target_free,
+                                 max_usage=args.max_usage, assume_yes=args.yes,
+                                 dry_run=args.dry_run, jobs=args.jobs)
+
+    plan, skipped = plan_unload(matching_entries)
+    print_unload_plan(plan, skipped)
+    if args.dry_run or not plan:
+        return
+
+    unloaded = execute_unload_plan(plan, jobs=args.jobs)
+    record_unloaded(unloaded)
+    print("Cleanup process completed.")
+
+def remove_local_path(entry, local_filepath):
+    """ removes the file or directory of an entry, returns True if it's gone """
+    local_filename = entry.get("local_filename")
+    try:
+        if os.path.isfile(local_filepath):
+            os.remove(local_filepath)
+            print(f"Removed file: {local_filename}")
+            ## drop the blob too, once nothing links to it anymore
+            release_blob(entry.get("sha256"))
+        elif os.path.isdir(local_filepath):
+            shutil.rmtree(local_filepath)
+            print(f"Removed directory: {local_filename}")
+        else:
+            print(f"Unknown file type: {local_filename}")
+            return False
+    except OSError as e:
+        print(f"Error removing {local_filename}: {e}")
+        return False
+    return True
+
+
+class UnloadItem:
+    """ a single model in an unload plan """
+    __slots__ = ('entry', 'filepath', 'num_bytes', 'last_used')
+
+    def __init__(self, entry, filepath, num_bytes, last_used=None):
+        self.entry = entry
+        self.filepath = filepath
+        self.num_bytes = num_bytes  ## what unloading it frees
+        self.last_used = last_used
+
+
+def plan_unload(entries):
+    """ returns (the local models to unload, the ones skipped for force_keep) """
+    plan = []
+    skipped = []
+    for size in get_entry_sizes(entries):
+        if not size.is_local and not os.path.exists(size.filepath):
+            continue ## nothing to do
+        if size.entry.get("force_keep", False):
+            skipped.append(UnloadItem(size.entry, size.filepath, size.num_bytes))
+            continue
+        plan.append(UnloadItem(size.entry, size.filepath, size.num_bytes))
+    return plan, skipped
+
+def print_unload_plan(plan, skipped, line_len=80):
+    print('-' * line_len)
+    for item in skipped:
+        print(f"Skipping {item.entry.get('local_filename')} due to force_keep flag")
+    for item in plan:
+        print(f"--- {format_size(item.num_bytes):>12}  {item.entry.get('local_filename')}")
+    print('-' * line_len)
+    print(f"--- {len(plan)} models to unload, {format_size(sum(item.num_bytes for item in plan))} reclaimed, "
+          f"{len(skipped)} skipped (force_keep)")
+    print('-' * line_len)
 
-        if clear_model_type:
-            if clear_model_type!= model_type:
-                continue ## then we bypass this file
+def execute_unload_plan(plan, jobs=DEFAULT_UNLOAD_JOBS, stop_when=None):
+    """ removes the planned models in order with up to `jobs` removals in flight,
+    no new removal is started once stop_when() returns True.
+    returns the items that were removed
+    """
+    unloaded = []
+    pending = iter(plan)
+    with ThreadPoolExecutor(max_workers=max(1, jobs)) as executor:
+        in_flight = {}
+        def submit_next():
+            item = next(pending, None)
+            if item is not None:
+                in_flight[executor.submit(remove_local_path, item.entry, item.filepath)] = item
+            return item is not None
 
-        if clear_model_base:
-            if clear_model_base!= model_base:
+        for _ in range(max(1, jobs)):
+            if not submit_next():
+                break
+        while in_flight:
+            done, _ = wait(in_flight, return_when=FIRST_COMPLETED)
+            for future in done:
+                item = in_flight.pop(future)
+                if future.result():
+                    unloaded.append(item)
+            if stop_when is not None and stop_when():
+                continue ## let the ones in flight finish, but don't start new ones
+            while len(in_flight) < jobs and submit_next():
+                pass
+    return unloaded
+
+def record_unloaded(unloaded):
+    """ one db write for the whole batch """
+    if not unloaded:
+        return
+    unloaded_at = time.time()
+    with db_transaction() as txn:
+        for item in unloaded:
+            txn.update(item.entry.id, "unloaded_at", unloaded_at)
+
+
+def run_target_unload(entries, target_free=None, max_usage=None, assume_yes=False,
+                      dry_run=False, jobs=DEFAULT_UNLOAD_JOBS):
+    """ unloads the least recently used models until the disk has `target_free`
+    bytes free, or is at most `max_usage` percent full
+    """
+    usage = shutil.disk_usage(storage_root_dir)
+    bytes_to_free = get_bytes_to_free(usage, target_free=target_free, max_usage=max_usage)
+    if bytes_to_free <= 0:
+        print(f"--- nothing to do, {format_size(usage.free)} free ({usage.used / usage.total:.0%} used)")
+        return
+
+    candidates = get_eviction_candidates(entries)
+    plan = plan_eviction(candidates, bytes_to_free)
+    print_eviction_plan(plan, bytes_to_free, usage)
+    if dry_run or not plan:
+        return
+
+    if not assume_yes:
+        choice = get_user_choice(f"Unload these {len(plan)} models?", ["Yes", "No"])
+        if choice != '1':
+            print("--- aborted, nothing was unloaded")
+            return
+
+    ## other processes write to the disk too, so go by what's actually free
+    def is_target_met():
+        usage = shutil.disk_usage(storage_root_dir)
+        return get_bytes_to_free(usage, target_free=target_free, max_usage=max_usage) <= 0
+
+    unloaded = execute_unload_plan(plan, jobs=jobs, stop_when=is_target_met)
+    record_unloaded(unloaded)
+
+    usage = shutil.disk_usage(storage_root_dir)
+    print(f"--- done, {format_size(usage.free)} free ({usage.used / usage.total:.0%} used)")
+
+def get_bytes_to_free(usage, target_free=None, max_usage=None):
+    bytes_to_free = 0
+    if target_free:
+        bytes_to_free = max(bytes_to_free, target_free - usage.free)
+    if max_usage is not None:
+        bytes_to_free = max(bytes_to_free, int(usage.used - usage.total * max_usage / 100))
+    return bytes_to_free
+
+def get_eviction_candidates(entries):
+    """ the local, not force_keep models, least recently used first and the
+    biggest first among the ones used at the same time.
+    last used is the later of the `last_used` timestamp of the entry (if some
+    launcher records it) and the atime of the file
+    """
+    candidates = []
+    for size in get_entry_sizes(entries):
+        entry = size.entry
+        if not size.is_local or entry.get("force_keep", False):
+            continue
+        try:
+            st = os.stat(size.filepath)
+        except OSError:
+            continue
+        num_bytes = size.num_bytes
+        if not os.path.isdir(size.filepath):
+            ## a file that is linked from somewhere else (another view of the
+            ## same blob) frees nothing, the blob itself doesn't count as a link
+            other_links = st.st_nlink - 1 - (1 if has_blob(entry.get("sha256")) else 0)
+            if other_links > 0:
                 continue
+        last_used = max(float(entry.get("last_used") or 0), st.st_atime)
+        candidates.append(UnloadItem(entry, size.filepath, num_bytes, last_used))
 
-        if clear_model_type and clear_model_base:
-            if clear_model_type != model_type or clear_model_base != model_base:
-                continue    
-        
-        ## if we passed in a force_keep flag, and the entry has a force_keep flag
-        if force_keep:
-            ## then we can skip this file
-            print(f"Skipping {local_filename} due to force_keep flag")
+    candidates.sort(key=lambda c: (c.last_used, -c.num_bytes))
+    return candidates
+
+def plan_eviction(candidates, bytes_to_free):
+    """ takes candidates in order until they add up to bytes_to_free """
+    plan = []
+    planned_bytes = 0
+    for candidate in candidates:
+        if planned_bytes >= bytes_to_free:
+            break
+        if candidate.num_bytes <= 0:
             continue
-        
-        if local_filename and os.path.exists(local_filepath):
-            try:
-                if os.path.isfile(local_filepath):
-                    os.remove(local_filepath)
-                    print(f"Removed file: {local_filename}")
-                elif os.path.isdir(local_filepath):
-                    import shutil
-                    shutil.rmtree(local_filepath)
-                    print(f"Removed directory: {local_filename}")
-                else:
-                    print(f"Unknown file type: {local_filename}")
-            except OSError as e:
-                print(f"Error removing {local_filename}: {e}")
-        elif local_filename:
-            ## if the file is not found, then we can skip it
-            pass
-        else:
-            print("Local filename not found in entry")
+        plan.append(candidate)
+        planned_bytes += candidate.num_bytes
+    return plan
 
-    print("Cleanup process completed.")
+def print_eviction_plan(plan, bytes_to_free, usage, line_len=80):
+    planned_bytes = sum(candidate.num_bytes for candidate in plan)
+    print('-' * line_len)
+    print(f"--- disk: {format_size(usage.free)} free of {format_size(usage.total)} ({usage.used / usage.total:.0%} used)")
+    print(f"--- need to free: {format_size(bytes_to_free)}")
+    print('-' * line_len)
+    for candidate in plan:
+        last_used = time.strftime('%Y-%m-%d', time.localtime(candidate.last_used)) if candidate.last_used else 'never'
+        print(f"--- {last_used}  {format_size(candidate.num_bytes):>12}  {candidate.entry.get('local_filename')}")
+    print('-' * line_len)
+    print(f"--- {len(plan)} models, {format_size(planned_bytes)} in total")
+    if planned_bytes < bytes_to_free:
+        print(f"--- warning:: that is {format_size(bytes_to_free - planned_bytes)} short of the target, "
+              f"everything else is force_keep, not local or shared with another model")
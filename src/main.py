@@ -3,10 +3,15 @@ from src.utils.download import (download_file_from_hf,
                           download_file_from_civitai, 
                           download_file)
 from src.utils.info import (create_download_info)
-from src.utils.db import read_db
-from src.utils.generic import get_absolute_model_filepath
-from dotenv import load_dotenv
-load_dotenv()
+from src.utils.db import (load_collection,
+                          update_entry)
+from src.utils.generic import (get_absolute_model_filepath,
+                               has_partial_download)
+from src.utils.blobs import (is_blob_store_enabled,
+                             link_from_blob,
+                             store_as_blob)
+from src.utils.mirrors import fetch_from_mirrors
+from src.utils.urls import is_directory_download
 
 db_filepath = os.getenv("MODEL_INFO_FILE")
 
@@ -16,36 +21,82 @@ def check_and_download_file(url,
                             download_dir, 
                             model_type,
                             model_base,
-                            filename=None):
-    db = read_db()
+                            filename=None,
+                            collection=None):
+    if collection is None:
+        collection = load_collection()
     
     should_add_info = True ## init to true
     ## here we check if the file already exists, so we can bypass the download
-    for entry in db.values():
-        if entry["url"] == url:
-            local_filename = entry["local_filename"]
-            local_filepath = get_absolute_model_filepath(local_filename, model_type, model_base)
-            if os.path.exists(local_filepath):
-                print(f"File already exists: {local_filepath}")
-                return local_filepath
-            else:
-                print(f"File info found, but file missing. Re-downloading: {url}")
-                should_add_info = False
-                break
+    entry = collection.find_by_url(url)
+    if entry is not None:
+        local_filename = entry.get("local_filename")
+        local_filepath = get_absolute_model_filepath(local_filename, model_type, model_base)
+        if os.path.exists(local_filepath) and is_download_complete(local_filepath, entry.get("file_size_mb")):
+            print(f"File already exists: {local_filepath}")
+            return local_filepath
+        elif os.path.exists(local_filepath):
+            print(f"File found, but it is incomplete. Resuming download: {url}")
+            should_add_info = False
+        elif (is_blob_store_enabled() and not is_directory_download(url)
+              and link_from_blob(entry.get("sha256"), local_filepath)):
+            ## the bytes are still in the blob store, e.g. under another name
+            print(f"File restored from the blob store: {local_filepath}")
+            return local_filepath
+        else:
+            print(f"File info found, but file missing. Re-downloading: {url}")
+            should_add_info = False
     
     # If we get here, either the URL wasn't found or the file was missing
-    if 'huggingface.co' in url:
-        filename = download_file_from_hf(url, filename=filename, download_dir=download_dir)
-    elif 'civitai.com' in url:
-        filename = download_file_from_civitai(url, filename=filename, download_dir=download_dir) 
-    else:
-        filename = download_file(url, filename=filename, download_dir=download_dir)
+    filename, sha256 = fetch_model_file(url, download_dir, filename=filename,
+                                        sha256=entry.get("sha256") if entry is not None else None)
 
     if should_add_info:
         # Create and save download information
-        db = create_download_info(url, 
-                                  filename, 
-                                  model_type,
-                                  model_base)
+        create_download_info(url, 
+                             filename, 
+                             model_type,
+                             model_base,
+                             collection=collection,
+                             sha256=sha256)
+    elif sha256 and entry.get("sha256") != sha256:
+        ## keep the digest of what we actually have on disk
+        update_entry(entry.id, "sha256", sha256, collection)
     
     return filename
+
+def fetch_model_file(url, download_dir, filename=None, sha256=None):
+    """ downloads the file (or civitai directory) into download_dir,
+    returns its name and sha256 without touching the db. the configured
+    mirrors are tried first, sha256 is the digest we expect if we know it
+    """
+    is_directory = is_directory_download(url)
+    ## a mirror matches a directory by its url only, the digest would find a lone file
+    fetched = fetch_from_mirrors(url, download_dir, filename=filename, sha256=None if is_directory else sha256)
+    if fetched is not None:
+        filename, sha256 = fetched
+    elif 'huggingface.co' in url:
+        filename, sha256 = download_file_from_hf(url, filename=filename, download_dir=download_dir)
+    elif 'civitai.com' in url:
+        ## a whole directory, the digest is the one of its primary file
+        filename, sha256 = download_file_from_civitai(url, filename=filename, download_dir=download_dir)
+    else:
+        filename, sha256 = download_file(url, filename=filename, download_dir=download_dir)
+
+    if sha256 and is_blob_store_enabled() and not is_directory:
+        ## keep the bytes once in the blob store, the type/base path becomes a hardlink
+        store_as_blob(os.path.join(download_dir, filename), sha256)
+
+    return filename, sha256
+
+def is_download_complete(local_filepath, expected_size_mb=None):
+    """ a file with a leftover .part next to it, or with a size that doesn't match
+    the one we recorded at download time, is a truncated download
+    """
+    if has_partial_download(local_filepath):
+        return False
+    if expected_size_mb and os.path.isfile(local_filepath):
+        size_mb = os.path.getsize(local_filepath) / (1024 * 1024)
+        ## file_size_mb is stored rounded to 2 decimals
+        return abs(size_mb - expected_size_mb) <= 0.01
+    return True
@@ -1,4 +1,5 @@
 import argparse
+from src.utils.generic import parse_size
 
 def get_download_args():
     parser = argparse.ArgumentParser(description="Download AI models from various sources.")
@@ -11,6 +12,8 @@ def get_download_args():
     parser.add_argument("--model-type", dest='model_type', type=str, help="e.g. controlnet, unet, checkpoint")
     parser.add_argument("--model-base", dest='model_base', type=str, default="flux1", help="e.g., flux1, sdxl, sd15")
     parser.add_argument("--filename", dest='filename', type=str, default=None, help="Custom filename incase repo naming not clear enough")
+    parser.add_argument("--from-file", dest='from_file', type=str, default=None, help="Download every url in this file, one 'url [type] [base] [filename]' per line")
+    parser.add_argument("--jobs", "-j", type=int, default=4, help="With --from-file, number of downloads to run at the same time")
     return parser.parse_args()
 
 def get_list_args():
@@ -60,6 +63,11 @@ def get_unload_args():
     parser.add_argument("--tag", type=str, default=None, help="Unloads all files with this tag")
     parser.add_argument("--model-type", type=str, default=None, help="Unloads all files with this model type")
     parser.add_argument("--model-base", type=str, default=None, help="Unloads all files with this model base")
+    parser.add_argument("--target-free", type=parse_size, default=None, help="Unload the least recently used models until this much is free, e.g. 200G")
+    parser.add_argument("--max-usage", type=float, default=None, help="Unload the least recently used models until the disk is at most this percent full")
+    parser.add_argument("--yes", "-y", action="store_true", help="Don't ask for confirmation")
+    parser.add_argument("--dry-run", action="store_true", help="Only show what would be unloaded")
+    parser.add_argument("--jobs", "-j", type=int, default=8, help="Number of files or directories to remove at the same time")
     
     args = parser.parse_args()
 
@@ -82,6 +90,12 @@ def get_reload_args():
     parser.add_argument("--tag", type=str, default=None, help="Only reload the models with this tag")
     parser.add_argument("--model-type", type=str, help="Only reload the models of this type, e.g. controlnet, unet, checkpoint")
     parser.add_argument("--model-base", type=str, help="Only reload the models of this base, e.g. flux1, sdxl, sd15")
+    parser.add_argument("--jobs", "-j", type=int, default=1, help="Number of downloads to run at the same time")
+    parser.add_argument("--plan", action="store_true", help="Only show what is missing, how much to fetch and how long it takes")
+    parser.add_argument("--priority-tag", action="append", default=[],
+                        help="Reload the models with this tag first, can be given more than once, in order of importance")
+    parser.add_argument("--min-free", type=parse_size, default=parse_size('1G'),
+                        help="Free space to always leave on the disk, e.g. 10G, downloads that don't fit are skipped")
 
     args = parser.parse_args()
 
@@ -94,3 +108,57 @@ def get_reload_args():
             args.model_base = args.subarg
 
     return args
+
+def get_migrate_args():
+    parser = argparse.ArgumentParser(description="Import a json collection into the sqlite db.")
+    parser.add_argument("_cmd")
+    parser.add_argument("json_file", type=str, help="Path to the existing json collection file")
+    return parser.parse_args()
+
+def get_export_args():
+    parser = argparse.ArgumentParser(description="Write models and their entries into a bundle.")
+    parser.add_argument("_cmd")
+    parser.add_argument("bundle", type=str, help="Path of the bundle (a tar file) to write, '-' for stdout")
+    parser.add_argument("subcmd", nargs='?', default=None, choices=['tag', 'type', 'base'],
+                        help="Subcommand to specify what sort of thing you want to export")
+    parser.add_argument("subarg", nargs='?', default=None, help="Argument for the subcmd")
+    parser.add_argument("--tag", type=str, default=None, help="Only export the models with this tag")
+    parser.add_argument("--model-type", type=str, help="Only export the models of this type, e.g. controlnet, unet, checkpoint")
+    parser.add_argument("--model-base", type=str, help="Only export the models of this base, e.g. flux1, sdxl, sd15")
+
+    args = parser.parse_args()
+
+    if args.subcmd:
+        if args.subcmd == 'tag':
+            args.tag = args.subarg
+        elif args.subcmd == 'type':
+            args.model_type = args.subarg
+        elif args.subcmd == 'base':
+            args.model_base = args.subarg
+
+    return args
+
+def get_import_args():
+    parser = argparse.ArgumentParser(description="Unpack a bundle into the storage dir and the collection.")
+    parser.add_argument("_cmd")
+    parser.add_argument("bundle", type=str, help="Path of the bundle to read, '-' for stdin")
+    parser.add_argument("--checksum", action="store_true",
+                        help="Also compare the sha256 of files that are already there, not just size and mtime")
+    return parser.parse_args()
+
+def get_serve_args():
+    parser = argparse.ArgumentParser(description="Serve the local store to other cozy nodes.")
+    parser.add_argument("_cmd")
+    parser.add_argument("--host", type=str, default="127.0.0.1", help="Address to listen on, e.g. 0.0.0.0 to serve the whole network")
+    parser.add_argument("--port", type=int, default=8765, help="Port to listen on")
+    parser.add_argument("--write-index", action="store_true",
+                        help="Only write the index.json into MODEL_STORAGE_DIR, for nodes that mount it as a directory mirror")
+    return parser.parse_args()
+
+def get_refresh_metadata_args():
+    parser = argparse.ArgumentParser(description="Fill in the missing metadata of the entries in the collection.")
+    parser.add_argument("_cmd")
+    parser.add_argument("--jobs", "-j", type=int, default=16, help="Number of entries to resolve at the same time")
+    parser.add_argument("--rate", type=float, default=10.0, help="Max requests per second to each host, 0 for no limit")
+    parser.add_argument("--force", action='store_true', help="Refresh every field, not just the missing or unknown ones")
+    return parser.parse_args()
@@ -0,0 +1,73 @@
+import os
+from src.utils import config
+
+## the content addressed store lives inside the storage dir, so the
+## type/base views can be hardlinks into it (hardlinks can't cross filesystems)
+BLOB_DIRNAME = '.blobs'
+
+
+def is_blob_store_enabled():
+    storage = config.get_config().get('storage') or {}
+    return bool(storage.get('blob_store', False))
+
+def get_blob_dir():
+    return os.path.join(os.getenv("MODEL_STORAGE_DIR"), BLOB_DIRNAME, 'sha256')
+
+def get_blob_path(sha256):
+    sha256 = sha256.lower()
+    return os.path.join(get_blob_dir(), sha256[:2], sha256)
+
+def has_blob(sha256):
+    return bool(sha256) and os.path.isfile(get_blob_path(sha256))
+
+def store_as_blob(filepath, sha256):
+    """ moves the bytes of a freshly downloaded file into the blob store and
+    leaves a hardlink at filepath. if the blob already exists the new copy is
+    dropped in favour of a link to the existing one. returns the blob path,
+    or None if the file could not be linked (e.g. a different filesystem)
+    """
+    blob_path = get_blob_path(sha256)
+    os.makedirs(os.path.dirname(blob_path), exist_ok=True)
+    try:
+        if not os.path.exists(blob_path):
+            os.link(filepath, blob_path)
+        elif not os.path.samefile(filepath, blob_path):
+            replace_with_link(blob_path, filepath)
+    except OSError as e:
+        print(f"--- warning:: could not add {os.path.basename(filepath)} to the blob store: {e}")
+        return None
+    return blob_path
+
+def link_from_blob(sha256, filepath):
+    """ creates filepath as a hardlink to an existing blob, returns False if there is no such blob """
+    if not has_blob(sha256):
+        return False
+    os.makedirs(os.path.dirname(filepath), exist_ok=True)
+    try:
+        replace_with_link(get_blob_path(sha256), filepath)
+    except OSError as e:
+        print(f"--- warning:: could not link {os.path.basename(filepath)} from the blob store: {e}")
+        return False
+    return True
+
+def replace_with_link(blob_path, filepath):
+    """ atomically points filepath at the blob, whatever was there before """
+    tmp_path = f"{filepath}.{os.getpid()}.link"
+    os.link(blob_path, tmp_path)
+    os.replace(tmp_path, filepath)
+
+def release_blob(sha256):
+    """ call after removing a file that may be a view of a blob. the blob is
+    deleted once no view links to it anymore, its link count is the ref count
+    """
+    if not has_blob(sha256):
+        return False
+    blob_path = get_blob_path(sha256)
+    try:
+        if os.stat(blob_path).st_nlink > 1:
+            return False
+        os.remove(blob_path)
+    except FileNotFoundError:
+        return False ## released by a concurrent unload of another view
+    print(f"Removed unreferenced blob: {sha256}")
+    return True
@@ -0,0 +1,147 @@
+from html.parser import HTMLParser
+from src.utils import config
+
+## the config sections we classify a page against
+SECTIONS = ('model_type_names', 'model_base_names')
+
+## how much text (in characters) the html is fed to the parser at a time
+CHUNK_SIZE = 64 * 1024
+
+## we stop scanning once every section has at least EARLY_STOP_MIN_MATCHES
+## matches and its leader holds at least EARLY_STOP_SHARE of them
+EARLY_STOP_MIN_MATCHES = 200
+EARLY_STOP_SHARE = 0.75
+
+
+class AliasMatcher:
+    """ counts all type and base aliases in one pass over the page, a chunk at
+    a time. every distinct alias is counted once per chunk (even when it is
+    listed under several names) and credited to all the names that list it.
+
+    a single regex alternation over all aliases was tried too, but with the
+    few dozen aliases in the config.yaml CPython's re is 2-3x slower than the
+    str.count calls, which run in C over a chunk that is still in the cache
+    """
+    def __init__(self, alias_lists):
+        self.credits = {}
+        for section, name_lists in alias_lists.items():
+            for names in name_lists:
+                canonical = names[0]
+                for alias in filter(None, names):
+                    self.credits.setdefault(alias, []).append((section, canonical))
+
+        ## an alias can continue in the next chunk, this much text is carried over
+        self.overlap = max((len(a) for a in self.credits), default=1) - 1
+        self.names = {section: [names[0] for names in name_lists]
+                      for section, name_lists in alias_lists.items()}
+
+    def new_counts(self):
+        return {section: dict.fromkeys(names, 0) for section, names in self.names.items()}
+
+    def scan(self, text, counts, carried=''):
+        """ adds the alias hits in (lowercased) text to counts. text starts with
+        the carried over end of the previous chunk, whose hits were already counted
+        """
+        for alias, credits in self.credits.items():
+            hits = text.count(alias)
+            if carried:
+                hits -= carried.count(alias)
+            if hits:
+                for section, canonical in credits:
+                    counts[section][canonical] += hits
+
+
+class TextCollector(HTMLParser):
+    """ incremental html to text, the equivalent of soup.get_text(' ', strip=True).
+    like bs4 it leaves out the contents of <script> and <style>, model pages carry
+    big inline json and js blobs that would otherwise skew the alias counts
+    """
+    SKIPPED_TAGS = ('script', 'style')
+
+    def __init__(self):
+        super().__init__()
+        self.parts = []
+        self.skipping = None ## the tag whose contents we are skipping
+
+    def handle_starttag(self, tag, attrs):
+        if tag in self.SKIPPED_TAGS:
+            self.skipping = tag
+
+    def handle_endtag(self, tag):
+        if tag == self.skipping:
+            self.skipping = None
+
+    def handle_data(self, data):
+        if self.skipping:
+            return
+        data = data.strip()
+        if data:
+            self.parts.append(data)
+
+    def pop_text(self):
+        text = ' '.join(self.parts)
+        self.parts = []
+        return text
+
+
+_matcher = None
+_matcher_source = None
+
+def get_matcher():
+    """ the matcher for the current config.yaml, rebuilt when the config changes """
+    global _matcher, _matcher_source
+    compiled = config.get_compiled_config()
+    if _matcher is None or _matcher_source is not compiled:
+        _matcher = AliasMatcher({section: compiled['aliases'][section] for section in SECTIONS})
+        _matcher_source = compiled
+    return _matcher
+
+def classify_text_stream(chunks, early_stop=True):
+    """ counts the aliases in a stream of text chunks in a single pass,
+    returns {section: {name: confidence}} with confidences summing to 1
+    """
+    matcher = get_matcher()
+    counts = matcher.new_counts()
+    carried = ''
+
+    for chunk in chunks:
+        if not chunk:
+            continue
+        text = carried + chunk.lower()
+        matcher.scan(text, counts, carried)
+        carried = text[-matcher.overlap:] if matcher.overlap else ''
+        if early_stop and is_decided(counts):
+            break
+
+    return counts_to_confidences(counts)
+
+def classify_html(html, early_stop=True):
+    """ parses the html incrementally and classifies its text in the same pass """
+    return classify_text_stream(iter_html_text(html), early_stop=early_stop)
+
+def iter_html_text(html):
+    collector = TextCollector()
+    for start in range(0, len(html), CHUNK_SIZE):
+        collector.feed(html[start:start + CHUNK_SIZE])
+        text = collector.pop_text()
+        if text:
+            yield text + ' '
+    collector.close()
+    yield collector.pop_text()
+
+def is_decided(counts):
+    for section_counts in counts.values():
+        total = sum(section_counts.values())
+        if total < EARLY_STOP_MIN_MATCHES:
+            return False
+        if max(section_counts.values()) / total < EARLY_STOP_SHARE:
+            return False
+    return True
+
+def counts_to_confidences(counts):
+    confidences = {}
+    for section, section_counts in counts.items():
+        total = sum(section_counts.values())
+        confidences[section] = {name: count / total if total > 0 else 0
+                                for name, count in section_counts.items()}
+    return confidences
@@ -0,0 +1,151 @@
+from src.utils.urls import normalize_url
+
+## the fields we know about, these live in __slots__ so an 8k entry
+## collection stays compact in memory. anything else goes into `extra`
+ENTRY_FIELDS = ('url',
+                'local_filename',
+                'source_name',
+                'model_type',
+                'model_base',
+                'file_size_mb',
+                'sha256',
+                'author',
+                'repo',
+                'filename_in_repo',
+                'download_date',
+                'tags',
+                'force_keep',
+                'last_used',
+                'unloaded_at',
+                'priority')
+
+
+def matches_filters(entry, tag=None, model_type=None, model_base=None):
+    """ whether the entry has the tag, type and base, the ones that are None match anything """
+    if tag and tag not in (entry.get('tags') or []):
+        return False
+    if model_type and model_type != entry.get('model_type'):
+        return False
+    if model_base and model_base != entry.get('model_base'):
+        return False
+    return True
+
+
+class Entry:
+    """ a single model entry of the collection """
+    __slots__ = ('id', 'extra') + ENTRY_FIELDS
+
+    def __init__(self, id, data):
+        self.id = str(id)
+        self.extra = {}
+        for field, value in data.items():
+            self.set(field, value)
+
+    def get(self, field, default=None):
+        """ same behaviour as dict.get, so entries can be used like the raw json dicts """
+        if field in ENTRY_FIELDS:
+            return getattr(self, field, default)
+        return self.extra.get(field, default)
+
+    def set(self, field, value):
+        if field in ENTRY_FIELDS:
+            setattr(self, field, value)
+        else:
+            self.extra[field] = value
+
+    def to_dict(self):
+        """ returns the entry as a plain dict, the way it is stored in the db """
+        data = {}
+        for field in ENTRY_FIELDS:
+            if hasattr(self, field):
+                data[field] = getattr(self, field)
+        data.update(self.extra)
+        return data
+
+    def __repr__(self):
+        return f"Entry({self.id!r}, {self.to_dict()!r})"
+
+
+class Collection:
+    """ in-memory view of the whole model collection,
+    load it once per command and pass it around instead of re-reading the db
+    """
+    __slots__ = ('entries', '_url_index')
+
+    def __init__(self, entries=None):
+        self.entries = entries if entries is not None else {}
+        self._url_index = None
+
+    @classmethod
+    def from_dict(cls, db):
+        return cls({str(id): Entry(id, data) for id, data in db.items()})
+
+    def to_dict(self):
+        return {id: entry.to_dict() for id, entry in self.entries.items()}
+
+    def get(self, id, default=None):
+        return self.entries.get(str(id), default)
+
+    def get_entry_data(self, id, field, default=None):
+        entry = self.entries.get(str(id))
+        if entry is None:
+            return default
+        return entry.get(field, default)
+
+    def set_entry_data(self, id, field, value):
+        entry = self.entries.get(str(id))
+        if entry is not None:
+            entry.set(field, value)
+            if field == 'url':
+                self._url_index = None
+
+    def add(self, id, data):
+        entry = Entry(id, data)
+        self.entries[entry.id] = entry
+        if self._url_index is not None:
+            self._index_entry(entry)
+        return entry
+
+    def remove(self, id):
+        self.entries.pop(str(id), None)
+        self._url_index = None
+
+    def find_by_url(self, url):
+        """ constant time lookup of the entry for a url, equivalent urls
+        (blob vs resolve links, query strings, trailing slashes..) match the same entry
+        """
+        if self._url_index is None:
+            self.index_urls()
+        return self._url_index.get(normalize_url(url))
+
+    def index_urls(self):
+        """ (re)builds the url index, find_by_url does this on first use """
+        self._url_index = {}
+        for entry in self.entries.values():
+            self._index_entry(entry)
+
+    def _index_entry(self, entry):
+        url_key = normalize_url(entry.get('url'))
+        if url_key:
+            ## the first entry wins, same as the old linear scan
+            self._url_index.setdefault(url_key, entry)
+
+    def ids(self):
+        return list(self.entries.keys())
+
+    def filter(self, model_type=None, model_base=None, tag=None):
+        """ returns the entries matching all of the given filters """
+        return [entry for entry in self.entries.values()
+                if matches_filters(entry, tag, model_type, model_base)]
+
+    def __getitem__(self, id):
+        return self.entries[str(id)]
+
+    def __contains__(self, id):
+        return str(id) in self.entries
+
+    def __iter__(self):
+        return iter(self.entries.values())
+
+    def __len__(self):
+        return len(self.entries)
@@ -0,0 +1,132 @@
+import os
+import json
+import time
+
+config_path = os.path.join(os.path.dirname(os.path.dirname(__file__)), os.path.pardir, 'config.yaml')
+## precompiled copy of the config, only written when COZY_CONFIG_CACHE is set
+config_cache_path = os.path.join(os.path.dirname(config_path), '.config.cache.json')
+
+## the config sections that map aliases to a canonical name
+ALIAS_SECTIONS = ('model_type_names', 'model_base_names')
+
+## how often (in seconds) we stat the config file to see if it changed
+STAT_INTERVAL = 1.0
+
+_compiled = None     ## the compiled config, see compile_config()
+_stamp = None        ## (mtime_ns, size) of the yaml file the compiled config came from
+_last_checked = 0.0  ## monotonic time of the last stat
+
+
+def get_config():
+    """ returns the parsed config.yaml, parsed once per process
+    and re-parsed only when the file on disk changes
+    """
+    return get_compiled_config()['config']
+
+def get_compiled_config():
+    global _compiled, _stamp, _last_checked
+
+    now = time.monotonic()
+    if _compiled is not None and now - _last_checked < STAT_INTERVAL:
+        return _compiled
+    _last_checked = now
+
+    stamp = get_config_stamp()
+    if _compiled is not None and stamp == _stamp:
+        return _compiled
+
+    compiled = None
+    if is_config_cache_enabled():
+        compiled = read_config_cache(stamp)
+
+    if compiled is None:
+        compiled = compile_config(parse_config_file())
+        if is_config_cache_enabled():
+            write_config_cache(stamp, compiled)
+
+    _compiled = compiled
+    _stamp = stamp
+    return _compiled
+
+def get_config_stamp():
+    stat = os.stat(config_path)
+    return [stat.st_mtime_ns, stat.st_size]
+
+def parse_config_file():
+    import yaml ## only needed when the config actually has to be parsed
+    with open(config_path, 'r') as config_file:
+        return yaml.safe_load(config_file) or {}
+
+def compile_config(config):
+    """ precomputes everything the lookups need from the raw config:
+        - alias_maps: {section: {alias: canonical_name}} for O(1) lookups
+        - aliases:    {section: [[canonical_name, alias, ...], ...]}
+    """
+    alias_maps = {}
+    aliases = {}
+    for section in ALIAS_SECTIONS:
+        mappings = config.get(section) or {}
+        alias_map = {}
+        alias_lists = []
+        for correct_value, variations in mappings.items():
+            variations = variations or []
+            ## first match wins, same as the old linear scan
+            alias_map.setdefault(correct_value, correct_value)
+            for v in variations:
+                alias_map.setdefault(v.lower().strip(), correct_value)
+
+            combined_list = [x.lower() for x in [correct_value] + variations]
+            combined_list = list(dict.fromkeys(combined_list)) ## remove duplicates, keep order
+            combined_list.remove(correct_value.lower())
+            combined_list.insert(0, correct_value.lower())
+            alias_lists.append(combined_list)
+
+        alias_maps[section] = alias_map
+        aliases[section] = alias_lists
+
+    return {
+        'config': config,
+        'alias_maps': alias_maps,
+        'aliases': aliases,
+    }
+
+def is_config_cache_enabled():
+    return os.getenv("COZY_CONFIG_CACHE", "").lower() in ("1", "true", "yes")
+
+def read_config_cache(stamp):
+    try:
+        with open(config_cache_path, 'r') as f:
+            data = json.load(f)
+    except (OSError, ValueError):
+        return None
+    if data.get('stamp') != stamp:
+        return None
+    return data.get('compiled')
+
+def write_config_cache(stamp, compiled):
+    tmp_path = f"{config_cache_path}.{os.getpid()}.tmp"
+    try:
+        with open(tmp_path, 'w') as f:
+            json.dump({'stamp': stamp, 'compiled': compiled}, f)
+        os.replace(tmp_path, config_cache_path)
+    except OSError as e:
+        ## the cache is only an optimisation, never fail a command because of it
+        print(f"--- warning:: could not write config cache: {e}")
+
+def lookup_alias(arg_input, mapping_type):
+    """ returns the canonical name for an alias, or None if it is unknown """
+    alias_map = get_compiled_config()['alias_maps'][mapping_type]
+    return alias_map.get(arg_input.lower().strip())
+
+def get_model_list(config_key_name):
+    """ returns the top level key names for model_type_names or model_base_names """
+    return list(get_config()[config_key_name].keys())
+
+def get_model_aliases(config_key_name):
+    """ returns a nested list of model names and their aliases,
+    with the main name first in each list
+    """
+    return get_compiled_config()['aliases'][config_key_name]
+
+def get_filenames_to_auto_rename():
+    return get_config().get('filenames_to_auto_rename', [])
@@ -1,63 +1,244 @@
 import os
 import json 
-from src.utils.generic import get_absolute_model_filepath 
+import threading
+from contextlib import contextmanager
+from src.utils.generic import (get_absolute_model_filepath,
+                               clear_terminal)
+from src.utils.collection import Collection
+from src.utils import sqlite_db
+from src.utils.blobs import release_blob
+
+try:
+    import fcntl
+except ImportError: ## not available on windows, we then only lock within the process
+    fcntl = None
 
 db_filepath = os.getenv("MODEL_INFO_FILE")
-config_path = os.path.join(os.path.dirname(os.path.dirname(__file__)), os.path.pardir, 'config.yaml')
+
+## the inter-process lock is re-entrant within a process,
+## so a transaction can call helpers that lock again
+_thread_lock = threading.RLock()
+_lock_depth = 0
+_lock_file = None
+## the transaction currently open in this thread, nested transactions join it
+_local = threading.local()
+
+def is_sqlite_db():
+    """ the sqlite backend is used when MODEL_INFO_FILE ends in .sqlite / .sqlite3 / .db """
+    return sqlite_db.is_sqlite_path(db_filepath)
 
 def read_db():
+    if is_sqlite_db():
+        return sqlite_db.read_db(db_filepath)
+
     validate_db_filepath()
     with open(db_filepath, "r") as f:
         db = json.load(f)
     return db
 
 def write_db(db):
-    validate_db_filepath()
-    # Save the updated json db file
-    with open(db_filepath, "w") as f:
-        json.dump(db, f, indent=4)
+    if is_sqlite_db():
+        sqlite_db.write_db(db_filepath, db)
+        return
+
+    # Save the updated json db file, without ever leaving a half written file behind
+    with db_lock():
+        atomic_write_json(db_filepath, db)
+
+def atomic_write_json(filepath, data):
+    """ writes to a temp file in the same dir, fsyncs it and renames it over the target,
+    so a crash mid-write leaves either the old or the new file, never a corrupt one
+    """
+    import tempfile
+    dirname = os.path.dirname(os.path.abspath(filepath))
+    fd, tmp_path = tempfile.mkstemp(dir=dirname, prefix=f".{os.path.basename(filepath)}.", suffix=".tmp")
+    try:
+        with os.fdopen(fd, "w") as f:
+            json.dump(data, f, indent=4)
+            f.flush()
+            os.fsync(f.fileno())
+        os.replace(tmp_path, filepath)
+    except BaseException:
+        if os.path.exists(tmp_path):
+            os.remove(tmp_path)
+        raise
+
+    ## make the rename itself durable
+    try:
+        dir_fd = os.open(dirname, os.O_RDONLY)
+    except OSError:
+        return
+    try:
+        os.fsync(dir_fd)
+    except OSError:
+        pass
+    finally:
+        os.close(dir_fd)
+
+@contextmanager
+def db_lock():
+    """ advisory lock on '<MODEL_INFO_FILE>.lock', held around read-modify-write cycles
+    so parallel cozy processes don't lose each others entries
+    """
+    global _lock_depth, _lock_file
+    with _thread_lock:
+        if _lock_depth == 0:
+            _lock_file = open(f"{db_filepath}.lock", "a")
+            if fcntl is not None:
+                fcntl.flock(_lock_file, fcntl.LOCK_EX)
+        _lock_depth += 1
+        try:
+            yield
+        finally:
+            _lock_depth -= 1
+            if _lock_depth == 0:
+                if fcntl is not None:
+                    fcntl.flock(_lock_file, fcntl.LOCK_UN)
+                _lock_file.close()
+                _lock_file = None
+
+class JsonTransaction:
+    """ batch of changes to the json db, written once when the transaction ends """
+    def __init__(self, db):
+        self.db = db
+        self.dirty = False
+
+    def get(self, id):
+        return self.db.get(str(id))
+
+    def create(self, entry):
+        id = str(get_next_available_id(self.db))
+        self.db[id] = entry
+        self.dirty = True
+        return id
+
+    def update(self, id, field, value):
+        if str(id) not in self.db:
+            return False
+        self.db[str(id)][field] = value
+        self.dirty = True
+        return True
+
+    def delete(self, id):
+        if str(id) not in self.db:
+            return False
+        del self.db[str(id)]
+        self.dirty = True
+        return True
+
+class SqliteTransaction:
+    """ batch of changes to the sqlite db, committed as one sqlite transaction """
+    def __init__(self, conn):
+        self.conn = conn
+
+    def get(self, id):
+        return sqlite_db.fetch_entry(self.conn, id)
+
+    def create(self, entry):
+        return str(sqlite_db.insert_entry(self.conn, entry))
+
+    def update(self, id, field, value):
+        return sqlite_db.update_entry_field(self.conn, id, field, value)
+
+    def delete(self, id):
+        return sqlite_db.delete_entry_row(self.conn, id)
+
+@contextmanager
+def db_transaction():
+    """ make many changes under one lock and one write, e.g.
+
+        with db_transaction() as txn:
+            txn.update(id, 'tags', tags)
+            txn.create(entry)
+    """
+    active_txn = getattr(_local, 'txn', None)
+    if active_txn is not None:
+        yield active_txn
+        return
+
+    if is_sqlite_db():
+        with sqlite_db.connect(db_filepath) as conn:
+            conn.execute("BEGIN IMMEDIATE")
+            _local.txn = SqliteTransaction(conn)
+            try:
+                yield _local.txn
+            finally:
+                _local.txn = None
+        return
+
+    with db_lock():
+        _local.txn = JsonTransaction(read_db())
+        try:
+            yield _local.txn
+        finally:
+            txn, _local.txn = _local.txn, None
+        if txn.dirty:
+            write_db(txn.db)
+
+def load_collection():
+    """ reads the db once and returns it as an in-memory Collection """
+    return Collection.from_dict(read_db())
 
 def validate_db_filepath():
     if not os.path.exists(db_filepath):
-        with open(db_filepath, "w") as f:
-            json.dump({}, f)
+        with db_lock():
+            if not os.path.exists(db_filepath):
+                atomic_write_json(db_filepath, {})
 
-def get_next_available_id():
+def get_next_available_id(db=None):
     try:
-        db = read_db()
+        if db is None:
+            db = read_db()
         next_id = max(map(int, db.keys())) + 1
     except (FileNotFoundError, ValueError, json.JSONDecodeError):
         next_id = 1
     
     return next_id
 
-def get_entry(id):
-    db = read_db()
+def get_entry(id, collection=None):
+    if collection is not None:
+        db = collection
+    elif is_sqlite_db():
+        entry = sqlite_db.get_entry(db_filepath, id)
+        db = {str(id): entry} if entry is not None else {}
+    else:
+        db = read_db()
     if str(id) not in db:
         raise KeyError(f"Entry with id '{id}' not found in the database.")
     return db[str(id)]
 
+def find_entries(url=None, model_type=None, model_base=None, tag=None):
+    """ returns {id: entry} for the entries matching all the given filters,
+    the sqlite backend answers this from its indexes
+    """
+    if is_sqlite_db():
+        return sqlite_db.find_entries(db_filepath, url=url, model_type=model_type,
+                                      model_base=model_base, tag=tag)
 
-def create_entry(entry):
-    db = read_db()
-    id = get_next_available_id()
+    collection = load_collection()
+    matches = collection.filter(model_type=model_type, model_base=model_base, tag=tag)
+    return {entry.id: entry.to_dict() for entry in matches
+            if not url or entry.get('url') == url}
 
-    ## now add the new info with a new id 
-    db[str(id)] = entry 
 
-    write_db(db)
+def create_entry(entry):
+    """ adds a new entry to the db and returns its id """
+    with db_transaction() as txn:
+        return txn.create(entry)
 
-def delete_entry(id, force=False):
+def delete_entry(id, force=False, collection=None):
     """ Main entry point for purging a model """
-    db = read_db()
+    if is_sqlite_db():
+        entry = sqlite_db.get_entry(db_filepath, id)
+    else:
+        entry = read_db().get(id)
 
     # Check if the ID exists in the download_info
-    if id not in db:
+    if entry is None:
         print(f"Error: Model with ID '{id}' not found.")
         return
 
     # Get the model information
-    entry = db[id]
     local_filename = entry.get('local_filename')
     model_type = entry.get('model_type')
     model_base = entry.get('model_base')
@@ -76,39 +257,48 @@ def delete_entry(id, force=False):
             try:
                 os.remove(local_filepath)
                 print(f"File '{local_filepath}' has been removed.")
+                release_blob(entry.get('sha256'))
             except OSError as e:
                 print(f"Error removing file: {e}")
         else:
             print(f"File '{local_filepath}' not found.")
 
-    # Remove the entry from the JSON file
-    del db[id]
-    write_db(db)
+    # Remove the entry from the db
+    with db_transaction() as txn:
+        txn.delete(id)
 
-def update_entry(id, field, value):
-    db = read_db()
+    if collection is not None:
+        collection.remove(id)
 
-    # Check if the ID exists in the download_info
-    if id not in db:
-        print(f"Error: Model with ID '{id}' not found.")
-        return
-
-    # Update the specified field with the new value
-    db[id][field] = value
+def update_entry(id, field, value, collection=None):
+    with db_transaction() as txn:
+        # Update the specified field with the new value
+        if not txn.update(id, field, value):
+            print(f"Error: Model with ID '{id}' not found.")
+            return
 
-    # Write the updated database back to the file
-    write_db(db)
+    ## keep the in-memory collection in sync, if we got one
+    if collection is not None:
+        collection.set_entry_data(id, field, value)
 
     print(f"Successfully updated {field} for model '{id}'.")
 
     
-def get_entry_data(id, field, default=None):
+def get_entry_data(id, field, default=None, collection=None):
+    if collection is not None:
+        return collection.get_entry_data(id, field, default)
+
+    if is_sqlite_db():
+        entry = sqlite_db.get_entry(db_filepath, id)
+        return entry.get(field, default) if entry is not None else default
+
     db = read_db()
     if id not in db:
         return default
     return db[id].get(field, default)
 
 def print_db_entry(id, 
+                   collection=None,
                    header_str=None, 
                    line_len=80, 
                    clear=False, 
@@ -130,20 +320,30 @@ def print_db_entry(id,
         print("-" * line_len)
     ## ------------------------------------------------------------------
 
-    url = get_entry_data(id, 'url', 'N/A')
-    local_filename = get_entry_data(id, 'local_filename', 'N/A')
-    model_type = get_entry_data(id, 'model_type', 'N/A')
-    model_base = get_entry_data(id, 'model_base', 'N/A')
+    ## only hit the db if the caller did not hand us the collection
+    if collection is None:
+        collection = load_collection()
+    entry = collection.get(id)
+    if entry is None:
+        print(f"Error: Model with ID '{id}' not found.")
+        return
+
+    url = entry.get('url', 'N/A')
+    local_filename = entry.get('local_filename', 'N/A')
+    model_type = entry.get('model_type', 'N/A')
+    model_base = entry.get('model_base', 'N/A')
     if mode=='detailed':
         ## load some extra data
-        download_date = get_entry_data(id, 'download_date', 'N/A')
-        tags = get_entry_data(id, 'tags', [])
+        download_date = entry.get('download_date', 'N/A')
+        tags = entry.get('tags', [])
+        sha256 = entry.get('sha256') or 'N/A'
         print(f"ID: {id}")
         print(f"URL: {url}")
         print(f"Local Filename: {local_filename}")
         print(f"Model Type: {model_type}")
         print(f"Model Base: {model_base}")
         print(f"Download Date: {download_date}")
+        print(f"SHA256: {sha256}")
         print(f"Tags: {', '.join(tags) if tags else 'None'}")
     elif mode=='minimal':
         print(f"[{id}] :: {model_type} / {model_base} / {local_filename}")
@@ -153,27 +353,31 @@ def print_db_entry(id,
         print("-" * line_len)
     ## ------------------------------------------------------------------
 
-def print_db_entries(id_list, line_len=80):
+def print_db_entries(id_list, collection=None, line_len=80):
+    ## load once up front, so printing stays linear in the number of entries
+    if collection is None and id_list:
+        collection = load_collection()
+
     if len(id_list)==0:
         print("No models found.")
     elif len(id_list)==1:
-        print_db_entry(id_list[0], line_len=line_len, mode='minimal',
+        print_db_entry(id_list[0], collection, line_len=line_len, mode='minimal',
                        divider_start=True, divider_end=True)
     elif len(id_list)==2:
-        print_db_entry(id_list[0], line_len=line_len, mode='minimal',
+        print_db_entry(id_list[0], collection, line_len=line_len, mode='minimal',
                        divider_start=True, divider_end=False)
-        print_db_entry(id_list[1], line_len=line_len, mode='minimal',
+        print_db_entry(id_list[1], collection, line_len=line_len, mode='minimal',
                        divider_start=False, divider_end=True)
     else:
         ## print the first entry with the divider start
-        print_db_entry(id_list[0], line_len=line_len, 
+        print_db_entry(id_list[0], collection, line_len=line_len, 
                     mode='minimal', divider_start=True, divider_end=False)
 
         ## now print the rest without the divider start
         for id in id_list[1:-1]:
-            print_db_entry(id, line_len=line_len,
+            print_db_entry(id, collection, line_len=line_len,
                         mode='minimal', divider_start=False, divider_end=False)
 
         ## now print the last entry with the divider end
-        print_db_entry(id_list[-1], line_len=line_len,
+        print_db_entry(id_list[-1], collection, line_len=line_len,
                     mode='minimal', divider_start=False, divider_end=True)
\ No newline at end of file
@@ -1,13 +1,22 @@
 import os
+import re
 import huggingface_hub
-import wget
-import subprocess
-from src.utils.generic import (get_huggingface_repo_id, 
-                               get_huggingface_filename, 
-                               validate_filename)
+import requests
+from src.utils.generic import (validate_filename,
+                               get_part_path)
+from src.utils.transfer import (download,
+                                DownloadError)
+from src.utils.http_cache import cached_get
+from src.utils.blobs import (is_blob_store_enabled,
+                             link_from_blob)
+from src.utils.urls import (parse_huggingface_file_url,
+                            get_huggingface_resolve_url,
+                            parse_civitai_url)
 
 def download_file(url, filename=None , download_dir="downloads"):
-    """Download a file from the given URL into a specific directory with a specific filename."""
+    """Download a file from the given URL into a specific directory with a specific filename.
+    returns the path of the file and its sha256
+    """
     if filename is None:
         filename = os.path.basename(url)
     
@@ -17,10 +26,14 @@ def download_file(url, filename=None , download_dir="downloads"):
     # Construct the full path for the downloaded file
     full_path = os.path.join(download_dir, filename)
     
-    # Download the file to the specified directory with the given filename
-    return wget.download(url, out=full_path)
+    # Download the file to the specified directory with the given filename,
+    # resuming a previous partial download if there is one, large files
+    # are fetched over several connections at once
+    result = download(url, full_path)
+    return result.filepath, result.sha256
 
 def download_file_from_hf(url, filename=None, download_dir="downloads"):
+    """ returns the local filename and the sha256 of the downloaded file """
     # Create the download directory if it doesn't exist
     os.makedirs(download_dir, exist_ok=True)
 
@@ -32,86 +45,110 @@ def download_file_from_hf(url, filename=None, download_dir="downloads"):
     # Construct the full path for the downloaded file
     full_path = os.path.join(download_dir, filename)
 
-    repo_id = get_huggingface_repo_id(url) ## extract repo_id from URL
-    filename_in_repo = get_huggingface_filename(url) ## extract filename from URL
+    ## extract the repo_id, revision and filename from the URL
+    repo_id, revision, filename_in_repo = parse_huggingface_file_url(url)
     print(f'repo id: {repo_id}, filename: {filename_in_repo}')
-    
-    # Download the file using huggingface_hub
-    huggingface_hub.hf_hub_download(
-        repo_id=repo_id,
-        filename=filename_in_repo,
-        local_dir=download_dir,
-        local_dir_use_symlinks=False
-    )
-    
-    ## now check fi the filename_in_repo is the same as the filename we wanted..
-    if filename!=filename_in_repo:
-        os.rename(os.path.join(download_dir, filename_in_repo), full_path)
 
-    return filename   
+    # Stream the file straight to its final name, resuming a previous partial download,
+    # and check what we got against the sha256 huggingface has on record for LFS files
+    resolve_url = get_huggingface_resolve_url(repo_id, revision, filename_in_repo)
+    headers = get_huggingface_auth_headers()
+    expected_sha256 = get_huggingface_lfs_sha256(resolve_url, headers)
+    if is_blob_store_enabled() and link_from_blob(expected_sha256, full_path):
+        ## we already have these exact bytes, e.g. the same vae under another name
+        print(f"Linked from the blob store: {full_path}")
+        return filename, expected_sha256
+    result = download(resolve_url, full_path, headers=headers, expected_sha256=expected_sha256)
+
+    return filename, result.sha256
+
+def get_huggingface_lfs_sha256(resolve_url, headers=None):
+    """ for LFS files the resolve endpoint answers with a redirect that carries
+    the sha256 of the file in the X-Linked-Etag header, None for non-LFS files
+    """
+    return get_huggingface_lfs_info(resolve_url, headers)[0]
+
+def get_huggingface_lfs_info(resolve_url, headers=None):
+    """ (sha256, size in bytes) of a file on huggingface from a single HEAD request
+    to the resolve endpoint, either is None if the headers don't carry it
+    """
+    try:
+        response = requests.head(resolve_url, headers=headers or {}, allow_redirects=False, timeout=30)
+    except requests.RequestException:
+        return None, None
+    sha256 = None
+    linked_etag = response.headers.get('X-Linked-Etag', '')
+    linked_etag = linked_etag.replace('W/', '').strip('"').lower()
+    ## git blob etags are 40 char sha1s, LFS etags are 64 char sha256s
+    if len(linked_etag) == 64 and all(c in '0123456789abcdef' for c in linked_etag):
+        sha256 = linked_etag
+    size = response.headers.get('X-Linked-Size')
+    return sha256, int(size) if size and size.isdigit() else None
+
+def get_huggingface_auth_headers():
+    token = os.getenv("HF_TOKEN") or huggingface_hub.get_token()
+    return {"Authorization": f"Bearer {token}"} if token else {}
 
 def download_file_from_civitai(url, filename=None, download_dir="downloads"):
-    # Create the download directory if it doesn't exist
-    os.makedirs(download_dir, exist_ok=True)
+    """ downloads the primary file of a civitai model version into its own directory,
+    `<model name>-mid_<model id>-vid_<version id>` (the name civitdl used) or `filename`.
+    the files are fetched into '<dir>.part' first, so the directory only shows up
+    once complete. returns the name of the directory and the sha256 of the primary file
+    """
+    model_id, version_id = parse_civitai_url(url)
+    version = get_civitai_version_info(model_id, version_id)
+    model_id = version.get('modelId') or model_id
+    version_id = version.get('id') or version_id
 
-    full_path = download_dir ## should be the download dir + the name of the dir thats created
+    files = version.get('files') or []
+    primary_file = next((f for f in files if f.get('primary')), files[0] if files else None)
+    if primary_file is None or not primary_file.get('downloadUrl'):
+        raise DownloadError(f"civitai model version {version_id} has no files to download")
 
-    # Get all directory names in the download_dir
-    existing_dirs_before = get_existing_dirs(download_dir)
+    model_name = (version.get('model') or {}).get('name') or 'model'
+    dirname = filename or f"{get_civitai_slug(model_name)}-mid_{model_id}-vid_{version_id}"
+    target_dir = os.path.join(download_dir, dirname)
+    staging_dir = get_part_path(target_dir)
+    os.makedirs(staging_dir, exist_ok=True)
 
-    # Use civitdl as a command-line process to download the file
-    try:
-        command = [
-            "civitdl",
-            url,
-            download_dir,
-        ]
-        
-        # Run the command and capture the output in real-time
-        process = subprocess.Popen(command, stdout=subprocess.PIPE, stderr=subprocess.STDOUT, universal_newlines=True)
-        
-        # Print the output (including progress bar) in real-time
-        for line in process.stdout:
-            print(line, end='')  # end='' to avoid double line breaks
-        
-        # Wait for the process to complete and get the return code
-        return_code = process.wait()
-        
-        if return_code == 0:
-            try:
-                # Check for new directories after download
-                existing_dirs_after = get_existing_dirs(download_dir)
-                new_model_dirname = list(set(existing_dirs_after) - set(existing_dirs_before))
-                
-                if new_model_dirname:
-                    # If a new directory was created, update the full_path
-                    full_path = os.path.join(download_dir, new_model_dirname[0])
-                    dirname = new_model_dirname[0]
-                    print(f"New directory created: {full_path}")
-                    
-                    # If a filename was provided, rename the directory
-                    if filename:
-                        new_full_path = os.path.join(download_dir, filename)
-                        os.rename(full_path, new_full_path)
-                        full_path = new_full_path
-                        dirname = filename
-                        print(f"Directory renamed to: {full_path}")
-                    
-                    return dirname
-                else:
-                    print("No new directory was created during download.")
-            except Exception as e:
-                print(f"Error occurred while checking for new directories: {str(e)}")
-                return None
-        else:
-            print(f"Error downloading file from Civitai. Return code: {return_code}")
-            return None
-    except subprocess.CalledProcessError as e:
-        print(f"Error running civitdl: {e}")
-        return None
-    except Exception as e:
-        print(f"Unexpected error downloading file from Civitai: {e}")
-        return None
-    
-def get_existing_dirs(dir):
-    return [d for d in os.listdir(dir) if os.path.isdir(os.path.join(dir, d))]
\ No newline at end of file
+    file_path = os.path.join(staging_dir, os.path.basename(primary_file['name']))
+    expected_sha256 = ((primary_file.get('hashes') or {}).get('SHA256') or '').lower() or None
+    print(f"civitai model: {model_id}, version: {version_id}, file: {primary_file['name']}")
+    result = download(primary_file['downloadUrl'], file_path,
+                      headers=get_civitai_auth_headers(), expected_sha256=expected_sha256)
+
+    if os.path.isdir(target_dir):
+        ## an earlier, incomplete download of the same version, keep whatever else it has
+        for name in os.listdir(staging_dir):
+            os.replace(os.path.join(staging_dir, name), os.path.join(target_dir, name))
+        os.rmdir(staging_dir)
+    else:
+        os.replace(staging_dir, target_dir)
+    print(f"New directory created: {target_dir}")
+    return dirname, result.sha256
+
+def get_civitai_version_info(model_id, version_id=None):
+    """ the api info of the model version, the latest one if we only know the model """
+    if version_id is None:
+        if model_id is None:
+            raise DownloadError("could not find a civitai model or version id in the url")
+        model = fetch_civitai_api_json(f"https://civitai.com/api/v1/models/{model_id}")
+        versions = model.get('modelVersions') or []
+        if not versions:
+            raise DownloadError(f"civitai model {model_id} has no versions")
+        version_id = versions[0]['id']
+    return fetch_civitai_api_json(f"https://civitai.com/api/v1/model-versions/{version_id}")
+
+def fetch_civitai_api_json(api_url):
+    response = cached_get(api_url, headers=get_civitai_auth_headers())
+    if response.status_code != 200:
+        raise DownloadError(f"{api_url} returned status {response.status_code}")
+    return response.json()
+
+def get_civitai_auth_headers():
+    api_key = os.getenv("CIVITAI_API_KEY")
+    return {"Authorization": f"Bearer {api_key}"} if api_key else {}
+
+def get_civitai_slug(name):
+    """ a model name as a directory name, e.g. 'Detail Tweaker (LoRA)' -> 'Detail_Tweaker_LoRA' """
+    return re.sub(r"[^\w\-.]+", "_", name).strip("_.") or "model"
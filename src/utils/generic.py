@@ -1,15 +1,16 @@
 import os
-import huggingface_hub
-import yaml
-from dotenv import load_dotenv
-load_dotenv()
+from src.utils import config
 
 hf_token = os.getenv("HF_TOKEN")
-config_path = os.path.join(os.path.dirname(os.path.dirname(__file__)), os.path.pardir, 'config.yaml')
+
+## downloads go into '<name>.part' first and are only renamed once complete
+PART_SUFFIX = '.part'
 
 def log_into_huggingface():
+    import huggingface_hub ## heavy, only imported by the commands that download
+
     ## check if we already logged in
-    if huggingface_hub.HfFolder.get_token() is not None:
+    if huggingface_hub.get_token() is not None:
         return
 
     ## if we have a token, use it
@@ -26,10 +27,26 @@ def get_absolute_model_filepath(filename, model_type, model_base):
 
     return os.path.join(model_store_directory, model_type, model_base, filename)
 
+def get_cozy_data_dir():
+    """ where cozy keeps its caches, COZY_DATA_DIR or ~/.cache/cozy-manager """
+    data_dir = os.getenv("COZY_DATA_DIR") or os.path.join(os.path.expanduser("~"), ".cache", "cozy-manager")
+    os.makedirs(data_dir, exist_ok=True)
+    return data_dir
+
+def get_part_path(filepath):
+    return f"{filepath}{PART_SUFFIX}"
+
+def has_partial_download(filepath):
+    """ True if an unfinished download for this path is lying around """
+    return os.path.exists(get_part_path(filepath))
+
 def is_model_local(filename, model_type, model_base):
-    filepath = get_absolute_model_filepath(filename, model_type, model_base)
+    return is_path_local(get_absolute_model_filepath(filename, model_type, model_base))
+
+def is_path_local(filepath):
     if os.path.isfile(filepath):
-        return True
+        ## a leftover .part file means the last download never finished
+        return not has_partial_download(filepath)
     elif os.path.isdir(filepath):
         # Check if the directory is not empty
         return len(os.listdir(filepath)) > 0
@@ -37,21 +54,12 @@ def is_model_local(filename, model_type, model_base):
 
 
 def sanitize_and_validate_arg_input(arg_input, mapping_type):
+    correct_value = config.lookup_alias(arg_input, mapping_type)
+    if correct_value is not None:
+        return correct_value
+
     arg_input = arg_input.lower().strip()
-    
-    # Load mappings from YAML file
-    with open(config_path, 'r') as config_file:
-        data = yaml.safe_load(config_file)
-        mappings = data[mapping_type]
-    
-    for correct_value, variations in mappings.items():
-        if arg_input==correct_value:
-            return correct_value
-
-        variations = [v.lower().strip() for v in variations]
-        if arg_input in variations:
-            return correct_value
-    
+    mappings = config.get_config()[mapping_type]
     error_type = "model_type" if mapping_type == 'model_type_names' else "model_base"
     raise ValueError(f"Invalid {error_type}: >> {arg_input} << "
                      f"Please use one of the supported {error_type}s: {', '.join(mappings.keys())}, "
@@ -71,10 +79,7 @@ def clear_terminal():
 
 def get_filenames_to_auto_rename():
     """Read the config.yaml file and return the filenames_to_auto_rename list."""
-    with open(config_path, 'r') as config_file:
-        config_data = yaml.safe_load(config_file)
-    
-    return config_data.get('filenames_to_auto_rename', [])
+    return config.get_filenames_to_auto_rename()
 
 def get_size_of_path(path):
     """ returns the size of the path in megabytes
@@ -98,6 +103,30 @@ def get_size_of_path(path):
     total_size = round(total_size / (1024 * 1024), 2)
     return total_size
 
+## binary units, what df -h and most file managers show
+SIZE_UNITS = {'': 1, 'b': 1, 'k': 1024, 'm': 1024 ** 2, 'g': 1024 ** 3, 't': 1024 ** 4}
+
+def parse_size(size_str):
+    """ parses a size like '200G', '1.5TB', '500mb' or '1024' into bytes """
+    value = size_str.strip().lower()
+    if value.endswith('ib'):
+        value = value[:-2]
+    elif value.endswith('b') and len(value) > 1 and value[-2] in SIZE_UNITS:
+        value = value[:-1]
+    unit = value[-1] if value and value[-1] in SIZE_UNITS else ''
+    number = value[:-1] if unit else value
+    try:
+        return int(float(number) * SIZE_UNITS[unit])
+    except ValueError:
+        raise ValueError(f"Invalid size: >> {size_str} << use e.g. 200G, 1.5T or 500M")
+
+def format_size(num_bytes):
+    for unit in ('B', 'KB', 'MB', 'GB'):
+        if abs(num_bytes) < 1024:
+            return f"{num_bytes:.2f} {unit}" if unit != 'B' else f"{num_bytes} B"
+        num_bytes /= 1024
+    return f"{num_bytes:.2f} TB"
+
 def get_huggingface_repo_id(url):
     return "/".join(url.split("/")[3:5])
 
@@ -0,0 +1,203 @@
+import os
+import json
+import time
+import hashlib
+import threading
+from urllib.parse import urlparse, parse_qsl, urlencode
+from src.utils import config
+from src.utils.generic import get_cozy_data_dir
+
+CACHE_DIRNAME = 'http_cache'
+
+## defaults for the `http_cache` section of the config.yaml
+DEFAULT_TTL_HOURS = 24
+DEFAULT_MAX_SIZE_MB = 256
+## eviction goes down to this share of max_size_mb, so it doesn't run again on the very next write
+EVICT_TO_SHARE = 0.9
+
+## running total of the cache size in bytes, so a write doesn't have to list the
+## whole cache to know whether to evict. None until the first write of the process
+_cache_size = None
+_cache_size_lock = threading.Lock()
+
+
+class CachedResponse:
+    """ the bits of a requests.Response the metadata code uses """
+    __slots__ = ('url', 'status_code', 'text', 'etag', 'fetched_at', 'from_cache')
+
+    def __init__(self, url, status_code, text, etag=None, fetched_at=None, from_cache=False):
+        self.url = url
+        self.status_code = status_code
+        self.text = text
+        self.etag = etag
+        self.fetched_at = fetched_at if fetched_at is not None else time.time()
+        self.from_cache = from_cache
+
+    def json(self):
+        return json.loads(self.text)
+
+    def to_dict(self):
+        return {
+            'url': self.url,
+            'status_code': self.status_code,
+            'etag': self.etag,
+            'fetched_at': self.fetched_at,
+            'text': self.text,
+        }
+
+
+def is_offline():
+    """ with COZY_OFFLINE=1 we never hit the network and serve stale entries instead """
+    return os.getenv("COZY_OFFLINE", "").lower() in ("1", "true", "yes")
+
+def get_cache_settings():
+    settings = {
+        'ttl_hours': DEFAULT_TTL_HOURS,
+        'max_size_mb': DEFAULT_MAX_SIZE_MB,
+    }
+    settings.update(config.get_config().get('http_cache') or {})
+    return settings
+
+def get_cache_dir():
+    return os.path.join(get_cozy_data_dir(), CACHE_DIRNAME)
+
+def get_cache_key(url):
+    """ lowercase host, no scheme, fragment or trailing slash, sorted query """
+    parsed = urlparse(url.strip())
+    query = urlencode(sorted(parse_qsl(parsed.query)))
+    key = f"{(parsed.hostname or '').lower()}{parsed.path.rstrip('/')}"
+    return f"{key}?{query}" if query else key
+
+def get_cache_path(url):
+    digest = hashlib.sha256(get_cache_key(url).encode('utf-8')).hexdigest()
+    return os.path.join(get_cache_dir(), digest[:2], f"{digest}.json")
+
+def cached_get(url, headers=None, before_request=None):
+    """ GET with a persistent cache: fresh entries are served without any network
+    round trip, stale ones are revalidated with If-None-Match, and when offline
+    (or the network fails) stale entries are served as they are.
+    before_request(url) is called right before going to the network, e.g. to rate limit
+    """
+    settings = get_cache_settings()
+    ttl = float(settings['ttl_hours']) * 3600
+    cache_path = get_cache_path(url)
+    cached = read_cache_entry(cache_path)
+
+    if cached is not None and time.time() - cached.fetched_at < ttl:
+        touch(cache_path)
+        return cached
+
+    if is_offline():
+        if cached is not None:
+            print(f"--- offline, using cached response from {time.ctime(cached.fetched_at)}: {url}")
+            touch(cache_path)
+            return cached
+        print(f"--- offline, and no cached response for: {url}")
+        return CachedResponse(url, 504, '')
+
+    import requests
+    request_headers = dict(headers or {})
+    if cached is not None and cached.etag:
+        request_headers['If-None-Match'] = cached.etag
+
+    if before_request is not None:
+        before_request(url)
+    try:
+        response = requests.get(url, headers=request_headers, timeout=60)
+    except requests.RequestException as e:
+        if cached is not None:
+            print(f"--- request failed ({e}), using cached response: {url}")
+            return cached
+        raise
+
+    if response.status_code == 304 and cached is not None:
+        ## still valid, just restart the ttl
+        cached.fetched_at = time.time()
+        write_cache_entry(cache_path, cached, settings)
+        return cached
+
+    fresh = CachedResponse(url, response.status_code, response.text,
+                           etag=response.headers.get('ETag'))
+    if response.status_code == 200:
+        write_cache_entry(cache_path, fresh, settings)
+    return fresh
+
+def read_cache_entry(cache_path):
+    try:
+        with open(cache_path, 'r') as f:
+            data = json.load(f)
+    except (OSError, ValueError):
+        return None
+    return CachedResponse(data['url'], data['status_code'], data['text'],
+                          etag=data.get('etag'), fetched_at=data.get('fetched_at', 0),
+                          from_cache=True)
+
+def write_cache_entry(cache_path, response, settings):
+    global _cache_size
+    os.makedirs(os.path.dirname(cache_path), exist_ok=True)
+    ## the refresh workers write from several threads of the same process
+    tmp_path = f"{cache_path}.{os.getpid()}.{threading.get_ident()}.tmp"
+    try:
+        old_size = os.path.getsize(cache_path) if os.path.exists(cache_path) else 0
+        with open(tmp_path, 'w') as f:
+            json.dump(response.to_dict(), f)
+        new_size = os.path.getsize(tmp_path)
+        os.replace(tmp_path, cache_path)
+    except OSError as e:
+        print(f"--- warning:: could not write http cache entry: {e}")
+        return
+
+    max_size = int(float(settings['max_size_mb']) * 1024 * 1024)
+    with _cache_size_lock:
+        if _cache_size is None:
+            _cache_size = get_cache_size()
+        else:
+            _cache_size += new_size - old_size
+        if _cache_size > max_size:
+            _cache_size = evict(max_size)
+
+def touch(cache_path):
+    """ the mtime of an entry is its last use, that's what the LRU eviction goes by """
+    try:
+        os.utime(cache_path)
+    except OSError:
+        pass
+
+def list_cache_entries():
+    """ [(mtime, size, path), ...] of every entry in the cache """
+    entries = []
+    cache_dir = get_cache_dir()
+    for prefix in os.scandir(cache_dir):
+        if not prefix.is_dir():
+            continue
+        for entry in os.scandir(prefix.path):
+            if entry.name.endswith('.tmp'):
+                continue ## still being written by another thread or process
+            try:
+                stat = entry.stat()
+            except OSError:
+                continue
+            entries.append((stat.st_mtime, stat.st_size, entry.path))
+    return entries
+
+def get_cache_size():
+    return sum(size for mtime, size, path in list_cache_entries())
+
+def evict(max_size):
+    """ once the cache is over max_size bytes, drops the least recently used entries
+    until it is down to EVICT_TO_SHARE of it. returns the size of the cache afterwards
+    """
+    entries = list_cache_entries()
+    total_size = sum(size for mtime, size, path in entries)
+    if total_size <= max_size:
+        return total_size
+    max_size = int(max_size * EVICT_TO_SHARE)
+    for mtime, size, path in sorted(entries):
+        try:
+            os.remove(path)
+        except OSError:
+            continue
+        total_size -= size
+        if total_size <= max_size:
+            break
+    return total_size
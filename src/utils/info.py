@@ -6,8 +6,23 @@ from src.utils.db import create_entry
 def create_download_info(url, 
                          filename, 
                          model_type,
-                         model_base):
+                         model_base,
+                         collection=None,
+                         sha256=None):
+    """ creates the db entry for a freshly downloaded model,
+    and adds it to the in-memory collection if one is passed in
     """
+    new_info = build_download_info(url, filename, model_type, model_base, sha256=sha256)
+
+    ## now lets add it to the db
+    id = create_entry(new_info)
+    if collection is not None:
+        collection.add(id, new_info)
+    return id
+
+def build_download_info(url, filename, model_type, model_base, sha256=None):
+    """ returns the db entry for a freshly downloaded model without writing it,
+    so a batch of them can be committed in one go
     """
     filepath = get_absolute_model_filepath(filename, model_type, model_base)
 
@@ -31,7 +46,8 @@ def create_download_info(url,
         "source_name": source_name,
         "model_type": model_type,
         "model_base": model_base,
-        "file_size_mb": round(file_size_mb, 2)  # Round to 2 decimal places
+        "file_size_mb": round(file_size_mb, 2),  # Round to 2 decimal places
+        "sha256": sha256, ## computed while downloading, for civitai the one of the primary file
     }
     
     if "huggingface.co" in url:
@@ -48,5 +64,4 @@ def create_download_info(url,
     new_info['tags'] = []
     new_info['force_keep'] = False ## if true the file will not be deleted when running the cleanup script
 
-    ## now lets add it to the db
-    create_entry(new_info)
\ No newline at end of file
+    return new_info
\ No newline at end of file
@@ -0,0 +1,166 @@
+import os
+import json
+import hashlib
+from src.utils import config
+from src.utils.generic import (get_cozy_data_dir,
+                               get_part_path,
+                               get_size_of_path,
+                               is_path_local)
+from src.utils.blobs import BLOB_DIRNAME
+
+SNAPSHOT_DIRNAME = 'inventory'
+SNAPSHOT_VERSION = 1
+
+
+class Inventory:
+    """ everything under MODEL_STORAGE_DIR from a single walk, as
+    path -> (size, mtime, is_dir). directories carry the total size of what's in them.
+    paths outside the storage dir are answered with a regular stat
+    """
+    def __init__(self, root, dirs):
+        self.root = os.path.normpath(root)
+        self.entries = {}
+        self.child_counts = {}
+        self._add_dir('', dirs)
+
+    def _add_dir(self, rel_dir, dirs):
+        """ flattens the {rel_dir: {'mtime', 'children'}} listing, returns the dir size """
+        children = dirs.get(rel_dir, {}).get('children', {})
+        total_size = 0
+        for name, (size, mtime, is_dir) in children.items():
+            rel_path = os.path.join(rel_dir, name) if rel_dir else name
+            if is_dir:
+                size = self._add_dir(rel_path, dirs)
+            self.entries[rel_path] = (size, mtime, is_dir)
+            total_size += size
+        self.child_counts[rel_dir] = len(children)
+        return total_size
+
+    def _relpath(self, path):
+        path = os.path.normpath(path)
+        if path == self.root:
+            return ''
+        if not path.startswith(self.root + os.sep):
+            return None
+        return path[len(self.root) + 1:]
+
+    def stat(self, path):
+        """ (size, mtime, is_dir) of path, or None if it doesn't exist """
+        rel_path = self._relpath(path)
+        if rel_path is not None:
+            return self.entries.get(rel_path)
+        try:
+            st = os.stat(path)
+        except OSError:
+            return None
+        is_dir = os.path.isdir(path)
+        return (st.st_size, st.st_mtime, is_dir)
+
+    def exists(self, path):
+        return self.stat(path) is not None
+
+    def is_model_local(self, filepath):
+        """ same answer as generic.is_model_local, without touching the disk """
+        rel_path = self._relpath(filepath)
+        if rel_path is None:
+            return is_path_local(filepath)
+        info = self.entries.get(rel_path)
+        if info is None:
+            return False
+        if info[2]:
+            return self.child_counts.get(rel_path, 0) > 0
+        ## a leftover .part file means the last download never finished
+        return get_part_path(rel_path) not in self.entries
+
+    def size_of(self, path):
+        """ size in bytes of a file, or of everything in a directory, 0 if missing """
+        info = self.stat(path)
+        if info is None:
+            return 0
+        if info[2] and self._relpath(path) is None:
+            return int(get_size_of_path(path) * 1024 * 1024)
+        return info[0]
+
+
+def is_snapshot_enabled():
+    storage = config.get_config().get('storage') or {}
+    return bool(storage.get('inventory_snapshot', False))
+
+def get_snapshot_path(root):
+    digest = hashlib.sha256(os.path.abspath(root).encode('utf-8')).hexdigest()[:16]
+    return os.path.join(get_cozy_data_dir(), SNAPSHOT_DIRNAME, f"{digest}.json")
+
+def get_inventory(root=None, use_snapshot=None):
+    """ walks the storage dir once. with the snapshot enabled only the directories
+    whose mtime changed since the last walk are listed again, the others are
+    taken from the snapshot. a directory's mtime changes whenever a file is
+    added, removed or renamed in it, so presence is always up to date, the size
+    of a file that was rewritten in place is not
+    """
+    root = root or os.getenv("MODEL_STORAGE_DIR")
+    if use_snapshot is None:
+        use_snapshot = is_snapshot_enabled()
+
+    previous = read_snapshot(root) if use_snapshot else {}
+    dirs = {}
+    if os.path.isdir(root):
+        scan_dir(root, '', previous, dirs)
+
+    if use_snapshot and dirs != previous:
+        write_snapshot(root, dirs)
+    return Inventory(root, dirs)
+
+def scan_dir(abs_dir, rel_dir, previous, dirs):
+    """ lists abs_dir into dirs[rel_dir] = {'mtime': ns, 'children': {name: [size, mtime, is_dir]}}
+    and recurses into the sub directories
+    """
+    try:
+        dir_mtime = os.stat(abs_dir).st_mtime_ns
+    except OSError:
+        return
+
+    cached = previous.get(rel_dir)
+    if cached is not None and cached['mtime'] == dir_mtime:
+        children = cached['children']
+    else:
+        children = {}
+        try:
+            with os.scandir(abs_dir) as it:
+                for entry in it:
+                    if not rel_dir and entry.name == BLOB_DIRNAME:
+                        continue ## the views already point at those bytes
+                    try:
+                        is_dir = entry.is_dir()
+                        st = entry.stat()
+                    except OSError:
+                        continue
+                    children[entry.name] = [0 if is_dir else st.st_size, st.st_mtime, is_dir]
+        except OSError:
+            return
+
+    dirs[rel_dir] = {'mtime': dir_mtime, 'children': children}
+    for name, (size, mtime, is_dir) in children.items():
+        if is_dir:
+            rel_path = os.path.join(rel_dir, name) if rel_dir else name
+            scan_dir(os.path.join(abs_dir, name), rel_path, previous, dirs)
+
+def read_snapshot(root):
+    try:
+        with open(get_snapshot_path(root), 'r') as f:
+            snapshot = json.load(f)
+    except (OSError, ValueError):
+        return {}
+    if snapshot.get('version') != SNAPSHOT_VERSION or snapshot.get('root') != os.path.abspath(root):
+        return {}
+    return snapshot.get('dirs') or {}
+
+def write_snapshot(root, dirs):
+    snapshot_path = get_snapshot_path(root)
+    os.makedirs(os.path.dirname(snapshot_path), exist_ok=True)
+    tmp_path = f"{snapshot_path}.{os.getpid()}.tmp"
+    try:
+        with open(tmp_path, 'w') as f:
+            json.dump({'version': SNAPSHOT_VERSION, 'root': os.path.abspath(root), 'dirs': dirs}, f)
+        os.replace(tmp_path, snapshot_path)
+    except OSError as e:
+        print(f"--- warning:: could not write the inventory snapshot: {e}")
@@ -1,12 +1,21 @@
 import os
 import re
-import yaml
-import requests
-from bs4 import BeautifulSoup
+from src.utils import config
+from src.utils.http_cache import cached_get
+from src.utils.classifier import classify_html
+from src.utils.config import lookup_alias
+from src.utils.urls import parse_huggingface_file_url
 from src.utils.generic import (sanitize_and_validate_arg_input, 
                                sanitize_huggingface_file_to_repo_url)
 
-config_path = os.path.join(os.path.dirname(os.path.dirname(__file__)), os.path.pardir, 'config.yaml')
+## file types that hold the weights we are after, the rest of a repo is configs and docs
+WEIGHT_FILE_EXTENSIONS = ('.safetensors', '.ckpt', '.pt', '.pth', '.bin', '.gguf')
+
+## a diffusers repo with one of these pipelines is a full model
+FULL_PIPELINE_TAGS = ('text-to-image', 'image-to-image', 'text-to-video')
+
+## shorter aliases like 'ae' or 'cn' are too ambiguous to look for inside other words
+MIN_SUBSTRING_ALIAS_LEN = 4
 
 def get_model_info(url, verbose=False):
     """ gets the model_type and the base_model from a url, works for both huggingface and civitai
@@ -17,8 +26,7 @@ def get_model_info(url, verbose=False):
     if 'civitai' in url:
         return get_civitai_model_info(url, verbose)
     elif 'huggingface' in url:
-        url = sanitize_huggingface_file_to_repo_url(url)
-        return distill_model_metadata_from_webpage(url, verbose)
+        return get_huggingface_model_info(url, verbose)
     else:
         print('url not supported')
         return None, None
@@ -34,7 +42,7 @@ def get_civitai_model_info(url, verbose=False):
     else:
         api_url = f"https://civitai.com/api/v1/models/{model_id}"
     
-    response = requests.get(api_url)
+    response = cached_get(api_url)
     
     if response.status_code == 200:
         data = response.json()
@@ -78,23 +86,122 @@ def get_civitai_model_ids(url):
         "version_id": version_id
     }
 
+def get_huggingface_model_info(url, verbose=False):
+    """ classifies a huggingface repo (or a file in it) from the structured repo
+    info of the hub api, the word count on the rendered page is only used for
+    whatever the api info doesn't tell us
+    """
+    repo_id, revision, path_in_repo = parse_huggingface_file_url(url)
+    info = fetch_huggingface_repo_info(repo_id)
+
+    model_type, base_model = None, None
+    if info is not None:
+        model_type, base_model = classify_huggingface_repo_info(info, path_in_repo)
+        if verbose:
+            print('api base:', base_model)
+            print('api type:', model_type)
+
+    if model_type is None or base_model is None:
+        repo_url = sanitize_huggingface_file_to_repo_url(url)
+        page_type, page_base = distill_model_metadata_from_webpage(repo_url, verbose)
+        model_type = model_type or page_type
+        base_model = base_model or page_base
+
+    return model_type, base_model
+
+def fetch_huggingface_repo_info(repo_id):
+    """ the api json for a repo: tags, cardData, library_name, pipeline_tag and siblings.
+    a few KB instead of the few hundred KB of the rendered model card
+    """
+    from src.utils.download import get_huggingface_auth_headers ## gated repos need the token
+
+    response = cached_get(f"https://huggingface.co/api/models/{repo_id}",
+                          headers=get_huggingface_auth_headers())
+    if response.status_code != 200:
+        print(f"--- could not fetch the repo info for {repo_id} (status {response.status_code}), falling back to the model card")
+        return None
+    try:
+        return response.json()
+    except ValueError:
+        return None
+
+def classify_huggingface_repo_info(info, path_in_repo=''):
+    """ takes the repo info as returned by the hub api and returns (model_type, base_model),
+    either can be None. every field is checked in a fixed order and the first one
+    that maps onto a known alias wins, so the same info always gives the same result
+    """
+    tags = [str(tag) for tag in info.get('tags') or []]
+    ## 'license:other', 'region:us' and the like say nothing about the model
+    plain_tags = [tag for tag in tags if ':' not in tag]
+    card_data = info.get('cardData') or {}
+    filename = os.path.basename(path_in_repo or '')
+
+    ## e.g. 'base_model:adapter:black-forest-labs/FLUX.1-dev'
+    base_models = card_data.get('base_model') or []
+    if isinstance(base_models, str):
+        base_models = [base_models]
+    base_models = list(base_models) + [tag.split(':')[-1] for tag in tags if tag.startswith('base_model:')]
+    weight_files = [sibling.get('rfilename', '') for sibling in info.get('siblings') or []
+                    if sibling.get('rfilename', '').endswith(WEIGHT_FILE_EXTENSIONS)]
+
+    repo_id = info.get('id') or info.get('modelId') or ''
+    base_candidates = base_models + [repo_id] + plain_tags + [filename]
+    base_model = first_alias_match(base_candidates, 'model_base_names')
+
+    type_candidates = plain_tags + [repo_id, filename]
+    model_type = first_alias_match(type_candidates, 'model_type_names')
+    if model_type is None and any(tag.startswith('base_model:adapter:') for tag in tags):
+        model_type = lookup_alias('lora', 'model_type_names')
+    if model_type is None and info.get('library_name') == 'diffusers' and info.get('pipeline_tag') in FULL_PIPELINE_TAGS:
+        model_type = lookup_alias('checkpoint', 'model_type_names')
+    if model_type is None:
+        model_type = first_alias_match(weight_files, 'model_type_names')
+
+    return model_type, base_model
+
+def first_alias_match(candidates, mapping_type):
+    for candidate in candidates:
+        match = match_alias(candidate, mapping_type)
+        if match is not None:
+            return match
+    return None
+
+def match_alias(text, mapping_type):
+    """ maps a tag, repo id or filename onto a canonical name: the whole text,
+    then its words, then the longest alias it contains
+    """
+    text = text.lower().strip()
+    if not text:
+        return None
+    match = lookup_alias(text, mapping_type)
+    if match is not None:
+        return match
+
+    for word in re.split(r'[^a-z0-9]+', os.path.splitext(text)[0]):
+        if word and lookup_alias(word, mapping_type) is not None:
+            return lookup_alias(word, mapping_type)
+
+    aliases = [alias for names in config.get_model_aliases(mapping_type) for alias in names
+               if len(alias) >= MIN_SUBSTRING_ALIAS_LEN and alias in text]
+    if aliases:
+        return lookup_alias(max(aliases, key=len), mapping_type)
+    return None
+
 def distill_model_metadata_from_webpage(url, verbose=False):
     """ mainly used for huggingface, as base and type 
     categories are not always clearly defined
     """
-    content = parse_url_to_text(url)
-
-    ## first grab all the aliases for the types and the bases
-    base_name_list = get_model_aliases('model_base_names')
-    model_type_list = get_model_aliases('model_type_names')
+    html = fetch_url_html(url)
+    if html is None:
+        return None, None
 
-    ## count he occurances on the page and assign a confidence value to each 
-    base_model_confidences = calculate_model_confidences(content, base_name_list)
-    model_type_confidences = calculate_model_confidences(content, model_type_list)
+    ## count the occurances of all the type and base aliases on the page in a
+    ## single pass and assign a confidence value to each 
+    confidences = classify_html(html)
 
     ## distill the highest confidence base and model type
-    highest_base_model = get_highest_confidence(base_model_confidences)
-    highest_model_type = get_highest_confidence(model_type_confidences)
+    highest_base_model = get_highest_confidence(confidences['model_base_names'])
+    highest_model_type = get_highest_confidence(confidences['model_type_names'])
 
     if verbose:
         print('distilled base:', highest_base_model)
@@ -102,19 +209,13 @@ def distill_model_metadata_from_webpage(url, verbose=False):
 
     return highest_model_type, highest_base_model 
     
-def parse_url_to_text(url):
-    # Send a GET request to the URL
-    response = requests.get(url)
+def fetch_url_html(url):
+    # Send a GET request to the URL, repeat lookups are served from the cache
+    response = cached_get(url)
     
     # Check if the request was successful
     if response.status_code == 200:
-        # Parse the HTML content
-        soup = BeautifulSoup(response.text, 'html.parser')
-        
-        # Extract all text from the parsed HTML
-        text = soup.get_text(separator=' ', strip=True)
-        
-        return text
+        return response.text
     else:
         print(f"Error: Unable to fetch the webpage. Status code: {response.status_code}")
         return None
@@ -123,10 +224,7 @@ def get_model_list(config_key_name):
     """ returns the top level key names for model_type_names or model_base_names
     as stored in the config.yaml file
     """
-    with open(config_path, 'r') as f:
-        data = yaml.safe_load(f)
-
-    return list(data[config_key_name].keys())
+    return config.get_model_list(config_key_name)
 
 
 
@@ -136,51 +234,7 @@ def get_model_aliases(config_key_name):
     """ takes a config_key_name like 'model_base_names' or 'model_type_names' 
     and returns a nested list of model names and their aliases
     """
-    with open(config_path, 'r') as f:
-        data = yaml.safe_load(f)
-
-    model_names= []
-    for name, aliases in data[config_key_name].items():
-        aliases = data[config_key_name].get(name, []) ## get all the aliases for the model base name
-        combined_list = [name] + aliases ## combine the main name with its aliases
-        combined_list = [x.lower() for x in combined_list] ## lowercase all
-        combined_list = list(set(combined_list)) ## remove duplicates
-        ## make sure to move the base_name to the front
-        combined_list.remove(name.lower())
-        combined_list.insert(0, name.lower())
-        model_names.append(combined_list)
-
-    return model_names 
-
-def count_word_occurences_in_text(text, word_list):
-    word_counts = {}
-    # Convert text to lowercase for case-insensitive matching
-    text = text.lower()
-    
-    for word in word_list:
-        # Convert each word to lowercase
-        word = word.lower()
-        # Count occurrences of the word in the text
-        count = text.count(word)
-        word_counts[word] = count
-    
-    return word_counts
-
-def calculate_model_confidences(content, name_list):
-    confidences = {}
-    total_occurrences = 0
-    
-    for base_list in name_list:
-        key = base_list[0]  # Assume the first item is the key name
-        occurrences = sum(count_word_occurences_in_text(content, base_list).values())
-        confidences[key] = occurrences
-        total_occurrences += occurrences
-    
-    # Calculate confidence levels
-    for key in confidences:
-        confidences[key] = confidences[key] / total_occurrences if total_occurrences > 0 else 0
-    
-    return confidences
+    return config.get_model_aliases(config_key_name)
 
 def get_highest_confidence(confidence_dict, threshold=0.5):
     if not confidence_dict:
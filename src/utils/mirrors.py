@@ -0,0 +1,244 @@
+import os
+import json
+import shutil
+import hashlib
+import threading
+from urllib.parse import quote
+from src.utils import config
+from src.utils.generic import (get_part_path,
+                               has_partial_download)
+from src.utils.store_index import load_store_index
+
+## the file a mirror describes its store with, both in a mirror directory and on a `cozy serve` node
+INDEX_FILENAME = 'index.json'
+COPY_CHUNK_SIZE = 8 * 1024 * 1024
+INDEX_TIMEOUT = 10
+
+_indexes = {}  ## mirror -> StoreIndex, or None if it has no (readable) index
+_indexes_lock = threading.Lock()
+
+
+def get_mirrors():
+    """ the `mirrors` of the config.yaml, in order, as dicts with either a `path` or an `url` """
+    mirrors = []
+    for mirror in config.get_config().get('mirrors') or []:
+        if isinstance(mirror, str):
+            mirror = {'url': mirror} if mirror.startswith(('http://', 'https://')) else {'path': mirror}
+        if mirror.get('path') or mirror.get('url'):
+            mirrors.append(mirror)
+    return mirrors
+
+def get_mirror_name(mirror):
+    return mirror.get('url') or mirror.get('path')
+
+def fetch_from_mirrors(url, download_dir, filename=None, sha256=None):
+    """ tries to get the file from the configured mirrors before we go upstream.
+    returns (filename, sha256) like fetch_model_file, or None if no mirror has it
+    """
+    for mirror in get_mirrors():
+        try:
+            if mirror.get('url'):
+                fetched = fetch_from_http_mirror(mirror, url, download_dir, filename, sha256)
+            else:
+                fetched = fetch_from_dir_mirror(mirror, url, download_dir, filename, sha256)
+        except Exception as e:
+            print(f"--- warning:: mirror {get_mirror_name(mirror)} failed, trying the next source: {e}")
+            continue
+        if fetched is not None:
+            print(f"File fetched from mirror {get_mirror_name(mirror)}: {fetched[0]}")
+            return fetched
+    return None
+
+def get_mirror_index(mirror):
+    """ the index of the mirror, read once per process """
+    name = get_mirror_name(mirror)
+    with _indexes_lock:
+        if name in _indexes:
+            return _indexes[name]
+    index = None
+    try:
+        if mirror.get('url'):
+            import requests
+            response = requests.get(f"{mirror['url'].rstrip('/')}/{INDEX_FILENAME}", timeout=INDEX_TIMEOUT)
+            response.raise_for_status()
+            index = load_store_index(response.json())
+        else:
+            index_path = os.path.join(mirror['path'], INDEX_FILENAME)
+            if os.path.isfile(index_path):
+                with open(index_path, 'r') as f:
+                    index = load_store_index(json.load(f))
+    except Exception as e:
+        print(f"--- warning:: could not read the index of mirror {name}: {e}")
+    with _indexes_lock:
+        _indexes[name] = index
+    return index
+
+def get_target_name(index_entry, filename):
+    """ the name we store it under: the one we asked for, else the one the mirror has """
+    if filename:
+        return filename
+    name = os.path.basename(os.path.normpath(index_entry.get('local_filename') or ''))
+    if name in ('', '.', '..'):
+        raise ValueError(f"invalid local_filename in the mirror index: {index_entry.get('local_filename')!r}")
+    return name
+
+## --- http mirrors, another node running `cozy serve`
+
+def fetch_from_http_mirror(mirror, url, download_dir, filename=None, sha256=None):
+    index = get_mirror_index(mirror)
+    index_entry = index.find(url=url, sha256=sha256) if index else None
+    if index_entry is None:
+        return None
+
+    from src.utils.transfer import download
+    base_url = f"{mirror['url'].rstrip('/')}/files/"
+    filename = get_target_name(index_entry, filename)
+    target = os.path.join(download_dir, filename)
+    os.makedirs(download_dir, exist_ok=True)
+
+    if index_entry.get('files') is None:
+        result = download(base_url + quote(index_entry['path']), target,
+                          expected_sha256=sha256 or index_entry.get('sha256'))
+        return filename, result.sha256
+
+    ## a directory (civitai download), file by file, it only appears at target once complete
+    part_path = get_part_path(target)
+    for rel_path, size in index_entry['files']:
+        filepath = os.path.join(part_path, rel_path)
+        os.makedirs(os.path.dirname(filepath), exist_ok=True)
+        download(base_url + quote(f"{index_entry['path']}/{rel_path}"), filepath)
+    if os.path.isdir(target):
+        shutil.rmtree(target)
+    os.replace(part_path, target)
+    return filename, None
+
+## --- directory mirrors, e.g. an NFS export of another node's MODEL_STORAGE_DIR
+
+def fetch_from_dir_mirror(mirror, url, download_dir, filename=None, sha256=None):
+    """ looks the file up by url or digest in the mirror's index.json if it has one,
+    else by digest in its blob store, else at the same <type>/<base>/<filename> path
+    """
+    root = mirror['path']
+    if not os.path.isdir(root) or os.path.realpath(root) == os.path.realpath(os.getenv("MODEL_STORAGE_DIR")):
+        return None
+    source, trusted = find_in_dir_mirror(mirror, url, download_dir, filename, sha256)
+    if source is None:
+        return None
+
+    target = os.path.join(download_dir, filename or os.path.basename(source))
+    link = mirror.get('link', True)
+    if os.path.isdir(source):
+        copy_dir(source, target, link=link)
+        return os.path.basename(target), None
+    result_sha256 = copy_file(source, target, link=link,
+                              expected_sha256=sha256, trusted=trusted)
+    return os.path.basename(target), result_sha256 or sha256
+
+def find_in_dir_mirror(mirror, url, download_dir, filename, sha256):
+    """ (source path, whether its content is known to match sha256) """
+    root = mirror['path']
+    index = get_mirror_index(mirror)
+    index_entry = index.find(url=url, sha256=sha256) if index else None
+    if index_entry is not None:
+        source = os.path.join(root, index_entry['path'])
+        if os.path.exists(source) and not has_partial_download(source):
+            return source, False
+
+    if sha256:
+        from src.utils.blobs import BLOB_DIRNAME
+        blob_path = os.path.join(root, BLOB_DIRNAME, 'sha256', sha256.lower()[:2], sha256.lower())
+        if os.path.isfile(blob_path):
+            return blob_path, True ## content addressed, the name is the digest
+
+    if filename:
+        ## both stores lay out the same collection the same way
+        storage_root_dir = os.getenv("MODEL_STORAGE_DIR")
+        source = os.path.join(root, os.path.relpath(os.path.join(download_dir, filename), storage_root_dir))
+        if os.path.exists(source) and not has_partial_download(source):
+            return source, False
+    return None, False
+
+def copy_file(source, target, link=True, expected_sha256=None, trusted=False):
+    """ hardlinks (same filesystem) or copies source to target, through a .part file.
+    returns the sha256, which is checked against expected_sha256 unless the source is trusted
+    """
+    os.makedirs(os.path.dirname(target), exist_ok=True)
+    part_path = get_part_path(target)
+    if os.path.exists(part_path):
+        os.remove(part_path)
+
+    sha256 = None
+    linked = False
+    if link and can_link(source):
+        try:
+            os.link(source, part_path)
+            linked = True
+        except OSError:
+            pass ## e.g. another filesystem, copy it instead
+
+    if linked and trusted:
+        sha256 = expected_sha256
+    elif linked:
+        with open(part_path, 'rb') as f:
+            sha256 = hash_stream(f)
+    else:
+        hasher = hashlib.sha256()
+        with open(source, 'rb') as src, open(part_path, 'wb') as dst:
+            while True:
+                chunk = src.read(COPY_CHUNK_SIZE)
+                if not chunk:
+                    break
+                hasher.update(chunk)
+                dst.write(chunk)
+            dst.flush()
+            os.fsync(dst.fileno())
+        sha256 = hasher.hexdigest()
+
+    if expected_sha256 and sha256 and sha256 != expected_sha256.lower():
+        os.remove(part_path)
+        raise ValueError(f"sha256 mismatch for {source}: expected {expected_sha256}, got {sha256}")
+    os.replace(part_path, target)
+    return sha256
+
+def copy_dir(source, target, link=True):
+    """ same as copy_file for a whole directory, it only appears at target once complete """
+    part_path = get_part_path(target)
+    if os.path.exists(part_path):
+        shutil.rmtree(part_path)
+
+    def link_or_copy(src, dst):
+        if link and can_link(src):
+            try:
+                os.link(src, dst)
+                return dst
+            except OSError:
+                pass
+        return shutil.copy2(src, dst)
+
+    shutil.copytree(source, part_path, copy_function=link_or_copy)
+    if os.path.isdir(target):
+        shutil.rmtree(target)
+    os.replace(part_path, target)
+
+def can_link(source):
+    """ a hardlink shares the inode, and the blob stores count their views by its link
+    count: a file that is (or is a view of) a blob would never be freed again by the
+    mirror, and with our own blob store on neither would ours. those are copied
+    """
+    from src.utils.blobs import (BLOB_DIRNAME,
+                                 is_blob_store_enabled)
+    if is_blob_store_enabled() or BLOB_DIRNAME in os.path.normpath(source).split(os.sep):
+        return False
+    try:
+        return os.stat(source).st_nlink == 1
+    except OSError:
+        return False
+
+def hash_stream(f):
+    hasher = hashlib.sha256()
+    while True:
+        chunk = f.read(COPY_CHUNK_SIZE)
+        if not chunk:
+            break
+        hasher.update(chunk)
+    return hasher.hexdigest()
@@ -0,0 +1,146 @@
+import os
+import json
+import time
+import threading
+from concurrent.futures import ThreadPoolExecutor
+from itertools import zip_longest
+from src.utils import config
+from src.utils.urls import get_host_key
+from src.utils.generic import get_cozy_data_dir
+
+## how many downloads we run at the same time against each host,
+## can be overridden with `download_concurrency` in the config.yaml
+DEFAULT_HOST_CONCURRENCY = {
+    'huggingface': 4,
+    'civitai': 2,
+    'generic': 2,
+}
+
+## what we assume for an eta before we ever measured a run, in MB/s
+DEFAULT_THROUGHPUT = 50.0
+## runs that fetch less than this are mostly latency, they don't tell us the bandwidth
+MIN_THROUGHPUT_SAMPLE_MB = 64
+THROUGHPUT_FILENAME = 'throughput.json'
+
+
+class DownloadTask:
+    """ a single download to run in the pool, `fn` does the actual work and
+    returns the number of bytes it fetched, or None when nothing had to be fetched.
+    `prepare` runs before the task takes its host slot, e.g. to wait for a metadata lookup
+    """
+    __slots__ = ('label', 'url', 'fn', 'prepare')
+
+    def __init__(self, label, url, fn, prepare=None):
+        self.label = label
+        self.url = url
+        self.fn = fn
+        self.prepare = prepare
+
+
+class DownloadResult:
+    __slots__ = ('task', 'status', 'num_bytes', 'seconds', 'error')
+
+    def __init__(self, task, status, num_bytes=0, seconds=0.0, error=None):
+        self.task = task
+        self.status = status  ## 'downloaded', 'skipped' or 'failed'
+        self.num_bytes = num_bytes
+        self.seconds = seconds
+        self.error = error
+
+
+def get_host_limits():
+    limits = dict(DEFAULT_HOST_CONCURRENCY)
+    limits.update(config.get_config().get('download_concurrency') or {})
+    return limits
+
+def interleave_by_host(tasks):
+    """ round robins the tasks over the hosts, so workers don't all queue up
+    behind the same per-host limit while other hosts sit idle
+    """
+    by_host = {}
+    for task in tasks:
+        by_host.setdefault(get_host_key(task.url), []).append(task)
+    interleaved = []
+    for group in zip_longest(*by_host.values()):
+        interleaved.extend(task for task in group if task is not None)
+    return interleaved
+
+def run_download_tasks(tasks, jobs=1, interleave=True):
+    """ runs the tasks through a pool of `jobs` workers, with at most
+    `download_concurrency[host]` of them talking to the same host at once.
+    with interleave=False they start in the given order, e.g. by priority.
+    prints a summary at the end and returns the list of DownloadResults
+    """
+    jobs = max(1, jobs or 1)
+    host_semaphores = {host: threading.BoundedSemaphore(max(1, int(limit)))
+                       for host, limit in get_host_limits().items()}
+
+    def run_task(task):
+        semaphore = host_semaphores.get(get_host_key(task.url)) or host_semaphores['generic']
+        if task.prepare is not None:
+            ## waiting must not keep the host busy for the tasks that are ready
+            try:
+                task.prepare()
+            except Exception as e:
+                return DownloadResult(task, 'failed', error=e)
+        with semaphore:
+            start = time.monotonic()
+            try:
+                num_bytes = task.fn()
+            except Exception as e:
+                return DownloadResult(task, 'failed', seconds=time.monotonic() - start, error=e)
+            seconds = time.monotonic() - start
+            if num_bytes is None:
+                return DownloadResult(task, 'skipped', seconds=seconds)
+            return DownloadResult(task, 'downloaded', num_bytes=num_bytes, seconds=seconds)
+
+    start = time.monotonic()
+    with ThreadPoolExecutor(max_workers=jobs) as executor:
+        results = list(executor.map(run_task, interleave_by_host(tasks) if interleave else tasks))
+    elapsed = time.monotonic() - start
+
+    print_download_summary(results, elapsed)
+    record_throughput(results, elapsed)
+    return results
+
+def get_throughput_path():
+    return os.path.join(get_cozy_data_dir(), THROUGHPUT_FILENAME)
+
+def get_estimated_throughput():
+    """ MB/s of the recent download runs, or DEFAULT_THROUGHPUT if we have none yet """
+    try:
+        with open(get_throughput_path(), 'r') as f:
+            return float(json.load(f)['mb_per_second'])
+    except (OSError, ValueError, KeyError, TypeError):
+        return DEFAULT_THROUGHPUT
+
+def record_throughput(results, elapsed):
+    """ keeps a moving average of the throughput of the runs, for the next eta """
+    total_mb = sum(r.num_bytes for r in results if r.status == 'downloaded') / (1024 * 1024)
+    if total_mb < MIN_THROUGHPUT_SAMPLE_MB or elapsed <= 0:
+        return
+    sample = total_mb / elapsed
+    throughput_path = get_throughput_path()
+    if os.path.exists(throughput_path):
+        sample = 0.5 * sample + 0.5 * get_estimated_throughput()
+    tmp_path = f"{throughput_path}.{os.getpid()}.tmp"
+    try:
+        with open(tmp_path, 'w') as f:
+            json.dump({'mb_per_second': round(sample, 2), 'updated_at': int(time.time())}, f)
+        os.replace(tmp_path, throughput_path)
+    except OSError as e:
+        print(f"--- warning:: could not record the download throughput: {e}")
+
+def print_download_summary(results, elapsed, line_len=80):
+    downloaded = [r for r in results if r.status == 'downloaded']
+    skipped = [r for r in results if r.status == 'skipped']
+    failed = [r for r in results if r.status == 'failed']
+    total_mb = sum(r.num_bytes for r in downloaded) / (1024 * 1024)
+    throughput = total_mb / elapsed if elapsed > 0 else 0
+
+    print('-' * line_len)
+    print(f"--- downloaded: {len(downloaded)}, already present: {len(skipped)}, failed: {len(failed)}")
+    print(f"--- fetched {total_mb:.2f} MB in {elapsed:.1f}s ({throughput:.2f} MB/s)")
+    for result in failed:
+        print(f"--- failed: {result.task.label} :: {result.error}")
+    print('-' * line_len)
@@ -0,0 +1,165 @@
+import os
+import json
+from concurrent.futures import ThreadPoolExecutor
+from src.utils import config
+from src.utils.generic import (get_cozy_data_dir,
+                               get_absolute_model_filepath,
+                               has_partial_download)
+from src.utils.inventory import scan_dir
+
+SIZE_CACHE_FILENAME = 'sizes.json'
+SIZE_CACHE_VERSION = 2
+
+## the stats are mostly waiting on the disk (or the network for NFS), so more threads than cores
+DEFAULT_JOBS = 16
+STAT_BATCH_SIZE = 64
+
+
+class EntrySize:
+    """ what's on disk for a single entry """
+    __slots__ = ('entry', 'filepath', 'num_bytes', 'is_local', 'file_id')
+
+    def __init__(self, entry, filepath, num_bytes=0, is_local=False, file_id=None):
+        self.entry = entry
+        self.filepath = filepath
+        self.num_bytes = num_bytes
+        self.is_local = is_local
+        self.file_id = file_id ## (st_dev, st_ino) of a file, shared by its hardlinked views
+
+
+def is_size_cache_enabled():
+    storage = config.get_config().get('storage') or {}
+    return bool(storage.get('size_cache', True))
+
+def get_size_cache_path():
+    return os.path.join(get_cozy_data_dir(), SIZE_CACHE_FILENAME)
+
+def read_size_cache():
+    try:
+        with open(get_size_cache_path(), 'r') as f:
+            cache = json.load(f)
+    except (OSError, ValueError):
+        return {}
+    if cache.get('version') != SIZE_CACHE_VERSION or cache.get('root') != os.getenv("MODEL_STORAGE_DIR"):
+        return {}
+    return cache.get('paths') or {}
+
+def write_size_cache(paths):
+    cache_path = get_size_cache_path()
+    os.makedirs(os.path.dirname(cache_path), exist_ok=True)
+    tmp_path = f"{cache_path}.{os.getpid()}.tmp"
+    try:
+        with open(tmp_path, 'w') as f:
+            json.dump({'version': SIZE_CACHE_VERSION, 'root': os.getenv("MODEL_STORAGE_DIR"), 'paths': paths}, f)
+        os.replace(tmp_path, cache_path)
+    except OSError as e:
+        print(f"--- warning:: could not write the size cache: {e}")
+
+def get_entry_sizes(collection, jobs=DEFAULT_JOBS):
+    """ returns an EntrySize for every entry. files are a single stat, directories
+    (civitai downloads) are cached with the (size, mtime) of every file and the mtime
+    of every sub directory in them, and only walked again when one of those changed.
+    the stats and the walks of the changed directories run in parallel
+    """
+    use_cache = is_size_cache_enabled()
+    cache = read_size_cache() if use_cache else {}
+    filepaths = [get_absolute_model_filepath(entry.get('local_filename'),
+                                             entry.get('model_type'),
+                                             entry.get('model_base'))
+                 for entry in collection]
+
+    ## handed out in batches, one future per stat costs more than the stat on a local disk
+    def get_batch_sizes(batch):
+        return [get_path_size(filepath, cache.get(filepath)) for filepath in batch]
+    batches = [filepaths[i:i + STAT_BATCH_SIZE] for i in range(0, len(filepaths), STAT_BATCH_SIZE)]
+    with ThreadPoolExecutor(max_workers=jobs) as executor:
+        results = [result for batch in executor.map(get_batch_sizes, batches) for result in batch]
+
+    sizes = []
+    new_cache = {}
+    for entry, filepath, (num_bytes, is_local, file_id, cache_entry) in zip(collection, filepaths, results):
+        sizes.append(EntrySize(entry, filepath, num_bytes, is_local, file_id))
+        if cache_entry is not None:
+            new_cache[filepath] = cache_entry
+
+    if use_cache and new_cache != cache:
+        write_size_cache(new_cache)
+    return sizes
+
+def get_path_size(filepath, cached=None):
+    """ (size in bytes, is local, file id, cache entry) for a file or directory """
+    try:
+        st = os.stat(filepath)
+    except OSError:
+        return 0, False, None, None
+
+    if not os.path.isdir(filepath):
+        ## a leftover .part file means the last download never finished
+        return st.st_size, not has_partial_download(filepath), (st.st_dev, st.st_ino), None
+
+    if cached is not None and is_dir_unchanged(filepath, cached):
+        return cached['size'], cached['num_children'] > 0, None, cached
+
+    cache_entry = walk_dir(filepath)
+    return cache_entry['size'], cache_entry['num_children'] > 0, None, cache_entry
+
+def walk_dir(dirpath):
+    """ a fresh walk of the tree with the same listing the inventory uses,
+    as {'size', 'num_children', 'dirs': {rel_dir: mtime_ns}, 'files': {rel_path: [size, mtime]}}
+    """
+    dirs = {}
+    scan_dir(dirpath, '', {}, dirs)
+    files = {}
+    for rel_dir, listing in dirs.items():
+        for name, (size, mtime, is_dir) in listing['children'].items():
+            if not is_dir:
+                files[os.path.join(rel_dir, name)] = [size, mtime]
+    return {'size': sum(size for size, mtime in files.values()),
+            'num_children': len(dirs.get('', {}).get('children', {})),
+            'dirs': {rel_dir: listing['mtime'] for rel_dir, listing in dirs.items()},
+            'files': files}
+
+def is_dir_unchanged(dirpath, cached):
+    """ a file added, removed or renamed anywhere in the tree changes the mtime of
+    the directory it's in, a file rewritten in place changes its own size or mtime
+    """
+    try:
+        for rel_dir, mtime in cached['dirs'].items():
+            if os.stat(os.path.join(dirpath, rel_dir)).st_mtime_ns != mtime:
+                return False
+        for rel_path, (size, mtime) in cached['files'].items():
+            st = os.stat(os.path.join(dirpath, rel_path))
+            if st.st_size != size or st.st_mtime != mtime:
+                return False
+    except OSError:
+        return False
+    return True
+
+def get_size_breakdowns(sizes):
+    """ local bytes by type, base and tag, and count/bytes for loaded vs unloaded.
+    the unloaded bytes are the recorded file_size_mb, what a reload would fetch
+    """
+    breakdowns = {'model_type': {}, 'model_base': {}, 'tag': {}}
+    status = {'loaded': [0, 0], 'unloaded': [0, 0]}
+    ## hardlinked views of the same blob are the same bytes, each bucket counts them once
+    counted = set()
+    def add_bytes(bucket, key, size):
+        if size.file_id is not None:
+            if (bucket, key, size.file_id) in counted:
+                return 0
+            counted.add((bucket, key, size.file_id))
+        return size.num_bytes
+
+    for size in sizes:
+        entry = size.entry
+        if not size.is_local:
+            status['unloaded'][0] += 1
+            status['unloaded'][1] += int((entry.get('file_size_mb') or 0) * 1024 * 1024)
+            continue
+        status['loaded'][0] += 1
+        status['loaded'][1] += add_bytes('loaded', None, size)
+        for key, value in (('model_type', entry.get('model_type')), ('model_base', entry.get('model_base'))):
+            breakdowns[key][value] = breakdowns[key].get(value, 0) + add_bytes(key, value, size)
+        for tag in entry.get('tags') or []:
+            breakdowns['tag'][tag] = breakdowns['tag'].get(tag, 0) + add_bytes('tag', tag, size)
+    return breakdowns, status
@@ -0,0 +1,161 @@
+import os
+import json
+from contextlib import contextmanager
+
+## the MODEL_INFO_FILE extensions that select the sqlite backend
+SQLITE_EXTENSIONS = ('.sqlite', '.sqlite3', '.db')
+
+SCHEMA = """
+CREATE TABLE IF NOT EXISTS entries (
+    id INTEGER PRIMARY KEY AUTOINCREMENT,
+    url TEXT,
+    model_type TEXT,
+    model_base TEXT,
+    data TEXT NOT NULL
+);
+CREATE TABLE IF NOT EXISTS entry_tags (
+    entry_id INTEGER NOT NULL REFERENCES entries(id) ON DELETE CASCADE,
+    tag TEXT NOT NULL,
+    PRIMARY KEY (entry_id, tag)
+);
+CREATE INDEX IF NOT EXISTS idx_entries_url ON entries(url);
+CREATE INDEX IF NOT EXISTS idx_entries_model_type ON entries(model_type);
+CREATE INDEX IF NOT EXISTS idx_entries_model_base ON entries(model_base);
+CREATE INDEX IF NOT EXISTS idx_entry_tags_tag ON entry_tags(tag);
+"""
+
+
+def is_sqlite_path(path):
+    return bool(path) and path.lower().endswith(SQLITE_EXTENSIONS)
+
+@contextmanager
+def connect(path):
+    """ opens the db, makes sure the schema exists and commits on success """
+    import sqlite3 ## only paid for when the sqlite backend is in use
+    conn = sqlite3.connect(path, timeout=30)
+    try:
+        conn.execute("PRAGMA foreign_keys = ON")
+        conn.execute("PRAGMA journal_mode = WAL")
+        conn.executescript(SCHEMA)
+        yield conn
+        conn.commit()
+    except Exception:
+        conn.rollback()
+        raise
+    finally:
+        conn.close()
+
+def read_db(path):
+    """ returns the whole collection as {id: entry} just like the json backend """
+    with connect(path) as conn:
+        rows = conn.execute("SELECT id, data FROM entries ORDER BY id").fetchall()
+    return {str(id): json.loads(data) for id, data in rows}
+
+def write_db(path, db):
+    """ replaces the whole collection, only used for bulk rewrites """
+    with connect(path) as conn:
+        conn.execute("DELETE FROM entry_tags")
+        conn.execute("DELETE FROM entries")
+        for id, entry in db.items():
+            insert_entry(conn, entry, id=int(id))
+
+def insert_entry(conn, entry, id=None):
+    cursor = conn.execute(
+        "INSERT INTO entries (id, url, model_type, model_base, data) VALUES (?, ?, ?, ?, ?)",
+        (id, entry.get('url'), entry.get('model_type'), entry.get('model_base'), json.dumps(entry)))
+    entry_id = cursor.lastrowid
+    write_tags(conn, entry_id, entry.get('tags') or [])
+    return entry_id
+
+def write_tags(conn, entry_id, tags):
+    conn.execute("DELETE FROM entry_tags WHERE entry_id = ?", (entry_id,))
+    conn.executemany("INSERT OR IGNORE INTO entry_tags (entry_id, tag) VALUES (?, ?)",
+                     [(entry_id, tag) for tag in tags])
+
+def get_entry(path, id):
+    with connect(path) as conn:
+        return fetch_entry(conn, id)
+
+def fetch_entry(conn, id):
+    try:
+        id = int(id)
+    except (TypeError, ValueError):
+        return None
+    row = conn.execute("SELECT data FROM entries WHERE id = ?", (id,)).fetchone()
+    return json.loads(row[0]) if row else None
+
+def create_entry(path, entry):
+    with connect(path) as conn:
+        return insert_entry(conn, entry)
+
+def update_entry(path, id, field, value):
+    """ updates a single field, returns False if the entry does not exist """
+    with connect(path) as conn:
+        return update_entry_field(conn, id, field, value)
+
+def update_entry_field(conn, id, field, value):
+    entry = fetch_entry(conn, id)
+    if entry is None:
+        return False
+    entry[field] = value
+    conn.execute("UPDATE entries SET url = ?, model_type = ?, model_base = ?, data = ? WHERE id = ?",
+                 (entry.get('url'), entry.get('model_type'), entry.get('model_base'),
+                  json.dumps(entry), int(id)))
+    if field == 'tags':
+        write_tags(conn, int(id), value or [])
+    return True
+
+def delete_entry(path, id):
+    with connect(path) as conn:
+        return delete_entry_row(conn, id)
+
+def delete_entry_row(conn, id):
+    try:
+        id = int(id)
+    except (TypeError, ValueError):
+        return False
+    cursor = conn.execute("DELETE FROM entries WHERE id = ?", (id,))
+    return cursor.rowcount > 0
+
+def find_entries(path, url=None, model_type=None, model_base=None, tag=None):
+    """ indexed lookup, returns {id: entry} for all entries matching every given filter """
+    query = "SELECT e.id, e.data FROM entries e"
+    where = []
+    params = []
+    if tag:
+        query += " JOIN entry_tags t ON t.entry_id = e.id"
+        where.append("t.tag = ?")
+        params.append(tag)
+    if url:
+        where.append("e.url = ?")
+        params.append(url)
+    if model_type:
+        where.append("e.model_type = ?")
+        params.append(model_type)
+    if model_base:
+        where.append("e.model_base = ?")
+        params.append(model_base)
+    if where:
+        query += " WHERE " + " AND ".join(where)
+    query += " ORDER BY e.id"
+
+    with connect(path) as conn:
+        rows = conn.execute(query, params).fetchall()
+    return {str(id): json.loads(data) for id, data in rows}
+
+def import_json_db(json_path, sqlite_path):
+    """ one-shot import of an existing json collection, keeps the original ids.
+    returns the number of imported entries
+    """
+    with open(json_path, 'r') as f:
+        db = json.load(f)
+
+    imported = 0
+    with connect(sqlite_path) as conn:
+        for id, entry in sorted(db.items(), key=lambda item: int(item[0])):
+            if fetch_entry(conn, id) is not None:
+                print(f"--- skipping entry '{id}', it already exists in {os.path.basename(sqlite_path)}")
+                continue
+            insert_entry(conn, entry, id=int(id))
+            imported += 1
+    return imported
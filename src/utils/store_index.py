@@ -0,0 +1,119 @@
+import os
+import time
+from src.utils.urls import normalize_url
+from src.utils.sizes import get_entry_sizes
+from src.utils.blobs import BLOB_DIRNAME
+
+## the index a node publishes of its local store, see `cozy serve` and the mirrors
+INDEX_VERSION = 1
+
+
+class StoreIndex:
+    """ the entries of a store index, looked up by url key or by digest """
+    __slots__ = ('entries', 'by_key', 'by_sha256')
+
+    def __init__(self, entries):
+        self.entries = entries
+        self.by_key = {}
+        self.by_sha256 = {}
+        for index_entry in entries:
+            if index_entry.get('key'):
+                self.by_key.setdefault(index_entry['key'], index_entry)
+            ## a directory's digest is the one of its primary file, not of the directory
+            if index_entry.get('sha256') and index_entry.get('files') is None:
+                self.by_sha256.setdefault(index_entry['sha256'].lower(), index_entry)
+
+    def find(self, url=None, sha256=None):
+        """ the index entry for the url (or any equivalent link) or the digest, or None """
+        index_entry = self.by_key.get(normalize_url(url)) if url else None
+        if index_entry is None and sha256:
+            index_entry = self.by_sha256.get(sha256.lower())
+        return index_entry
+
+
+def build_store_index(collection, include_entries=False):
+    """ describes every entry that is on disk, with its path relative to
+    MODEL_STORAGE_DIR. civitai downloads are directories, they list their files.
+    with include_entries the full db entry comes along, e.g. for a bundle
+    """
+    storage_root_dir = os.getenv("MODEL_STORAGE_DIR")
+    entries = []
+    for size in get_entry_sizes(collection):
+        if not size.is_local:
+            continue
+        entry = size.entry
+        index_entry = {
+            'id': entry.id,
+            'url': entry.get('url'),
+            'key': normalize_url(entry.get('url')),
+            'sha256': entry.get('sha256'),
+            'model_type': entry.get('model_type'),
+            'model_base': entry.get('model_base'),
+            'local_filename': entry.get('local_filename'),
+            'path': os.path.relpath(size.filepath, storage_root_dir),
+            'size': size.num_bytes,
+        }
+        if os.path.isdir(size.filepath):
+            index_entry['files'] = list_dir_files(size.filepath)
+        if include_entries:
+            index_entry['entry'] = entry.to_dict()
+        entries.append(index_entry)
+    return {'version': INDEX_VERSION, 'created_at': int(time.time()), 'entries': entries}
+
+def list_dir_files(dirpath):
+    """ [[path relative to dirpath, size], ...] of every file in the tree """
+    files = []
+    for current, dirnames, filenames in os.walk(dirpath):
+        dirnames.sort()
+        for filename in sorted(filenames):
+            filepath = os.path.join(current, filename)
+            try:
+                files.append([os.path.relpath(filepath, dirpath), os.path.getsize(filepath)])
+            except OSError:
+                continue
+    return files
+
+def load_store_index(data):
+    """ the parsed index.json of another node, ready for lookups. the paths in it are
+    normalized, entries with a path that would escape the store are dropped
+    """
+    if not isinstance(data, dict) or data.get('version') != INDEX_VERSION:
+        raise ValueError(f"unsupported store index version: {data.get('version') if isinstance(data, dict) else data!r}")
+    entries = []
+    for index_entry in data.get('entries') or []:
+        index_entry = get_safe_index_entry(index_entry)
+        if index_entry is None:
+            print("--- warning:: skipping a store index entry with an invalid path")
+            continue
+        entries.append(index_entry)
+    return StoreIndex(entries)
+
+def get_safe_index_entry(index_entry):
+    """ the entry with its path and the paths of its files normalized, or None if any of them is unsafe """
+    if not isinstance(index_entry, dict):
+        return None
+    path = get_safe_rel_path(index_entry.get('path'))
+    if path is None:
+        return None
+    index_entry = dict(index_entry, path=path)
+    if index_entry.get('files') is not None:
+        files = []
+        for rel_path, size in index_entry['files']:
+            rel_path = get_safe_rel_path(rel_path)
+            if rel_path is None:
+                return None
+            files.append([rel_path, size])
+        index_entry['files'] = files
+    return index_entry
+
+def get_safe_rel_path(rel_path):
+    """ the normalized path if it stays inside the store, None if it is absolute,
+    goes up with '..', points into the blob store or is empty
+    """
+    if not isinstance(rel_path, str) or not rel_path:
+        return None
+    rel_path = os.path.normpath(rel_path)
+    parts = rel_path.split(os.sep)
+    if os.path.isabs(rel_path) or '..' in parts or parts[0] in ('.', BLOB_DIRNAME):
+        return None
+    return rel_path
@@ -0,0 +1,396 @@
+import os
+import re
+import sys
+import json
+import time
+import hashlib
+import threading
+import requests
+from concurrent.futures import (ThreadPoolExecutor,
+                                as_completed)
+from src.utils import config
+from src.utils.generic import (get_part_path,
+                               has_partial_download)
+
+## segmented downloads keep track of the finished byte ranges in here
+SEGMENTS_SUFFIX = '.segments'
+CHUNK_SIZE = 1024 * 1024
+## how many times we try to resume an interrupted transfer before giving up
+MAX_RETRIES = 5
+TIMEOUT = 60
+
+
+class DownloadError(Exception):
+    pass
+
+
+class TransferResult:
+    """ what a finished download produced, the sha256 is computed while streaming """
+    __slots__ = ('filepath', 'size', 'sha256')
+
+    def __init__(self, filepath, size, sha256):
+        self.filepath = filepath
+        self.size = size
+        self.sha256 = sha256
+
+
+def get_download_settings():
+    """ the `download` section of the config.yaml, with defaults """
+    settings = {
+        'connections': 8,
+        'segment_size_mb': 64,
+        'segmented_min_size_mb': 256,
+    }
+    settings.update(config.get_config().get('download') or {})
+    return settings
+
+def download(url, filepath, headers=None, progress=True, expected_sha256=None):
+    """ downloads the url to filepath, large files on servers that support
+    byte ranges are fetched over several parallel connections, everything
+    else is streamed over a single one. returns a TransferResult
+
+    if expected_sha256 is given and the content doesn't match, the download
+    is thrown away and a DownloadError is raised
+    """
+    settings = get_download_settings()
+    connections = int(settings['connections'])
+    segment_size = int(settings['segment_size_mb'] * 1024 * 1024)
+    min_size = int(settings['segmented_min_size_mb'] * 1024 * 1024)
+
+    ## a sequential download that was interrupted is resumed as it is
+    part_path = get_part_path(filepath)
+    resuming_sequential = os.path.exists(part_path) and not os.path.exists(part_path + SEGMENTS_SUFFIX)
+
+    if connections > 1 and not resuming_sequential:
+        total_size, accepts_ranges = probe_url(url, headers)
+        if accepts_ranges and total_size and total_size >= min_size:
+            return segmented_download(url, filepath, total_size, headers=headers,
+                                      connections=connections, segment_size=segment_size,
+                                      progress=progress, expected_sha256=expected_sha256)
+
+    return stream_download(url, filepath, headers=headers, progress=progress,
+                           expected_sha256=expected_sha256)
+
+def probe_url(url, headers=None):
+    """ HEAD request, returns (size, accepts_ranges) of the file behind the url """
+    try:
+        response = requests.head(url, headers=headers or {}, allow_redirects=True, timeout=TIMEOUT)
+        response.raise_for_status()
+    except requests.RequestException:
+        return None, False
+    content_length = response.headers.get('Content-Length')
+    accepts_ranges = response.headers.get('Accept-Ranges', '').lower() == 'bytes'
+    return (int(content_length) if content_length else None), accepts_ranges
+
+def segmented_download(url, filepath, total_size, headers=None, connections=8,
+                       segment_size=64 * 1024 * 1024, progress=True, expected_sha256=None):
+    """ splits the file into byte ranges and fetches them over `connections`
+    parallel connections straight into a preallocated '<filepath>.part'.
+    finished segments are recorded next to it (after their bytes are synced),
+    so an interrupted download only fetches the missing segments again. returns a TransferResult
+
+    the sha256 is fed in file order, straight from the stream of whichever segment
+    the hashed prefix has reached. only the bytes that arrived ahead of the prefix
+    (and the segments a resumed download already had) are read back from the file,
+    right after they were written, so mostly from the page cache
+    """
+    part_path = get_part_path(filepath)
+    state_path = part_path + SEGMENTS_SUFFIX
+    label = os.path.basename(filepath)
+
+    segments = [(start, min(start + segment_size, total_size) - 1)
+                for start in range(0, total_size, segment_size)]
+    done = read_segment_state(state_path, total_size, segment_size)
+    if done is None or not os.path.exists(part_path):
+        done = set()
+        ## write the state first, so a .part without it is never mistaken
+        ## for a sequential download that can simply be appended to
+        write_segment_state(state_path, total_size, segment_size, done)
+        preallocate_file(part_path, total_size)
+
+    lock = threading.Lock()
+    progress_state = {'written': sum(segments[i][1] - segments[i][0] + 1 for i in done),
+                      'last_report': 0.0}
+
+    hasher = hashlib.sha256()
+    hash_lock = threading.Lock()
+    hash_state = {'offset': 0} ## everything before it went into the hasher
+
+    def hash_finished_prefix():
+        ## the segments the prefix reached that are complete, read back from the file
+        while hash_state['offset'] < total_size and hash_state['offset'] // segment_size in done:
+            end = segments[hash_state['offset'] // segment_size][1]
+            hash_file_range(read_fd, hash_state['offset'], end - hash_state['offset'] + 1, hasher)
+            hash_state['offset'] = end + 1
+
+    def on_chunk(index, offset, chunk):
+        """ called by the fetch threads after every write """
+        with hash_lock:
+            start = segments[index][0]
+            if start <= hash_state['offset'] < offset:
+                ## the prefix just reached this segment, catch up on what it already wrote
+                hash_file_range(read_fd, hash_state['offset'], offset - hash_state['offset'], hasher)
+                hash_state['offset'] = offset
+            if hash_state['offset'] == offset:
+                hasher.update(chunk)
+                hash_state['offset'] += len(chunk)
+        with lock:
+            progress_state['written'] += len(chunk)
+            if progress and time.monotonic() - progress_state['last_report'] > 0.5:
+                progress_state['last_report'] = time.monotonic()
+                print_progress(label, progress_state['written'], total_size)
+
+    def on_segment_done(index):
+        ## the bytes have to be on the disk before the state says we have them
+        sync_data(fd)
+        with lock:
+            done.add(index)
+            write_segment_state(state_path, total_size, segment_size, done)
+        with hash_lock:
+            hash_finished_prefix()
+
+    fd = os.open(part_path, os.O_WRONLY)
+    read_fd = os.open(part_path, os.O_RDONLY)
+    try:
+        with hash_lock:
+            hash_finished_prefix() ## what a resumed download already had
+        todo = [i for i in range(len(segments)) if i not in done]
+        with ThreadPoolExecutor(max_workers=max(1, connections)) as executor:
+            futures = {executor.submit(fetch_segment, url, fd, segments[i],
+                                       headers, lambda offset, chunk, i=i: on_chunk(i, offset, chunk)): i
+                       for i in todo}
+            errors = []
+            for future in as_completed(futures):
+                ## keep recording the segments that did finish, even if one failed
+                try:
+                    future.result()
+                except Exception as e:
+                    errors.append(e)
+                    continue
+                on_segment_done(futures[future])
+            if errors:
+                raise errors[0]
+        os.fsync(fd)
+        if hash_state['offset'] != total_size:
+            raise DownloadError(f"only hashed {hash_state['offset']} of {total_size} bytes of {label}")
+    finally:
+        os.close(fd)
+        os.close(read_fd)
+
+    if progress:
+        print_progress(label, total_size, total_size)
+        print()
+
+    try:
+        result = finalize_part_file(part_path, filepath, hasher.hexdigest(), expected_sha256)
+    finally:
+        if os.path.exists(state_path) and not os.path.exists(part_path):
+            os.remove(state_path)
+    return result
+
+def sync_data(fd):
+    if hasattr(os, 'fdatasync'):
+        os.fdatasync(fd)
+    else:
+        os.fsync(fd)
+
+def hash_file_range(fd, offset, length, hasher):
+    while length > 0:
+        chunk = os.pread(fd, min(CHUNK_SIZE * 8, length), offset)
+        if not chunk:
+            break
+        hasher.update(chunk)
+        offset += len(chunk)
+        length -= len(chunk)
+
+def finalize_part_file(part_path, filepath, sha256, expected_sha256=None):
+    """ checks the digest and moves the finished .part file into place """
+    if expected_sha256 and sha256 != expected_sha256.lower():
+        os.remove(part_path)
+        raise DownloadError(f"sha256 mismatch for {os.path.basename(filepath)}: "
+                            f"expected {expected_sha256}, got {sha256}")
+    size = os.path.getsize(part_path)
+    os.replace(part_path, filepath)
+    return TransferResult(filepath, size, sha256)
+
+def fetch_segment(url, fd, segment, headers, on_chunk):
+    """ fetches a single byte range into the shared file descriptor,
+    retrying from where it stopped if the connection drops.
+    on_chunk(offset, chunk) is called after every write
+    """
+    start, end = segment
+    offset = start
+    retries = 0
+    while offset <= end:
+        request_headers = dict(headers or {})
+        request_headers['Range'] = f"bytes={offset}-{end}"
+        try:
+            with requests.get(url, headers=request_headers, stream=True, timeout=TIMEOUT) as response:
+                response.raise_for_status()
+                if response.status_code != 206:
+                    raise DownloadError(f"server ignored the byte range request for {url}")
+                for chunk in response.iter_content(chunk_size=CHUNK_SIZE):
+                    if not chunk:
+                        continue
+                    chunk = chunk[:end - offset + 1]
+                    os.pwrite(fd, chunk, offset)
+                    on_chunk(offset, chunk)
+                    offset += len(chunk)
+                    if offset > end:
+                        break
+        except (requests.ConnectionError, requests.Timeout,
+                requests.exceptions.ChunkedEncodingError) as e:
+            retries += 1
+            if retries > MAX_RETRIES:
+                raise DownloadError(f"giving up on bytes {start}-{end} of {url}: {e}")
+            time.sleep(2 ** retries)
+            continue
+        if offset <= end:
+            retries += 1
+            if retries > MAX_RETRIES:
+                raise DownloadError(f"bytes {start}-{end} of {url} ended early")
+
+def preallocate_file(filepath, size):
+    with open(filepath, 'wb') as f:
+        if hasattr(os, 'posix_fallocate'):
+            try:
+                os.posix_fallocate(f.fileno(), 0, size)
+                return
+            except OSError:
+                pass ## e.g. not supported on this filesystem
+        f.truncate(size)
+
+def read_segment_state(state_path, total_size, segment_size):
+    """ the set of finished segment indices, or None if there is no usable state """
+    try:
+        with open(state_path, 'r') as f:
+            state = json.load(f)
+    except (OSError, ValueError):
+        return None
+    if state.get('size') != total_size or state.get('segment_size') != segment_size:
+        return None
+    return set(state.get('done', []))
+
+def write_segment_state(state_path, total_size, segment_size, done):
+    tmp_path = state_path + '.tmp'
+    with open(tmp_path, 'w') as f:
+        json.dump({'size': total_size, 'segment_size': segment_size, 'done': sorted(done)}, f)
+    os.replace(tmp_path, state_path)
+
+def stream_download(url, filepath, headers=None, progress=True, expected_sha256=None):
+    """ downloads the url to filepath through '<filepath>.part'
+
+    an interrupted transfer is resumed with a Range request, so only the missing bytes
+    are fetched again. the size is checked against the Content-Length before the .part
+    file is atomically renamed to filepath. the sha256 is computed from the stream
+    as it is written. returns a TransferResult
+    """
+    part_path = get_part_path(filepath)
+    label = os.path.basename(filepath)
+    headers = dict(headers or {})
+    retries = 0
+
+    while True:
+        offset = os.path.getsize(part_path) if os.path.exists(part_path) else 0
+        request_headers = dict(headers)
+        hasher = hashlib.sha256()
+        if offset:
+            request_headers['Range'] = f"bytes={offset}-"
+            ## the bytes we already have still have to go into the digest
+            with open(part_path, 'rb') as f:
+                hash_file_range(f.fileno(), 0, offset, hasher)
+
+        try:
+            total_size, hasher = fetch_to_part_file(url, part_path, offset, request_headers,
+                                                    label, progress, hasher)
+        except (requests.ConnectionError, requests.Timeout,
+                requests.exceptions.ChunkedEncodingError) as e:
+            retries += 1
+            if retries > MAX_RETRIES:
+                raise DownloadError(f"giving up on {url} after {MAX_RETRIES} retries: {e}")
+            print(f"\n--- download interrupted ({e}), resuming in {2 ** retries}s..")
+            time.sleep(2 ** retries)
+            continue
+
+        size = os.path.getsize(part_path)
+        if total_size is not None and size < total_size:
+            retries += 1
+            if retries > MAX_RETRIES:
+                raise DownloadError(f"incomplete download of {url}: got {size} of {total_size} bytes")
+            print(f"\n--- download ended early ({size} of {total_size} bytes), resuming..")
+            continue
+        if total_size is not None and size > total_size:
+            os.remove(part_path)
+            raise DownloadError(f"download of {url} is larger than expected: {size} > {total_size} bytes")
+
+        return finalize_part_file(part_path, filepath, hasher.hexdigest(), expected_sha256)
+
+def fetch_to_part_file(url, part_path, offset, headers, label, progress, hasher):
+    """ appends the response body to the part file and feeds it to the hasher,
+    returns the expected total size and the hasher
+    """
+    with requests.get(url, headers=headers, stream=True, timeout=TIMEOUT) as response:
+        if response.status_code == 416:
+            ## we asked for bytes past the end, the .part file is either complete or bogus
+            total_size = parse_content_range_total(response.headers.get('Content-Range'))
+            if total_size is not None and total_size == offset:
+                return total_size, hasher
+            os.remove(part_path)
+            raise requests.ConnectionError("could not resume the partial download, restarting")
+        response.raise_for_status()
+
+        if offset and response.status_code != 206:
+            ## the server ignored the Range header, start over
+            offset = 0
+            hasher = hashlib.sha256()
+        total_size = get_total_size(response, offset)
+
+        with open(part_path, 'ab' if offset else 'wb') as f:
+            written = offset
+            last_report = 0.0
+            for chunk in response.iter_content(chunk_size=CHUNK_SIZE):
+                if not chunk:
+                    continue
+                f.write(chunk)
+                hasher.update(chunk)
+                written += len(chunk)
+                if progress and time.monotonic() - last_report > 0.5:
+                    last_report = time.monotonic()
+                    print_progress(label, written, total_size)
+            f.flush()
+            os.fsync(f.fileno())
+        if progress:
+            print_progress(label, written, total_size)
+            print()
+    return total_size, hasher
+
+def get_total_size(response, offset):
+    """ the full size of the file, taking a partial (206) response into account """
+    if response.status_code == 206:
+        total_size = parse_content_range_total(response.headers.get('Content-Range'))
+        if total_size is not None:
+            return total_size
+    ## a compressed transfer has a content-length that is not the file size
+    if response.headers.get('Content-Encoding', 'identity') != 'identity':
+        return None
+    content_length = response.headers.get('Content-Length')
+    if content_length is None:
+        return None
+    return int(content_length) + (offset if response.status_code == 206 else 0)
+
+def parse_content_range_total(content_range):
+    """ 'bytes 100-199/1000' or 'bytes */1000' -> 1000 """
+    if not content_range:
+        return None
+    match = re.search(r"/(\d+)\s*$", content_range)
+    return int(match.group(1)) if match else None
+
+def print_progress(label, written, total_size):
+    written_mb = written / (1024 * 1024)
+    if total_size:
+        percent = written / total_size * 100
+        total_mb = total_size / (1024 * 1024)
+        sys.stdout.write(f"\r--- {label}: {percent:5.1f}% ({written_mb:.1f} / {total_mb:.1f} MB)")
+    else:
+        sys.stdout.write(f"\r--- {label}: {written_mb:.1f} MB")
+    sys.stdout.flush()
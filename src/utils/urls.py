@@ -0,0 +1,117 @@
+import re
+from urllib.parse import urlparse, parse_qs
+
+HF_HOSTS = ('huggingface.co', 'hf.co')
+CIVITAI_HOSTS = ('civitai.com',)
+
+## the different ways huggingface links to a single file in a repo
+HF_FILE_VIEWS = ('blob', 'resolve', 'raw')
+
+
+def get_host_key(url):
+    """ groups urls by the service they point to: huggingface, civitai or generic """
+    host = get_hostname(url)
+    if host in HF_HOSTS:
+        return 'huggingface'
+    if host in CIVITAI_HOSTS:
+        return 'civitai'
+    return 'generic'
+
+def is_directory_download(url):
+    """ civitai downloads are a directory per model version, their sha256 is the one
+    of the primary file in it and can't stand in for the whole directory
+    """
+    return get_host_key(url or '') == 'civitai'
+
+def get_hostname(url):
+    host = (urlparse(url.strip()).hostname or '').lower()
+    if host.startswith('www.'):
+        host = host[4:]
+    return host
+
+def normalize_url(url):
+    """ returns a canonical key for a download url, so that different links to
+    the same file end up with the same key e.g.
+
+        https://huggingface.co/a/b/blob/main/x.safetensors
+        https://huggingface.co/a/b/resolve/main/x.safetensors?download=true
+            -> hf:a/b@main/x.safetensors
+
+        https://civitai.com/models/123/some-name?modelVersionId=456
+        https://civitai.com/api/download/models/456
+            -> civitai:version/456
+    """
+    if not url:
+        return None
+    url = url.strip()
+    host_key = get_host_key(url)
+    if host_key == 'huggingface':
+        return normalize_huggingface_url(url)
+    if host_key == 'civitai':
+        return normalize_civitai_url(url)
+    return normalize_generic_url(url)
+
+def normalize_huggingface_url(url):
+    parts = [p for p in urlparse(url).path.split('/') if p]
+    if len(parts) < 2:
+        return normalize_generic_url(url)
+
+    repo_id = f"{parts[0]}/{parts[1]}".lower()
+    if len(parts) >= 5 and parts[2] in HF_FILE_VIEWS:
+        revision = parts[3]
+        path_in_repo = '/'.join(parts[4:])
+        return f"hf:{repo_id}@{revision}/{path_in_repo}"
+
+    ## a link to the repo itself, e.g. the model card or a tree view
+    return f"hf:{repo_id}"
+
+def parse_huggingface_file_url(url):
+    """ splits a huggingface file url into (repo_id, revision, path_in_repo),
+    links without a blob/resolve part are assumed to point at 'main'
+    """
+    parts = [p for p in urlparse(url).path.split('/') if p]
+    repo_id = '/'.join(parts[:2])
+    if len(parts) >= 5 and parts[2] in HF_FILE_VIEWS:
+        return repo_id, parts[3], '/'.join(parts[4:])
+    return repo_id, 'main', parts[-1] if len(parts) > 2 else ''
+
+def get_huggingface_resolve_url(repo_id, revision, path_in_repo):
+    return f"https://huggingface.co/{repo_id}/resolve/{revision}/{path_in_repo}"
+
+def normalize_civitai_url(url):
+    model_id, version_id = parse_civitai_url(url)
+    if version_id:
+        return f"civitai:version/{version_id}"
+    if model_id:
+        return f"civitai:model/{model_id}"
+    return normalize_generic_url(url)
+
+def parse_civitai_url(url):
+    """ returns the (model_id, version_id) a civitai link points at, either can be None """
+    parsed = urlparse(url)
+    path = parsed.path
+    query = parse_qs(parsed.query)
+
+    version_id = None
+    if query.get('modelVersionId'):
+        version_id = query['modelVersionId'][0]
+    else:
+        ## both of these carry the model version id in the path
+        match = re.search(r"/api/download/models/(\d+)", path) or \
+                re.search(r"/api/v1/model-versions/(\d+)", path)
+        if match:
+            version_id = match.group(1)
+
+    model_id = None
+    if not re.search(r"/api/download/models/", path):
+        match = re.search(r"/models/(\d+)", path)
+        if match:
+            model_id = match.group(1)
+
+    return model_id, version_id
+
+def normalize_generic_url(url):
+    """ drops the scheme, query string, fragment and trailing slashes """
+    parsed = urlparse(url)
+    path = parsed.path.rstrip('/')
+    return f"url:{get_hostname(url)}{path}"
@@ -0,0 +1,22 @@
+import io
+import sys
+import tarfile
+from src.cmds import bundle
+from src.cmds.bundle import (BUNDLE_INDEX_NAME,
+                             write_bundle)
+from src.utils.store_index import INDEX_VERSION
+
+
+def test_bundle_to_stdout_restores_stdout(tmp_path, monkeypatch):
+    (tmp_path / 'loras' / 'sdxl').mkdir(parents=True)
+    (tmp_path / 'loras' / 'sdxl' / 'a.safetensors').write_bytes(b'a' * 100)
+    monkeypatch.setattr(bundle, 'storage_root_dir', str(tmp_path))
+    stdout = io.TextIOWrapper(io.BytesIO(), encoding='utf-8')
+    monkeypatch.setattr(sys, 'stdout', stdout)
+    index = {'version': INDEX_VERSION, 'entries': [{'path': 'loras/sdxl/a.safetensors'}]}
+
+    assert write_bundle(index, '-') == 100
+    assert sys.stdout is stdout
+    stdout.buffer.seek(0)
+    with tarfile.open(fileobj=stdout.buffer, mode='r|') as tar:
+        assert [member.name for member in tar] == [BUNDLE_INDEX_NAME, 'files/loras/sdxl/a.safetensors']
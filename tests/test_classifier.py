@@ -0,0 +1,53 @@
+import os
+import pytest
+from src.utils import config
+from src.utils.classifier import (SECTIONS,
+                                  classify_html,
+                                  iter_html_text)
+
+FIXTURES_DIR = os.path.join(os.path.dirname(os.path.abspath(__file__)), 'fixtures')
+
+
+def read_fixture(name):
+    with open(os.path.join(FIXTURES_DIR, name), 'r', encoding='utf-8') as f:
+        return f.read()
+
+def old_confidences(html):
+    """ the classifier before the single pass one: bs4 text, then text.count per alias """
+    from bs4 import BeautifulSoup
+    text = BeautifulSoup(html, 'html.parser').get_text(separator=' ', strip=True).lower()
+    confidences = {}
+    for section in SECTIONS:
+        counts = {}
+        for names in config.get_model_aliases(section):
+            word_counts = {alias.lower(): text.count(alias.lower()) for alias in names}
+            counts[names[0]] = sum(word_counts.values())
+        total = sum(counts.values())
+        confidences[section] = {name: count / total if total > 0 else 0 for name, count in counts.items()}
+    return confidences
+
+
+def test_matches_the_old_classifier_on_a_model_page():
+    pytest.importorskip('bs4')
+    html = read_fixture('hf_model_page.html')
+    expected = old_confidences(html)
+    result = classify_html(html, early_stop=False)
+    for section in SECTIONS:
+        assert result[section] == pytest.approx(expected[section], abs=1e-3)
+
+def test_early_stop_picks_the_same_leaders():
+    html = read_fixture('hf_model_page.html')
+    full = classify_html(html, early_stop=False)
+    early = classify_html(html)
+    for section in SECTIONS:
+        assert max(early[section], key=early[section].get) == max(full[section], key=full[section].get)
+
+def test_script_and_style_contents_are_not_counted():
+    html = ("<html><head><style>.sdxl { color: red }</style>"
+            "<script>var related = ['sdxl', 'sdxl', 'controlnet'];</script></head>"
+            "<body><p>a flux lora</p><script type='application/json'>{\"tags\": [\"sdxl\"]}</script></body></html>")
+    text = ''.join(iter_html_text(html))
+    assert 'sdxl' not in text
+    assert 'flux lora' in text
+    result = classify_html(html, early_stop=False)
+    assert result['model_base_names']['flux1'] == 1.0
@@ -0,0 +1,40 @@
+import os
+import json
+import pytest
+from src.utils import metadata
+from src.utils.metadata import classify_huggingface_repo_info
+
+FIXTURES_DIR = os.path.join(os.path.dirname(os.path.abspath(__file__)), 'fixtures', 'hf_api')
+
+## recorded /api/models/<repo> responses, the file name is the repo id with '/' -> '__'
+CASES = [
+    ('XLabs-AI/flux-RealismLora', 'lora.safetensors', ('loras', 'flux1')),
+    ('stabilityai/sdxl-vae', 'sdxl_vae.safetensors', ('vae', 'sdxl')),
+    ('diffusers/controlnet-canny-sdxl-1.0', 'diffusion_pytorch_model.safetensors', ('controlnet', 'sdxl')),
+    ('runwayml/stable-diffusion-v1-5', 'v1-5-pruned-emaonly.safetensors', ('checkpoints', 'sd15')),
+]
+
+
+def read_repo_info(repo_id):
+    with open(os.path.join(FIXTURES_DIR, f"{repo_id.replace('/', '__')}.json"), 'r', encoding='utf-8') as f:
+        return json.load(f)
+
+
+@pytest.mark.parametrize('repo_id, path_in_repo, expected', CASES)
+def test_classifies_recorded_repo_info(repo_id, path_in_repo, expected):
+    assert classify_huggingface_repo_info(read_repo_info(repo_id), path_in_repo) == expected
+
+@pytest.mark.parametrize('repo_id, path_in_repo, expected', CASES)
+def test_model_info_needs_no_network(monkeypatch, repo_id, path_in_repo, expected):
+    fetched = []
+    def fetch_repo_info(fetched_repo_id):
+        fetched.append(fetched_repo_id)
+        return read_repo_info(fetched_repo_id)
+    def no_webpage(*args, **kwargs):
+        raise AssertionError('the model card should not be needed')
+    monkeypatch.setattr(metadata, 'fetch_huggingface_repo_info', fetch_repo_info)
+    monkeypatch.setattr(metadata, 'distill_model_metadata_from_webpage', no_webpage)
+
+    url = f"https://huggingface.co/{repo_id}/resolve/main/{path_in_repo}"
+    assert metadata.get_huggingface_model_info(url) == expected
+    assert fetched == [repo_id]
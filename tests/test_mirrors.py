@@ -0,0 +1,37 @@
+import os
+from src.utils import blobs
+from src.utils.mirrors import copy_file
+
+
+def test_plain_files_are_hardlinked(tmp_path, monkeypatch):
+    monkeypatch.setattr(blobs, 'is_blob_store_enabled', lambda: False)
+    source = tmp_path / 'mirror' / 'loras' / 'sdxl' / 'a.safetensors'
+    source.parent.mkdir(parents=True)
+    source.write_bytes(b'a' * 100)
+    target = tmp_path / 'models' / 'loras' / 'sdxl' / 'a.safetensors'
+    copy_file(str(source), str(target))
+    assert os.stat(target).st_ino == os.stat(source).st_ino
+
+def test_blob_views_of_the_mirror_are_copied(tmp_path, monkeypatch):
+    monkeypatch.setattr(blobs, 'is_blob_store_enabled', lambda: False)
+    blob = tmp_path / 'mirror' / '.blobs' / 'sha256' / 'ab' / 'abcd'
+    blob.parent.mkdir(parents=True)
+    blob.write_bytes(b'a' * 100)
+    view = tmp_path / 'mirror' / 'loras' / 'sdxl' / 'a.safetensors'
+    view.parent.mkdir(parents=True)
+    os.link(blob, view)
+    for i, source in enumerate((blob, view)):
+        target = tmp_path / 'models' / f"{i}.safetensors"
+        copy_file(str(source), str(target))
+        assert os.stat(target).st_nlink == 1
+    ## the mirror can still free its blob once its view is gone
+    assert os.stat(blob).st_nlink == 2
+
+def test_nothing_is_linked_with_our_own_blob_store_on(tmp_path, monkeypatch):
+    monkeypatch.setattr(blobs, 'is_blob_store_enabled', lambda: True)
+    source = tmp_path / 'mirror' / 'a.safetensors'
+    source.parent.mkdir(parents=True)
+    source.write_bytes(b'a' * 100)
+    target = tmp_path / 'models' / 'a.safetensors'
+    copy_file(str(source), str(target))
+    assert os.stat(target).st_ino != os.stat(source).st_ino
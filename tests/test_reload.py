@@ -0,0 +1,32 @@
+import shutil
+from collections import namedtuple
+import pytest
+from src.cmds.reload import DiskAdmission
+from src.utils import pool
+from src.utils.pool import (DownloadTask,
+                            run_download_tasks)
+
+DiskUsage = namedtuple('DiskUsage', ('total', 'used', 'free'))
+
+
+def test_admission_does_not_count_written_bytes_twice(monkeypatch):
+    disk = {'free': 1000}
+    monkeypatch.setattr(shutil, 'disk_usage', lambda path: DiskUsage(2000, 2000 - disk['free'], disk['free']))
+    admission = DiskAdmission('/models', min_free=100)
+    admission.admit(400)
+    ## the first download is half way, the disk already lost those bytes
+    disk['free'] -= 200
+    admission.admit(400)
+    with pytest.raises(RuntimeError):
+        admission.admit(200)
+    ## a failed download gives its room back
+    admission.release(400)
+    admission.admit(200)
+
+def test_reload_starts_downloads_in_priority_order(monkeypatch):
+    monkeypatch.setattr(pool, 'record_throughput', lambda results, elapsed: None)
+    started = []
+    urls = ['https://huggingface.co/a', 'https://huggingface.co/b', 'https://civitai.com/c', 'https://huggingface.co/d']
+    tasks = [DownloadTask(url, url, lambda url=url: started.append(url)) for url in urls]
+    run_download_tasks(tasks, jobs=1, interleave=False)
+    assert started == urls
@@ -0,0 +1,28 @@
+import pytest
+from src.cmds.serve import parse_range_header
+
+
+@pytest.mark.parametrize('range_header, size, expected', [
+    (None, 100, None),
+    ('', 100, None),
+    ('bytes=0-9', 100, (0, 9)),
+    ('bytes=10-', 100, (10, 99)),
+    ('bytes=90-199', 100, (90, 99)),
+    ('bytes=-10', 100, (90, 99)),
+    ('bytes=-200', 100, (0, 99)),
+    (' bytes=5-5 ', 100, (5, 5)),
+    ## unsatisfiable, answered with a 416
+    ('bytes=100-', 100, False),
+    ('bytes=100-200', 100, False),
+    ('bytes=-0', 100, False),
+    ('bytes=-5', 0, False),
+    ('bytes=0-', 0, False),
+    ## invalid or not supported, ignored: the whole file with a 200
+    ('bytes=5-2', 100, None),
+    ('bytes=-', 100, None),
+    ('bytes=0-1,5-6', 100, None),
+    ('items=0-9', 100, None),
+    ('bytes=a-b', 100, None),
+])
+def test_parse_range_header(range_header, size, expected):
+    assert parse_range_header(range_header, size) == expected
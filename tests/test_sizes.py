@@ -0,0 +1,58 @@
+import os
+from src.utils.collection import Collection
+from src.utils import sizes as sizes_module
+from src.utils.sizes import (get_entry_sizes,
+                             get_size_breakdowns)
+
+
+def make_store(tmp_path, monkeypatch):
+    storage_dir = tmp_path / 'models'
+    monkeypatch.setenv('MODEL_STORAGE_DIR', str(storage_dir))
+    monkeypatch.setenv('COZY_DATA_DIR', str(tmp_path / 'data'))
+    for rel_dir in ('loras/sdxl', 'checkpoints/sdxl', 'loras/flux1/civ'):
+        (storage_dir / rel_dir).mkdir(parents=True)
+    (storage_dir / 'loras/sdxl/a.safetensors').write_bytes(b'a' * 3000)
+    ## a second view of the same bytes, as the blob store links them
+    os.link(storage_dir / 'loras/sdxl/a.safetensors', storage_dir / 'checkpoints/sdxl/a.safetensors')
+    (storage_dir / 'loras/flux1/civ/x.bin').write_bytes(b'x' * 1000)
+    return Collection.from_dict({
+        '1': {'url': 'https://h/a', 'local_filename': 'a.safetensors', 'model_type': 'loras', 'model_base': 'sdxl', 'tags': ['t']},
+        '2': {'url': 'https://h/b', 'local_filename': 'a.safetensors', 'model_type': 'checkpoints', 'model_base': 'sdxl', 'tags': ['t']},
+        '3': {'url': 'https://h/c', 'local_filename': 'civ/', 'model_type': 'loras', 'model_base': 'flux1', 'tags': []},
+        '4': {'url': 'https://h/d', 'local_filename': 'gone.bin', 'model_type': 'loras', 'model_base': 'sdxl', 'file_size_mb': 1},
+    })
+
+
+def test_entry_sizes(tmp_path, monkeypatch):
+    collection = make_store(tmp_path, monkeypatch)
+    sizes = {size.entry.id: size for size in get_entry_sizes(collection)}
+    assert [sizes[id].num_bytes for id in '1234'] == [3000, 3000, 1000, 0]
+    assert [sizes[id].is_local for id in '1234'] == [True, True, True, False]
+    assert sizes['1'].file_id == sizes['2'].file_id
+
+def test_hardlinked_views_are_counted_once(tmp_path, monkeypatch):
+    collection = make_store(tmp_path, monkeypatch)
+    breakdowns, status = get_size_breakdowns(get_entry_sizes(collection))
+    assert status['loaded'] == [3, 4000]
+    assert status['unloaded'] == [1, 1024 * 1024]
+    assert breakdowns['model_type'] == {'loras': 4000, 'checkpoints': 3000}
+    assert breakdowns['model_base'] == {'sdxl': 3000, 'flux1': 1000}
+    assert breakdowns['tag'] == {'t': 3000}
+
+def test_a_file_rewritten_in_a_cached_directory_is_measured_again(tmp_path, monkeypatch):
+    collection = make_store(tmp_path, monkeypatch)
+    get_entry_sizes(collection)
+    assert (tmp_path / 'data' / 'sizes.json').exists()
+    ## same name, the directory mtimes don't change
+    filepath = tmp_path / 'models/loras/flux1/civ/x.bin'
+    with open(filepath, 'ab') as f:
+        f.write(b'x' * 500)
+    os.utime(filepath, (0, 12345))
+    sizes = {size.entry.id: size for size in get_entry_sizes(collection)}
+    assert sizes['3'].num_bytes == 1500
+
+def test_the_size_cache_can_be_turned_off(tmp_path, monkeypatch):
+    collection = make_store(tmp_path, monkeypatch)
+    monkeypatch.setattr(sizes_module, 'is_size_cache_enabled', lambda: False)
+    get_entry_sizes(collection)
+    assert not (tmp_path / 'data').exists()
@@ -0,0 +1,61 @@
+import os
+import sys
+import json
+import subprocess
+
+REPO_DIR = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+
+## the dependencies only the downloading commands need, `cozy list` must never pay for them
+HEAVY_MODULES = ('requests', 'huggingface_hub', 'bs4')
+## dispatch + running `cozy list` on a small collection, the interpreter start itself not included.
+## it takes ~30ms on a laptop, the budget leaves room for slow CI machines
+STARTUP_BUDGET_SECONDS = 0.5
+
+## runs the cli in a fresh interpreter and reports what it imported and how long it took
+PROBE = """
+import sys, time, json
+start = time.perf_counter()
+sys.argv = ['cozy', 'list']
+import run
+run.main()
+elapsed = time.perf_counter() - start
+print(json.dumps({'elapsed': elapsed, 'modules': sorted(sys.modules)}))
+"""
+
+
+def run_cozy_list(tmp_path):
+    storage_dir = tmp_path / 'models'
+    storage_dir.mkdir()
+    db_path = tmp_path / 'collection.json'
+    db_path.write_text(json.dumps({
+        '1': {'url': 'https://huggingface.co/a/b/resolve/main/x.safetensors',
+              'local_filename': 'x.safetensors', 'model_type': 'loras', 'model_base': 'sdxl', 'tags': []},
+    }))
+    env = dict(os.environ,
+               PYTHONPATH=REPO_DIR,
+               MODEL_STORAGE_DIR=str(storage_dir),
+               MODEL_INFO_FILE=str(db_path),
+               COZY_DATA_DIR=str(tmp_path / 'data'),
+               HF_TOKEN='test',
+               CIVITAI_API_KEY='test')
+    result = subprocess.run([sys.executable, '-c', PROBE], cwd=tmp_path, env=env,
+                            capture_output=True, text=True, timeout=60)
+    assert result.returncode == 0, result.stderr
+    return json.loads(result.stdout.strip().splitlines()[-1])
+
+
+def test_list_does_not_import_heavy_dependencies(tmp_path):
+    report = run_cozy_list(tmp_path)
+    imported = [name for name in HEAVY_MODULES if name in report['modules']]
+    assert imported == []
+
+
+def test_list_starts_within_budget(tmp_path):
+    ## best of a few runs, a single cold run can hit a busy disk
+    timings = []
+    for i in range(3):
+        run_dir = tmp_path / str(i)
+        run_dir.mkdir()
+        timings.append(run_cozy_list(run_dir)['elapsed'])
+    elapsed = min(timings)
+    assert elapsed < STARTUP_BUDGET_SECONDS, f"cozy list took {elapsed * 1000:.0f}ms"
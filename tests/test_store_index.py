@@ -0,0 +1,30 @@
+import pytest
+from src.utils.store_index import (INDEX_VERSION,
+                                   load_store_index,
+                                   get_safe_rel_path)
+
+
+@pytest.mark.parametrize('rel_path, expected', [
+    ('loras/sdxl/a.safetensors', 'loras/sdxl/a.safetensors'),
+    ('loras/./sdxl//a.safetensors', 'loras/sdxl/a.safetensors'),
+    ('loras/x/../sdxl/a.safetensors', 'loras/sdxl/a.safetensors'),
+    ('/etc/passwd', None),
+    ('../outside', None),
+    ('loras/../../outside', None),
+    ('.blobs/sha256/ab/abcd', None),
+    ('.', None),
+    ('', None),
+    (None, None),
+])
+def test_safe_rel_path(rel_path, expected):
+    assert get_safe_rel_path(rel_path) == expected
+
+def test_index_entries_that_escape_the_store_are_dropped():
+    index = load_store_index({'version': INDEX_VERSION, 'entries': [
+        {'key': 'a', 'path': 'loras/sdxl/a.safetensors'},
+        {'key': 'b', 'path': '../../home/user/.ssh/authorized_keys'},
+        {'key': 'c', 'path': 'loras/flux1/civ', 'files': [['x.bin', 1], ['../../../etc/cron.d/x', 1]]},
+        {'key': 'd', 'path': 'loras/flux1/ok', 'files': [['sub/./y.bin', 1]]},
+    ]})
+    assert [index_entry['key'] for index_entry in index.entries] == ['a', 'd']
+    assert index.by_key['d']['files'] == [['sub/y.bin', 1]]
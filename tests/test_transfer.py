@@ -0,0 +1,77 @@
+import os
+import hashlib
+import threading
+from http.server import ThreadingHTTPServer
+import pytest
+from src.cmds import serve
+from src.cmds.serve import StoreRequestHandler
+from src.utils import transfer
+from src.utils.transfer import (SEGMENTS_SUFFIX,
+                                segmented_download,
+                                write_segment_state,
+                                preallocate_file)
+
+SEGMENT_SIZE = 64 * 1024
+DATA = os.urandom(10 * SEGMENT_SIZE + 123)
+
+
+class StaticIndex:
+    def get(self):
+        return b'', {'big.bin'}
+
+
+@pytest.fixture
+def file_url(tmp_path, monkeypatch):
+    served_dir = tmp_path / 'served'
+    served_dir.mkdir()
+    (served_dir / 'big.bin').write_bytes(DATA)
+    monkeypatch.setattr(serve, 'storage_root_dir', str(served_dir))
+    handler = type('TestHandler', (StoreRequestHandler,), {'index_cache': StaticIndex(),
+                                                          'log_message': lambda self, *args: None})
+    server = ThreadingHTTPServer(('127.0.0.1', 0), handler)
+    server.daemon_threads = True
+    thread = threading.Thread(target=server.serve_forever, daemon=True)
+    thread.start()
+    yield f"http://127.0.0.1:{server.server_address[1]}/files/big.bin"
+    server.shutdown()
+    server.server_close()
+
+def count_reread_bytes(monkeypatch):
+    reread = []
+    hash_file_range = transfer.hash_file_range
+    def counting(fd, offset, length, hasher):
+        reread.append(length)
+        hash_file_range(fd, offset, length, hasher)
+    monkeypatch.setattr(transfer, 'hash_file_range', counting)
+    return reread
+
+
+@pytest.mark.parametrize('connections', [1, 4])
+def test_segmented_download_hashes_the_whole_file(tmp_path, file_url, connections):
+    target = tmp_path / 'models' / 'big.bin'
+    target.parent.mkdir()
+    result = segmented_download(file_url, str(target), len(DATA), connections=connections,
+                                segment_size=SEGMENT_SIZE, progress=False)
+    assert target.read_bytes() == DATA
+    assert result.sha256 == hashlib.sha256(DATA).hexdigest()
+
+def test_segments_in_order_are_hashed_from_the_stream(tmp_path, file_url, monkeypatch):
+    reread = count_reread_bytes(monkeypatch)
+    target = tmp_path / 'big.bin'
+    segmented_download(file_url, str(target), len(DATA), connections=1,
+                       segment_size=SEGMENT_SIZE, progress=False)
+    assert sum(reread) == 0
+
+def test_resumed_download_hashes_what_it_already_had(tmp_path, file_url, monkeypatch):
+    target = tmp_path / 'big.bin'
+    part_path = str(target) + '.part'
+    preallocate_file(part_path, len(DATA))
+    with open(part_path, 'r+b') as f:
+        f.write(DATA[:3 * SEGMENT_SIZE])
+    write_segment_state(part_path + SEGMENTS_SUFFIX, len(DATA), SEGMENT_SIZE, {0, 1, 2})
+    reread = count_reread_bytes(monkeypatch)
+    result = segmented_download(file_url, str(target), len(DATA), connections=1,
+                                segment_size=SEGMENT_SIZE, progress=False)
+    assert result.sha256 == hashlib.sha256(DATA).hexdigest()
+    assert sum(reread) == 3 * SEGMENT_SIZE
+    assert not os.path.exists(part_path + SEGMENTS_SUFFIX)